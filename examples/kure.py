@@ -34,7 +34,7 @@ def main(args):
         quality.add_dependencies(done=[trimmer,])
         job_list.append(quality)
 
-    wf = WorkFlow(job_list)
+    wf = WorkFlow(job_list, arrays=args.arrays)
     wf.run() if args.run else wf.show()
 
 if __name__ == "__main__":
@@ -57,6 +57,10 @@ if __name__ == "__main__":
     parser.add_argument('files', 
                         nargs='+', 
                         help='Files to filter.')
+    parser.add_argument('--arrays',
+                        action='store_true',
+                        default=False,
+                        help='Boolean: submit per-file jobs as job arrays.')
     parser.add_argument('--run',
                         action='store_true',
                         default=False,
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 """Example for pipeline on localhost.
 
-Assumes jobs will run serially.
+Jobs run on this host, in parallel where dependencies allow.
 
 """
 # import modules needed to construct jobs
@@ -36,6 +36,7 @@ job3 = CLI(cmd="ls -l")
 
 
 # add jobs to workflow
-wf = WorkFlow([job1, job2, job3], lsf=False)
+wf = WorkFlow([job1, job2, job3], local=True)
 wf.show()
+wf.run()
 
@@ -1,25 +1,12 @@
-"""
+"""tfpipe builds and submits pipelines of command line tools.
+
+tfpipe.modules and tfpipe.pipeline are imported when first used.
 
 """
-import tfpipe.modules.cli
-import tfpipe.modules.fseq
-import tfpipe.modules.gmap
-import tfpipe.modules.mach
-import tfpipe.modules.blast
-import tfpipe.modules.plink
-import tfpipe.modules.qiime
-import tfpipe.modules.bowtie
-import tfpipe.modules.picard
-import tfpipe.modules.tophat
-import tfpipe.modules.dfilter
-import tfpipe.modules.tagdust
-import tfpipe.modules.abundant
-import tfpipe.modules.bedtools
-import tfpipe.modules.bamtools
-import tfpipe.modules.samtools
-import tfpipe.modules.bcl2fastq
-import tfpipe.modules.blacklist
-import tfpipe.modules.cufflinks
-import tfpipe.modules.bcl2fastq2
-import tfpipe.modules.sratoolkit
-import tfpipe.pipeline
+import sys
+from tfpipe.utils import LazyPackage
+
+sys.modules[__name__] = LazyPackage(sys.modules[__name__], {
+    'base': 'tfpipe.base',
+    'modules': 'tfpipe.modules',
+    'pipeline': 'tfpipe.pipeline'})
@@ -1,8 +1,12 @@
 """Base.py holds common functionality for future classes.
 
 """
+import os
+import sys
 import string
 import random
+import threading
+from logging import DEBUG
 
 from tfpipe.utils import logger
 from tfpipe.utils import InvalidInput, InvalidObjectCall, InvalidType
@@ -44,22 +48,101 @@ class Singleton:
     def __instancecheck__(self, inst):
         return isinstance(inst, self._decorated)
 
+def _process_prefix():
+    """Return the job ID prefix of this process.
+
+    Workers started by multiprocessing, or forked, add their process ID.
+
+    """
+    multiprocessing = sys.modules.get('multiprocessing')
+    if (multiprocessing and
+            multiprocessing.current_process().name != 'MainProcess'):
+        return 'JOB%d_' % os.getpid()
+    return 'JOB'
+
+
 @Singleton
 class jobid:
+    """Allocate the job IDs jobs are submitted as, JOB0000, JOB0001 and so on.
+
+    Allocation is thread-safe.  IDs are namespaced per process, so job
+    graphs built in a pool of worker processes can be merged: a worker
+    allocates JOB<pid>_0000 and so on.  set_namespace gives the jobs built
+    next their own prefix, e.g. one per sample.
+
+    """
     def __init__(self):
         self.jobid = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._prefix = _process_prefix()
+
+    def set_namespace(self, namespace=None):
+        """Prefix the following IDs with namespace and count them from zero.
+
+        Without a namespace IDs return to the prefix of the process.
+
+        """
+        if namespace is not None and not (
+                isinstance(namespace, basestring) and
+                namespace.replace('_', '').isalnum()):
+            raise InvalidInput("Job ID namespaces are letters, digits and "
+                               "underscores: %r" % (namespace,))
+        with self._lock:
+            self._pid = os.getpid()
+            self._prefix = ('JOB%s_' % namespace if namespace else
+                            _process_prefix())
+            self.jobid = 0
+
     def getjobid(self):
-        jobstring = "JOB%04d" % self.jobid
-        self.jobid += 1
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked copy of the counter would repeat the parent's IDs
+                self._pid = os.getpid()
+                self._prefix = 'JOB%d_' % self._pid
+                self.jobid = 0
+            jobstring = "%s%04d" % (self._prefix, self.jobid)
+            self.jobid += 1
         return jobstring
 
+# Created up front, as Singleton.Instance is not thread-safe
+jobid.Instance()
+
+
+def set_job_namespace(namespace=None):
+    """Prefix the IDs of jobs created next in this process with namespace.
+
+    """
+    jobid.Instance().set_namespace(namespace)
+
+
 class Job(object):
     """Generic Job Interface functionality. 
 
+    Per-job state lives in slots; module classes override the class level
+    defaults such as _cmd, _module and the resource requests.  Argument and
+    dependency containers are created when first used.
+
     """
+    __slots__ = ('cmd', 'name', '_args', '_pos_args', '_template', '_shared',
+                 '_dep', '_dep_str_lsf', '_dep_str_slurm',
+                 'redirect_output_file', 'append_output_file',
+                 'redirect_error_file', 'input_file', 'output_file',
+                 'error_file', 'queue', 'hoststospan', 'numberofprocesses',
+                 'job_output_file', 'scratch', 'autosize', 'retry_policy',
+                 'time_limit_set', '_jobid')
     dep_options = ('done', 'ended', 'exit', 'external',
                    'post_done', 'post_err', 'started')
     init_options = ('cmd', 'args', 'name', 'module')
+    # Expected wall time in seconds, used to order and pack jobs.
+    # Modules override this with an estimate for the tool.
+    _runtime_estimate = None
+    _memory_req_slurm = None
+    _memory_req_lsf = None
+    _time_str_slurm = '"06:00:00"'
+    # Methods handling the io_flag of arguments
+    _io_flag_handlers = {'input': '_io_flag_input',
+                         'output': '_io_flag_output'}
     def __init__(self, **inputs):
         """Initialize Job.
 
@@ -76,26 +159,20 @@ class Job(object):
                                         message)
         if not hasattr(self, '_cmd'):
             raise InvalidObjectCall, "This object cannot be called directly."
-        if hasattr(self,'_memory_req_slurm'):
-            self._memory_req_slurm = inputs.get('_memory_req_slurm', self._memory_req_slurm)
-        else:
-            self._memory_req_slurm = None
-        if hasattr(self,'_memory_req_lsf'):
-            self._memory_req_lsf = inputs.get('_memory_req_lsf', self._memory_req_lsf)
-        else:
-            self._memory_req_lsf = None
+        # Memory and time requests default to the class attributes
 
         self.cmd = inputs.get('cmd', self._cmd)
-        self.args = inputs.get('args', {}) 
-        self.pos_args = inputs.get('pos_args', [])
+        self._args = inputs.get('args')
+        self._pos_args = inputs.get('pos_args')
+        self._template = None
+        self._shared = None
         self.name = self._initialize_name(inputs)
 
         # These store values in the string form of the job control system in question
         self._dep_str_lsf = None
         self._dep_str_slurm = None
-        self._time_str_slurm = '"06:00:00"'
         # TODO REFACTOR - This is old code when you could pass dependencies at initialization.
-        self.dep = {}
+        self._dep = None
         self.redirect_output_file = ''
         self.append_output_file = ''
         self.redirect_error_file = ''
@@ -106,9 +183,11 @@ class Job(object):
         self.hoststospan = 1
         self.numberofprocesses = 1
         self.job_output_file = "%s.out" % (self.name)
-        self.io_flag_handler = {'input': self._io_flag_input,
-                                'output': self._io_flag_output,
-                                None: None}
+        self.scratch = None
+        self.autosize = True
+        self.retry_policy = None
+        # Whether time_str_slurm was set for this job, not left to its class
+        self.time_limit_set = False
         jobobj = jobid.Instance()
         self._jobid = jobobj.getjobid()
         #Deal with the memory requirements for seperate job controllers
@@ -117,8 +196,160 @@ class Job(object):
             self._module = inputs.get('module')
         if inputs.get('module_slurm'):
             self._module_slurm = inputs.get('module_slurm')
-        logger.info("%s: initialized with '%s' arguments and command: %s " % 
-                    (self.name, self._parse_args(), self.cmd))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("%s: initialized with '%s' arguments and command: %s ",
+                        self.name, self._parse_args(), self.cmd)
+
+    def __getstate__(self):
+        """Return the slots and instance attributes to pickle.
+
+        Slots are collected from every class of the job, so the argument
+        and dependency containers go with them, shared or not yet created.
+
+        """
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            for slot in slots:
+                if slot not in ('__dict__', '__weakref__') and \
+                        hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        """Restore the attributes returned by __getstate__.
+
+        """
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+    @property
+    def args(self):
+        """Keyword arguments, mapping flags to values.
+
+        Reading them here gives a cloned job its own copy of the arguments
+        it shares with its template.
+
+        """
+        self._own_arguments()
+        if self._args is None:
+            self._args = {}
+        return self._args
+
+    @args.setter
+    def args(self, value):
+        self._own_arguments()
+        self._args = value
+
+    @property
+    def pos_args(self):
+        """Positional arguments, in order.
+
+        """
+        self._own_arguments()
+        if self._pos_args is None:
+            self._pos_args = []
+        return self._pos_args
+
+    @pos_args.setter
+    def pos_args(self, value):
+        self._own_arguments()
+        self._pos_args = value
+
+    @property
+    def dep(self):
+        """Dependencies, mapping conditions to lists of jobs.
+
+        """
+        if self._dep is None:
+            self._dep = {}
+        return self._dep
+
+    @dep.setter
+    def dep(self, value):
+        self._dep = value
+
+    @property
+    def io_flag_handler(self):
+        """Map io_flag values to the methods handling them.
+
+        """
+        handlers = dict((flag, getattr(self, method))
+                        for flag, method in self._io_flag_handlers.items())
+        handlers[None] = None
+        return handlers
+
+    def _io_handler(self, io_flag):
+        """Return the method handling io_flag, or None.
+
+        """
+        method = self._io_flag_handlers.get(io_flag)
+        return getattr(self, method) if method else None
+
+    def _own_arguments(self):
+        """Stop sharing arguments with a template and clones.
+
+        Called before the arguments may be changed in place.
+
+        """
+        self._shared = None
+        if self._template is not None:
+            args, pos_args = self._template
+            self._template = None
+            own = dict(args)
+            own.update(self._args or {})
+            self._args = own
+            self._pos_args = list(pos_args) + (self._pos_args or [])
+
+    def _arg_items(self):
+        """Return the keyword argument items without copying shared ones.
+
+        """
+        if self._template is None:
+            return (self._args or {}).items()
+        args = dict(self._template[0])
+        args.update(self._args or {})
+        return args.items()
+
+    def _positional(self):
+        """Return the positional arguments without copying shared ones.
+
+        """
+        own = self._pos_args or []
+        if self._template is None:
+            return own
+        return list(self._template[1]) + own
+
+    def clone(self, name=None):
+        """Return a job of the same class sharing this job's arguments.
+
+        The arguments are shared copy-on-write between the job and all of
+        its clones: arguments added to a clone are kept with the clone only.
+        Thousands of per-sample jobs then store only what differs between
+        them.  Files, resource requests and settings are copied;
+        dependencies are not.
+
+        """
+        if self._shared is None:
+            self._shared = (dict(self._arg_items()), tuple(self._positional()))
+        inputs = {'cmd': self.cmd}
+        if name:
+            inputs['name'] = name
+        job = type(self)(**inputs)
+        job._template = self._shared
+        for attr in ('redirect_output_file', 'append_output_file',
+                     'redirect_error_file', 'input_file', 'output_file',
+                     'error_file', 'queue', 'hoststospan',
+                     'numberofprocesses', 'scratch', 'autosize',
+                     'retry_policy', 'time_limit_set'):
+            setattr(job, attr, getattr(self, attr))
+        # Per-job overrides of class attributes, such as memory requests
+        for attr, value in getattr(self, '__dict__', {}).items():
+            setattr(job, attr, value)
+        return job
+
     @property
     def module(self):
         return self._module
@@ -176,7 +407,14 @@ class Job(object):
     @time_str_slurm.setter
     def time_str_slurm(self, value):
         self._time_str_slurm = value
+        self.time_limit_set = True
 
+    @property
+    def runtime_estimate(self):
+        return self._runtime_estimate
+    @runtime_estimate.setter
+    def runtime_estimate(self, value):
+        self._runtime_estimate = value
 
 
     def __repr__(self):
@@ -212,8 +450,9 @@ class Job(object):
         """Parse arguments and positional arguments.
 
         """
-        kw = " ".join("%s %s" % (str(k), str(v)) for k,v in self.args.items())
-        pos = " ".join(self.pos_args) if self.pos_args else ''
+        kw = " ".join("%s %s" % (str(k), str(v)) for k,v in self._arg_items())
+        pos_args = self._positional()
+        pos = " ".join(pos_args) if pos_args else ''
         return " ".join([kw, pos])
                          
     def _initialize_name(self, inputs):
@@ -274,16 +513,16 @@ class Job(object):
 
         """
         self.input_file = value
-        logger.info("%s: input_file attribute '%s' set for %s" % 
-                    (self.name, value, self.cmd))
+        logger.debug("%s: input_file attribute '%s' set for %s",
+                     self.name, value, self.cmd)
         
     def _io_flag_output(self, value):
         """Set output_file attribute.
 
         """
         self.output_file = value
-        logger.info("%s: output_file attribute '%s' set for %s" % 
-                    (self.name, value, self.cmd))
+        logger.debug("%s: output_file attribute '%s' set for %s",
+                     self.name, value, self.cmd)
         
     def add_argument(self, arg, value=None, io_flag=None):
         """Method adds command line arguments to object.
@@ -293,23 +532,31 @@ class Job(object):
         attributes.
         
         """
-        handler = self.io_flag_handler.get(io_flag)
+        handler = self._io_handler(io_flag)
         if handler:
             handler(value)
-        self.args[arg] = True and value or ''
-        logger.info("%s: argument '%s %s' added to %s" % 
-                    (self.name, arg, self.args[arg], self.cmd))
+        value = True and value or ''
+        # Cloned jobs keep their own arguments apart from the shared ones
+        self._shared = None
+        if self._args is None:
+            self._args = {}
+        self._args[arg] = value
+        logger.debug("%s: argument '%s %s' added to %s",
+                     self.name, arg, value, self.cmd)
 
     def add_positional_argument(self, arg, io_flag=None):
         """Method adds positional arguments to object.
 
         """
-        handler = self.io_flag_handler.get(io_flag)
+        handler = self._io_handler(io_flag)
         if handler:
             handler(arg)
-        self.pos_args.append(arg)
-        logger.info("%s: argument '%s' added to %s" %
-                    (self.name, arg, self.cmd))
+        self._shared = None
+        if self._pos_args is None:
+            self._pos_args = []
+        self._pos_args.append(arg)
+        logger.debug("%s: argument '%s' added to %s",
+                     self.name, arg, self.cmd)
 
     def add_jobname(self, jobname):
         """Add name to current job.
@@ -317,8 +564,7 @@ class Job(object):
         """
         tmp = self.name
         self.name = str(jobname)
-        logger.info("%s: replacing jobname with '%s'" %
-                    (tmp, self.name))
+        logger.debug("%s: replacing jobname with '%s'", tmp, self.name)
 
     # make it so list does not have to be specified
     def add_dependencies(self, **kwargs):
@@ -339,10 +585,7 @@ class Job(object):
                                         message)
         for key, value in kwargs.iteritems():
             if isinstance(value, list):
-                try:
-                    self.dep[key] += list(value)
-                except KeyError:
-                    self.dep[key] = list(value)
+                self.dep.setdefault(key, []).extend(value)
             else:
                 raise InvalidInput, "Operand of dependency must be of type list."
 
@@ -375,12 +618,12 @@ class Job(object):
             error = "Cannot redirect and append output"
             logger.error(error)
             exit(error)
-        handler = self.io_flag_handler.get(io_flag)
+        handler = self._io_handler(io_flag)
         if handler:
             handler(outputfile)
         self.redirect_output_file = outputfile
-        logger.info("%s: output_file attribute '%s' set for %s" % 
-                    (self.name, self.output_file, self.cmd))
+        logger.debug("%s: output_file attribute '%s' set for %s",
+                     self.name, self.output_file, self.cmd)
 
     def append_output(self, outputfile, io_flag=None):
         """Method to append output in the Unix sense.
@@ -392,12 +635,12 @@ class Job(object):
             error = "Cannot redirect and append output"
             logger.error(error)
             exit(error)
-        handler = self.io_flag_handler.get(io_flag)
+        handler = self._io_handler(io_flag)
         if handler:
             handler(outputfile)
         self.append_output_file = outputfile
-        logger.info("%s: output_file attribute '%s' set for %s" % 
-                    (self.name, self.output_file, self.cmd))
+        logger.debug("%s: output_file attribute '%s' set for %s",
+                     self.name, self.output_file, self.cmd)
 
     def redirect_error(self, errorfile, io_flag=None):
         """Method to redirect error in the Unix sense.
@@ -405,12 +648,40 @@ class Job(object):
         Has ability to set error file as file to be referenced.
 
         """
-        handler = self.io_flag_handler.get(io_flag)
+        handler = self._io_handler(io_flag)
         if handler:
             handler(errorfile)
         self.redirect_error_file = errorfile
-        logger.info("%s: error_file attribute '%s' set for %s" % 
-                    (self.name, self.error_file, self.cmd))
+        logger.debug("%s: error_file attribute '%s' set for %s",
+                     self.name, self.error_file, self.cmd)
+
+    def use_scratch(self, directory='${TMPDIR:-/tmp}', decompress=False,
+                    inputs=(), outputs=()):
+        """Run the job on node-local scratch space.
+
+        input_file and output_file, plus any extra inputs and outputs, are
+        copied to a new directory under directory before the job runs and
+        copied back once it succeeds.  With decompress, .gz and .bz2 inputs
+        are decompressed while they are copied.
+
+        """
+        self.scratch = {'directory': directory, 'decompress': decompress,
+                        'inputs': list(inputs), 'outputs': list(outputs)}
+        logger.debug("%s: staged on scratch space %s", self.name, directory)
+
+    def add_retry(self, max_attempts=3, memory_factor=2.0, time_factor=2.0):
+        """Retry the job when it is killed for its memory or time limit.
+
+        The job runs at most max_attempts times; each retry multiplies the
+        limit that was hit by memory_factor or time_factor.  Failures that
+        are not caused by a limit are not retried.
+
+        """
+        self.retry_policy = {'max_attempts': max_attempts,
+                             'memory_factor': memory_factor,
+                             'time_factor': time_factor}
+        logger.debug("%s: retried up to %d times on memory or time limits",
+                     self.name, max_attempts)
 
     def set_output_file(self, value):
         """Set output_file attribute.
@@ -1 +1,119 @@
-""" """
+"""Tool modules.
+
+Tool packages and classes are imported when first used, so importing
+tfpipe.modules does not import every tool:
+
+    >>> import tfpipe.modules
+    >>> tfpipe.modules.samtools.Sort
+    >>> tfpipe.modules.Sort
+
+TOOLS maps each tool class name to its package, and get_tool looks a tool
+up by name, as given in a configuration file.
+
+"""
+import sys
+from importlib import import_module
+from tfpipe.utils import InvalidInput, LazyPackage
+
+TOOLS = {
+    'AbundantOTU': 'abundant',
+    'BamFilter': 'bamtools',
+    'Bcl2Fastq': 'bcl2fastq',
+    'ConfigureBcl2Fastq': 'bcl2fastq',
+    'Bcl2Fastq2': 'bcl2fastq2',
+    'BamToBed': 'bedtools',
+    'BedToBam': 'bedtools',
+    'Intersect': 'bedtools',
+    'MergeBed': 'bedtools',
+    'SortBed': 'bedtools',
+    'BFilter': 'blacklist',
+    'BlastDBAliasTool': 'blast',
+    'BlastDBCMD': 'blast',
+    'BlastDBCheck': 'blast',
+    'BlastDBCp': 'blast',
+    'BlastFormatter': 'blast',
+    'BlastN': 'blast',
+    'BlastP': 'blast',
+    'BlastX': 'blast',
+    'BowTie': 'bowtie',
+    'BowTieAlignL': 'bowtie',
+    'BowTieAlignS': 'bowtie',
+    'BowTieBuild': 'bowtie',
+    'BowTieBuildL': 'bowtie',
+    'BowTieBuildS': 'bowtie',
+    'BowTieInspect': 'bowtie',
+    'BowTieInspectL': 'bowtie',
+    'BowTieInspectS': 'bowtie',
+    'CLI': 'cli',
+    'Gunzip': 'cli',
+    'Tar': 'cli',
+    'CuffCompare': 'cufflinks',
+    'CuffDiff': 'cufflinks',
+    'CuffLinks': 'cufflinks',
+    'CuffMerge': 'cufflinks',
+    'Cutadapt': 'cutadapt',
+    'DFilter': 'dfilter',
+    'Fastqc': 'fastqc',
+    'FastqQualityFilter': 'fastx_toolkit',
+    'FastqToFasta': 'fastx_toolkit',
+    'FastxClipper': 'fastx_toolkit',
+    'FastxTrimmer': 'fastx_toolkit',
+    'Fseq': 'fseq',
+    'FseqJava': 'fseq',
+    'Gsnap': 'gmap',
+    'Mach1': 'mach',
+    'MachAdmix': 'mach',
+    'MarkDuplicates': 'picard',
+    'MarkDuplicatesSLURM': 'picard',
+    'MergeSamFiles': 'picard',
+    'MergeSamFilesSLURM': 'picard',
+    'SortSamFiles': 'picard',
+    'SortSamFilesSLURM': 'picard',
+    'Plink': 'plink',
+    'Python': 'python',
+    'ConvertFastaQualFastq': 'qiime',
+    'JoinPairedEnds': 'qiime',
+    'Rsem_calculate_expression': 'rsem',
+    'FixMate': 'samtools',
+    'Index': 'samtools',
+    'Merge': 'samtools',
+    'Sort': 'samtools',
+    'View': 'samtools',
+    'BamLoad': 'sratoolkit',
+    'BamLoad2': 'sratoolkit',
+    'BamLoad232': 'sratoolkit',
+    'FastQDump': 'sratoolkit',
+    'FastQDump2': 'sratoolkit',
+    'FastQDump232': 'sratoolkit',
+    'FastQLoad': 'sratoolkit',
+    'FastQLoad2': 'sratoolkit',
+    'FastQLoad232': 'sratoolkit',
+    'Star': 'star',
+    'TagDust': 'tagdust',
+    'TopHat': 'tophat',
+    'TopHat2': 'tophat',
+    'TopHatFusionPost': 'tophat',
+    'TopHatReports': 'tophat'}
+
+PACKAGES = sorted(set(TOOLS.values()))
+
+
+def get_tool(name):
+    """Return the tool class called name, e.g. 'Sort' or 'samtools.Sort'.
+
+    """
+    package, _, tool = name.rpartition('.')
+    package = package or TOOLS.get(tool)
+    if package:
+        try:
+            return getattr(import_module('tfpipe.modules.' + package), tool)
+        except (ImportError, AttributeError):
+            pass
+    raise InvalidInput("Unknown tool: %s" % name)
+
+
+_attributes = dict((package, 'tfpipe.modules.' + package)
+                   for package in PACKAGES)
+_attributes.update((tool, ('tfpipe.modules.' + package, tool))
+                   for tool, package in TOOLS.items())
+sys.modules[__name__] = LazyPackage(sys.modules[__name__], _attributes)
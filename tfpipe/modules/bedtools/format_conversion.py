@@ -13,6 +13,7 @@ class BamToBed(BedTools):
 
     """
     _cmd = 'bedtools bamtobed '
+    _stdin = '-'
 
 
 class BedToBam(BedTools):
@@ -48,6 +48,7 @@ class BlastN(BlastMod):
 
     """
     _cmd = 'blastn'
+    _runtime_estimate = 8 * 60 * 60
 
     
 class BlastP(BlastMod):
@@ -55,6 +56,7 @@ class BlastP(BlastMod):
 
     """
     _cmd = 'blastp'
+    _runtime_estimate = 8 * 60 * 60
 
 
 class BlastX(BlastMod):
@@ -62,5 +64,6 @@ class BlastX(BlastMod):
 
     """
     _cmd = 'blastx'
+    _runtime_estimate = 8 * 60 * 60
 
 
@@ -13,6 +13,7 @@ class BowTie(BowTieMod):
 
     """
     _cmd = 'bowtie'
+    _runtime_estimate = 3 * 60 * 60
 
 
 class BowTieAlignL(BowTieMod):
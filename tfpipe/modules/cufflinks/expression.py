@@ -20,6 +20,7 @@ class CuffDiff(CuffLinksModule):
 
     """
     _cmd = 'cuffdiff'
+    _runtime_estimate = 4 * 60 * 60
 
 
 class CuffLinks(CuffLinksModule):
@@ -27,6 +28,7 @@ class CuffLinks(CuffLinksModule):
 
     """
     _cmd = 'cufflinks'
+    _runtime_estimate = 3 * 60 * 60
 
 
 class CuffMerge(CuffLinksModule):
@@ -13,3 +13,5 @@ class Cutadapt(Cutadaptmod):
 
     """
     _cmd = 'cutadapt'
+    _stdin = '-'
+    _stdout = 'drop'
@@ -14,4 +14,5 @@ class Fastqc(FastQCMod):
 
     """
     _cmd = 'fastqc'
+    _runtime_estimate = 15 * 60
 
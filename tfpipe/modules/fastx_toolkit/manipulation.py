@@ -7,6 +7,9 @@ class FastXToolkit(Job):
     """
     _module = 'fastx_toolkit/0.0.13.2'
     _module_slurm = 'fastx_toolkit'
+    # -i and -o default to stdin and stdout.
+    _stdin = 'drop'
+    _stdout = 'drop'
 
 
 class FastqToFasta(FastXToolkit):
@@ -14,6 +17,7 @@ class FastqToFasta(FastXToolkit):
 
     """
     _cmd = 'fastq_to_fasta'
+    _runtime_estimate = 20 * 60
 
 
 class FastxClipper(FastXToolkit):
@@ -21,6 +25,7 @@ class FastxClipper(FastXToolkit):
 
     """
     _cmd = 'fastx_clipper'
+    _runtime_estimate = 20 * 60
 
     def __str__(self):
         """Represent object as string.
@@ -69,6 +74,7 @@ class FastqQualityFilter(FastXToolkit):
 
     """
     _cmd = 'fastq_quality_filter'
+    _runtime_estimate = 20 * 60
 
 
 class FastxTrimmer(FastXToolkit):
@@ -76,5 +82,6 @@ class FastxTrimmer(FastXToolkit):
 
     """
     _cmd = 'fastx_trimmer'
+    _runtime_estimate = 20 * 60
 
 
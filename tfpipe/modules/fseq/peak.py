@@ -7,16 +7,27 @@ class Fseq(Job):
     """
     _module = 'fseq/1.84'
     _cmd = 'fseq'
+    _runtime_estimate = 2 * 60 * 60
 
     # We are defaulting the memory here to 48 megs.
     # This command is killdevil LSF ONLY!
     _memory_req_lsf = "48"
 
+    # Region sharding, see tfpipe.pipeline.regions
+    _region_input = 'bed'
+    _region_pad = 5000
+    _region_sort = '-k1,1V -k2,2n'
+
 class FseqJava(Job):
     """
 
     """
     _cmd = 'java -Xmx8000M -cp /proj/fureylab/code_repository/paulcotn/fseq/commons-cli-1.1.jar:/proj/fureylab/code_repository/paulcotn/fseq/fseq.jar edu.duke.igsp.gkde.Main '
+    _runtime_estimate = 2 * 60 * 60
 
     # This commmand is SLURM only
-    _memory_req_slurm = "100G"
\ No newline at end of file
+    _memory_req_slurm = "100G"
+
+    _region_input = 'bed'
+    _region_pad = 5000
+    _region_sort = '-k1,1V -k2,2n'
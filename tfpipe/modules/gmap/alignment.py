@@ -12,6 +12,7 @@ class Gsnap(Job):
     """
     _module_slurm = 'gmap/2014-12-17'
     _cmd = "gsnap"
+    _runtime_estimate = 4 * 60 * 60
     #We are defaulting the memory here to 48 megs.
     _memory_req_slurm = "200G"
     _memory_req_lsf = "48"
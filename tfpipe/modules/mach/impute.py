@@ -16,6 +16,7 @@ class Mach1(Mach):
 
     """
     _cmd = 'mach1'
+    _runtime_estimate = 12 * 60 * 60
 
 
 class MachAdmix(Job):
@@ -25,3 +26,4 @@ class MachAdmix(Job):
 
     """
     _cmd = 'mach-admix'
+    _runtime_estimate = 12 * 60 * 60
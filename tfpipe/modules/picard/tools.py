@@ -13,6 +13,9 @@ class MarkDuplicates(Picard):
 
     """
     _cmd = 'java -Xmx4g -jar /nas02/apps/picard-2.2.4/picard-tools-2.2.4/picard.jar MarkDuplicates'
+    _runtime_estimate = 2 * 60 * 60
+    # Reads its input twice.
+    _seeks = True
 
 
 class MergeSamFiles(Picard):
@@ -20,6 +23,7 @@ class MergeSamFiles(Picard):
 
     """
     _cmd = 'java -Xmx4g -jar /nas02/apps/picard-2.2.4/picard-tools-2.2.4/picard.jar MergeSamFiles'
+    _runtime_estimate = 2 * 60 * 60
 
 
 class SortSamFiles(Picard):
@@ -27,12 +31,16 @@ class SortSamFiles(Picard):
 
     """
     _cmd = 'java -Xmx4g -jar /nas02/apps/picard-2.2.4/picard-tools-2.2.4/picard.jar SortSam'
+    _runtime_estimate = 2 * 60 * 60
 
 class MarkDuplicatesSLURM(Picard):
     """
 
     """
     _cmd = 'java -Xmx4g -jar /nas/longleaf/apps/picard/2.2.4/picard-tools-2.2.4/picard.jar MarkDuplicates'
+    _runtime_estimate = 2 * 60 * 60
+    # Reads its input twice.
+    _seeks = True
 
 
 class MergeSamFilesSLURM(Picard):
@@ -40,6 +48,7 @@ class MergeSamFilesSLURM(Picard):
 
     """
     _cmd = 'java -Xmx4g -jar /nas/longleaf/apps/picard/2.2.4/picard-tools-2.2.4/picard.jar MergeSamFiles'
+    _runtime_estimate = 2 * 60 * 60
 
 
 class SortSamFilesSLURM(Picard):
@@ -47,3 +56,4 @@ class SortSamFilesSLURM(Picard):
 
     """
     _cmd = 'java -Xmx4g -jar /nas/longleaf/apps/picard/2.2.4/picard-tools-2.2.4/picard.jar SortSam'
+    _runtime_estimate = 2 * 60 * 60
@@ -23,3 +23,10 @@ class Plink(Job):
     """
     _module = 'plink/1.07'
     _cmd = 'plink'
+    _runtime_estimate = 4 * 60 * 60
+
+    # Region sharding, see tfpipe.pipeline.regions
+    _region_args = (('--chr', '{chrom}'), ('--from-kb', '{start_kb}'),
+                    ('--to-kb', '{end_kb}'))
+    _region_header = 1
+    _region_sort = '-k1,1n -k3,3n'
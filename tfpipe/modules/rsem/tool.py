@@ -12,6 +12,7 @@ class Rsem_calculate_expression(Rsemmod):
 
     """
     _cmd = 'rsem-calculate-expression'
+    _runtime_estimate = 3 * 60 * 60
     _memory_req_slurm = "200G"
     _memory_req_lsf = "48"
     _time_str_slurm = '"05:00:00"'
\ No newline at end of file
@@ -1,3 +1,3 @@
 """ """
-from tools import View, Sort, Index, FixMate
+from tools import View, Sort, Index, FixMate, Merge
 
@@ -13,6 +13,9 @@ class View(SamTools):
 
     """
     _cmd = 'samtools view '
+    _runtime_estimate = 30 * 60
+    _stdin = '-'
+    _stdout = 'drop'
 
 
 class Sort(SamTools):
@@ -20,7 +23,10 @@ class Sort(SamTools):
     
     """
     _cmd = 'samtools sort '
+    _runtime_estimate = 2 * 60 * 60
     _memory_req_slurm = "100G"
+    _stdin = '-'
+    _stdout = 'drop'
 
 
 class Index(SamTools):
@@ -28,6 +34,16 @@ class Index(SamTools):
     
     """
     _cmd = 'samtools index '
+    _runtime_estimate = 10 * 60
+    _seeks = True
+
+
+class Merge(SamTools):
+    """
+
+    """
+    _cmd = 'samtools merge'
+    _runtime_estimate = 30 * 60
 
 
 class FixMate(SamTools):
@@ -35,5 +51,7 @@ class FixMate(SamTools):
 
     """
     _cmd = 'samtools fixmate'
+    _stdin = '-'
+    _stdout = '-'
 
 
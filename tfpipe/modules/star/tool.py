@@ -13,3 +13,4 @@ class Star(Starmod):
 
     """
     _cmd = 'star'
+    _runtime_estimate = 2 * 60 * 60
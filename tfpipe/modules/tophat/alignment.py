@@ -14,6 +14,7 @@ class TopHat(TopHatMod):
 
     """
     _cmd = 'tophat'
+    _runtime_estimate = 6 * 60 * 60
 
 
 
@@ -22,6 +23,7 @@ class TopHat2(TopHatMod):
 
     """
     _cmd = "tophat2"
+    _runtime_estimate = 6 * 60 * 60
 
 
 class TopHatFusionPost(TopHatMod):
@@ -2,3 +2,10 @@
 
 """
 from engine import WorkFlow
+from local import LocalExecutor
+from pilot import Pilot
+from sizing import Sizer
+from scatter import ScatterGather
+from regions import RegionShards
+from blast import ParallelBlast
+from mergetree import MergeTree
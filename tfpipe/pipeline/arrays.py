@@ -0,0 +1,371 @@
+"""Collapse per-sample jobs into scheduler job arrays.
+
+"""
+import re
+import copy
+import heapq
+from collections import defaultdict
+from tfpipe.base import Job
+from tfpipe.utils import logger
+
+# Dependency on every element of an array, or element i on element i
+WHOLE = None
+CORRESPONDING = '*'
+# Elements per array; SLURM's default MaxArraySize is 1001 and LSF's
+# MAX_JOB_ARRAY_SIZE 1000
+MAX_ARRAY_SIZE = 1000
+# Separates the columns of an argument table; unlike tab, read does not
+# merge consecutive ones, so empty values keep their column
+SEPARATOR = '\x1f'
+
+_extension = re.compile(r'\.[A-Za-z][A-Za-z0-9]*$')
+
+
+def _file_like(job, value):
+    """True if an argument value names a file.
+
+    Declared input, output and error files count, as do values that look
+    like a path or a file name with an extension.
+
+    """
+    if not isinstance(value, basestring) or not value:
+        return False
+    declared = (job.input_file, job.output_file, job.error_file,
+                job.redirect_output_file, job.append_output_file,
+                job.redirect_error_file)
+    return value in declared or '/' in value or bool(_extension.search(value))
+
+
+def _slots(job):
+    """Return the (slot, value) pairs a job array may vary.
+
+    """
+    slots = [(('arg', key), job.args[key]) for key in sorted(job.args)]
+    slots += [(('pos', i), value) for i, value in enumerate(job.pos_args)]
+    slots += [(('redirect', attr), getattr(job, attr))
+              for attr in ('redirect_output_file', 'append_output_file',
+                           'redirect_error_file')]
+    return slots
+
+
+def _arrayable(job):
+    """Jobs that render their own command line cannot be templated.
+
+    Jobs with a retry policy are requeued one by one, so they are not
+    grouped either.
+
+    """
+    cls = type(job)
+    return (not getattr(job, 'retry_policy', None) and
+            cls.__str__.__func__ is Job.__str__.__func__ and
+            cls._parse_args.__func__ is Job._parse_args.__func__)
+
+
+class JobArray(object):
+    """JobArray is a group of jobs submitted as a single array job.
+
+    Members differ only in file arguments.  Element i (1-based) runs the
+    shared command template with row i of the argument table.
+
+    """
+    def __init__(self, members, name):
+        """Initialize JobArray.
+
+        """
+        self.members = list(members)
+        self.name = name
+        self.template_job = self.members[0]
+        self.jobid = self.template_job.jobid
+        self._position = dict((job, i + 1) for i, job in enumerate(self.members))
+        slots = [_slots(job) for job in self.members]
+        self.variable = [slot for i, (slot, value) in enumerate(slots[0])
+                         if len(set(s[i][1] for s in slots)) > 1]
+        varying = set(self.variable)
+        self.rows = [[value for slot, value in member if slot in varying]
+                     for member in slots]
+
+    def add_column(self, values):
+        """Add a per-element column to the argument table.
+
+        Returns the column's index in the driver's ARGS array.
+
+        """
+        for row, value in zip(self.rows, values):
+            row.append(value)
+        return len(self.rows[0]) - 1
+
+    def __len__(self):
+        return len(self.members)
+
+    def index(self, job):
+        """Return the 1-based array index of a member job.
+
+        """
+        return self._position[job]
+
+    def template(self, placeholder='"${ARGS[%d]}"'):
+        """Return the command line with variable slots as placeholders.
+
+        """
+        job = copy.copy(self.template_job)
+        job.args = dict(job.args)
+        job.pos_args = list(job.pos_args)
+        for column, (kind, key) in enumerate(self.variable):
+            value = placeholder % column
+            if kind == 'arg':
+                job.args[key] = value
+            elif kind == 'pos':
+                job.pos_args[key] = value
+            else:
+                setattr(job, key, value)
+        return str(job)
+
+    def table(self):
+        """Return the argument table, one row per element, with columns
+        separated by SEPARATOR.
+
+        """
+        return "".join(SEPARATOR.join(str(v) for v in row) + "\n"
+                       for row in self.rows)
+
+    def driver(self, table_path, suffix='', command=None):
+        """Return a bash script running one element of the array.
+
+        The element index is taken from SLURM or LSF.  command replaces the
+        templated command line and suffix is appended to it.
+
+        """
+        return ("#!/bin/bash\n"
+                "INDEX=${SLURM_ARRAY_TASK_ID:-$LSB_JOBINDEX}\n"
+                "IFS=$'\\x1f' read -r -a ARGS <<< "
+                "\"$(sed -n \"${INDEX}p\" %s)\"\n"
+                "%s%s\n" % (table_path, command or self.template(), suffix))
+
+
+def _array_name(members, taken):
+    """Name an array after what its member names have in common.
+
+    """
+    names = [job.name for job in members]
+    prefix = names[0]
+    for name in names[1:]:
+        while not name.startswith(prefix):
+            prefix = prefix[:-1]
+    suffix = names[0]
+    for name in names[1:]:
+        while not name.endswith(suffix):
+            suffix = suffix[1:]
+    base = (prefix + suffix).strip('_-') or \
+        type(members[0]).__name__.lower()
+    name, count = base, 1
+    while name in taken:
+        count += 1
+        name = "%s_%d" % (base, count)
+    taken.add(name)
+    return name
+
+
+class ArrayPlan(object):
+    """ArrayPlan groups the jobs of a DAG into job arrays and single jobs.
+
+    Jobs join an array when they share command, constant arguments, resource
+    requests and DAG depth, so no member is upstream of another.  Members
+    must also depend on the same upstream units in the same way: on all of
+    an upstream array, on a single job, or each on the corresponding element
+    of an upstream array of the same size.  Anything else stays a single job,
+    which may still depend on individual array elements.
+
+    Groups of more than max_size jobs are split into consecutive arrays of
+    at most max_size; downstream element-wise groups split along the same
+    lines, as their members depend on different arrays.
+
+    """
+    def __init__(self, dag, min_size=2, max_size=MAX_ARRAY_SIZE):
+        """Initialize ArrayPlan and group the jobs of dag.
+
+        """
+        self.dag = dag
+        self.min_size = min_size
+        self.max_size = max_size
+        self.unit = {}
+        self.units = []
+        self._taken = set()
+        self._plan()
+
+    def _depth(self):
+        """Map each job to its longest distance from a source job.
+
+        """
+        depth = {}
+        for job in self.dag.topological_order():
+            depth[job] = 1 + max([depth[p] for p in self.dag.parents[job]] or
+                                 [-1])
+        return depth
+
+    def _signature(self, job, depth):
+        """Return what array members must have in common.
+
+        """
+        constant = tuple((slot, value) for slot, value in _slots(job)
+                         if not _file_like(job, value))
+        return (type(job), job.cmd, depth, tuple(sorted(job.args)),
+                len(job.pos_args), constant,
+                tuple(bool(v) for s, v in _slots(job) if s[0] == 'redirect'),
+                getattr(job, '_module', None), job.memory_req_slurm,
+                job.memory_req_lsf, job.time_str_slurm, job.numberofprocesses,
+                job.queue, tuple(sorted(job.dep)))
+
+    def dependencies(self, job):
+        """Return the dependency terms of a job.
+
+        Terms are (condition, unit, index) where index is WHOLE for a
+        dependency on a whole unit or the element index of an array.
+
+        """
+        terms = []
+        for condition, job_list in job.dep.items():
+            per_unit = defaultdict(set)
+            order = []
+            for up in job_list:
+                if not isinstance(up, Job) or up not in self.unit:
+                    continue
+                unit = self.unit[up]
+                if unit not in per_unit:
+                    order.append(unit)
+                if isinstance(unit, JobArray):
+                    per_unit[unit].add(unit.index(up))
+                else:
+                    per_unit[unit].add(WHOLE)
+            for unit in order:
+                indices = per_unit[unit]
+                if isinstance(unit, JobArray) and len(indices) < len(unit):
+                    terms += [(condition, unit, i) for i in sorted(indices)]
+                else:
+                    terms.append((condition, unit, WHOLE))
+        return terms
+
+    def unit_dependencies(self, unit):
+        """Return the dependency terms of a single job or job array.
+
+        Array terms use CORRESPONDING for element-wise dependencies.
+
+        """
+        if isinstance(unit, JobArray):
+            return list(self._pattern(unit.members[0])[0])
+        return self.dependencies(unit)
+
+    def _pattern(self, job):
+        """Return (shared pattern, corresponding index) of job's dependencies.
+
+        The index is None when the job has no element-wise dependency, and
+        False when its dependencies cannot be shared by array members.
+
+        """
+        pattern, position = [], None
+        for condition, unit, index in self.dependencies(job):
+            if index is WHOLE:
+                pattern.append((condition, unit, WHOLE))
+                continue
+            if position not in (None, index):
+                return None, False
+            position = index
+            pattern.append((condition, unit, CORRESPONDING))
+        return tuple(pattern), position
+
+    def _add(self, members):
+        """Record members as arrays of at most max_size, or as single jobs
+        if too few.
+
+        """
+        if len(members) > self.max_size:
+            for start in range(0, len(members), self.max_size):
+                self._add(members[start:start + self.max_size])
+            return
+        if len(members) < self.min_size:
+            for job in members:
+                self.unit[job] = job
+                self.units.append(job)
+            return
+        array = JobArray(members, _array_name(members, self._taken))
+        for job in members:
+            self.unit[job] = array
+        self.units.append(array)
+        logger.debug("ArrayPlan: %s[1-%d] from %s",
+                     array.name, len(array), array.template_job.name)
+
+    def _plan(self):
+        """Group jobs depth by depth so upstream units are always known.
+
+        """
+        depth = self._depth()
+        levels = defaultdict(list)
+        for job in self.dag.jobs:
+            levels[depth[job]].append(job)
+        for level in sorted(levels):
+            groups = defaultdict(list)
+            for job in levels[level]:
+                if _arrayable(job):
+                    groups[self._signature(job, level)].append(job)
+                else:
+                    self._add([job])
+            for members in sorted(groups.values(),
+                                  key=lambda g: self.dag.index[g[0]]):
+                self._split(members)
+
+    def _split(self, members):
+        """Split a candidate group by dependency pattern and add it.
+
+        """
+        by_pattern = defaultdict(list)
+        for job in members:
+            pattern, position = self._pattern(job)
+            if position is False:
+                self._add([job])
+            else:
+                by_pattern[pattern].append((position, job))
+        for pattern in sorted(by_pattern,
+                              key=lambda p: self.dag.index[by_pattern[p][0][1]]):
+            group = by_pattern[pattern]
+            sizes = set(len(unit) for c, unit, i in pattern if i is not WHOLE)
+            positions = [position for position, job in group]
+            if sizes and (len(sizes) > 1 or
+                          sorted(positions) != range(1, sizes.pop() + 1)):
+                for position, job in group:
+                    self._add([job])
+                continue
+            if sizes:
+                group.sort()
+            self._add([job for position, job in group])
+
+    def arrays(self):
+        """Return the job arrays of the plan.
+
+        """
+        return [unit for unit in self.units if isinstance(unit, JobArray)]
+
+    def submission_order(self):
+        """Return units after the units they depend on, by job priority.
+
+        """
+        rank = {}
+        for i, job in enumerate(self.dag.priority_order()):
+            rank.setdefault(self.unit[job], i)
+        pending = dict((unit, set()) for unit in self.units)
+        children = defaultdict(set)
+        for job in self.dag.jobs:
+            for parent in self.dag.parents[job]:
+                up, down = self.unit[parent], self.unit[job]
+                if up is not down:
+                    pending[down].add(up)
+                    children[up].add(down)
+        heap = [(rank[unit], unit) for unit in self.units if not pending[unit]]
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            unit = heapq.heappop(heap)[1]
+            order.append(unit)
+            for child in children[unit]:
+                pending[child].discard(unit)
+                if not pending[child]:
+                    heapq.heappush(heap, (rank[child], child))
+        return order
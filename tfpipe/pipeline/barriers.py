@@ -0,0 +1,191 @@
+"""Keep dependency expressions short.
+
+A job depending on every sample, such as MergeSamFiles over 1000 BAM files,
+gets one SLURM or LSF dependency term per upstream job.  Such expressions
+slow the scheduler down and can exceed its limits.  bound_fan_in rewrites
+the 'done' dependencies of a job list to bound them:
+
+    Dependencies implied by a longer path are dropped, i.e. the graph is
+    transitively reduced.
+
+    A job with more than max_fan_in upstream jobs waits for no-op Barrier
+    jobs instead, each waiting for up to max_fan_in of them, in as many
+    levels as needed.
+
+Jobs whose dependencies change are replaced by copies, as are the jobs
+depending on them, so the jobs passed in keep their dependencies and
+several WorkFlows can be built from one job list.  Rewriting a rewritten
+list again gives the same result, reusing its Barrier jobs.
+
+"""
+import copy
+from collections import deque
+from tfpipe.base import Job
+from tfpipe.utils import logger, InvalidInput
+from tfpipe.pipeline.dag import replace_jobs
+
+
+class Barrier(Job):
+    """Barrier is a no-op job that finishes once its upstream jobs are done.
+
+    """
+    _cmd = 'true'
+    _memory_req_slurm = '64M'
+    _time_str_slurm = '"00:05:00"'
+    _runtime_estimate = 1
+
+    def __init__(self, name, upstream):
+        """Initialize Barrier depending on the jobs in upstream.
+
+        """
+        Job.__init__(self, name=name)
+        self.job_output_file = '/dev/null'
+        self.autosize = False
+        self.add_dependencies(done=list(upstream))
+
+    @property
+    def upstream(self):
+        """The jobs the barrier waits for.
+
+        """
+        return tuple(self.dep['done'])
+
+
+def _done(job, members, barriers):
+    """Return the distinct jobs of the graph job waits for with done.
+
+    Barriers are replaced by the jobs they wait for, and collected in
+    barriers by their upstream jobs.
+
+    """
+    ups, seen = [], set()
+    stack = list(reversed((job._dep or {}).get('done', ())))
+    while stack:
+        up = stack.pop()
+        if isinstance(up, Barrier):
+            barriers[up.upstream] = up
+            stack.extend(reversed(up.upstream))
+        elif isinstance(up, Job) and up in members and up not in seen:
+            seen.add(up)
+            ups.append(up)
+    return ups
+
+
+def _depths(jobs, parents):
+    """Map each job to its longest path of done dependencies from a source.
+
+    Returns None if the dependencies have a cycle.
+
+    """
+    children = dict((job, []) for job in jobs)
+    pending = {}
+    for job in jobs:
+        pending[job] = len(parents[job])
+        for up in parents[job]:
+            children[up].append(job)
+    depth = {}
+    ready = deque(job for job in jobs if not pending[job])
+    while ready:
+        job = ready.popleft()
+        depth[job] = 1 + max([depth[up] for up in parents[job]] or [-1])
+        for child in children[job]:
+            pending[child] -= 1
+            if not pending[child]:
+                ready.append(child)
+    return depth if len(depth) == len(jobs) else None
+
+
+def _redundant(ups, parents, depth):
+    """Return the jobs of ups that another job of ups already waits for.
+
+    """
+    candidates = set(ups)
+    # Ancestors shallower than every candidate cannot lead to one
+    floor = min(depth[up] for up in ups)
+    stack = [grand for up in ups for grand in parents[up]]
+    seen, redundant = set(), set()
+    while stack:
+        ancestor = stack.pop()
+        if ancestor in seen or depth[ancestor] < floor:
+            continue
+        seen.add(ancestor)
+        if ancestor in candidates:
+            redundant.add(ancestor)
+        stack.extend(parents[ancestor])
+    return redundant
+
+
+def bound_fan_in(jobs, max_fan_in=None):
+    """Return jobs with implied done dependencies dropped and, if max_fan_in
+    is given, Barrier jobs bounding the number of done dependencies.
+
+    Only paths of done dependencies imply others, as ended or exit do not
+    imply success.  Jobs waiting for the same group of jobs share its
+    barriers.  Dependencies on names and external jobs are kept.
+
+    """
+    if max_fan_in is not None and max_fan_in < 2:
+        raise InvalidInput("max_fan_in must be at least 2: %r" % max_fan_in)
+    if not any(isinstance(job, Barrier) or
+               len((job._dep or {}).get('done', ())) > 1 for job in jobs):
+        return jobs
+    jobs = [job for job in jobs if not isinstance(job, Barrier)]
+    members = set(jobs)
+    shared = {}
+    parents = dict((job, _done(job, members, shared)) for job in jobs)
+    depth = _depths(jobs, parents)
+    if depth is None:
+        # Left for the DAG to report
+        return jobs
+    removed = 0
+    for job in jobs:
+        if len(parents[job]) > 1:
+            redundant = _redundant(parents[job], parents, depth)
+            if redundant:
+                parents[job] = [up for up in parents[job]
+                                if up not in redundant]
+                removed += len(redundant)
+    if removed:
+        logger.info("Dependencies: dropped %d implied by others", removed)
+    result, changed = [], {}
+    for job in jobs:
+        level, tier = parents[job], 0
+        while max_fan_in and len(level) > max_fan_in:
+            groups = (len(level) + max_fan_in - 1) // max_fan_in
+            size = (len(level) + groups - 1) // groups
+            barriers = []
+            for start in range(0, len(level), size):
+                group = tuple(level[start:start + size])
+                if group not in shared:
+                    shared[group] = Barrier("%s_barrier%d_%d" % (
+                        job.name, tier, len(barriers)), group)
+                barriers.append(shared[group])
+            level, tier = barriers, tier + 1
+        result.extend(barrier for barrier in _new_barriers(level, members))
+        if job._dep and 'done' in job._dep:
+            other = [up for up in job._dep['done'] if not (
+                isinstance(up, Barrier) or
+                isinstance(up, Job) and up in members)]
+            done = other + level
+            if done != job._dep['done']:
+                update = copy.copy(job)
+                update._dep = dict(job._dep, done=done)
+                update._dep_str_lsf = update._dep_str_slurm = None
+                changed[job] = update
+        result.append(job)
+    if not changed:
+        return result
+    return replace_jobs(result, changed)
+
+
+def _new_barriers(level, members):
+    """Yield the barriers of level, and the barriers they wait for, that are
+    not in members yet, upstream first.  They are added to members.
+
+    """
+    for barrier in level:
+        if isinstance(barrier, Barrier) and barrier not in members:
+            members.add(barrier)
+            for up in _new_barriers(barrier.upstream, members):
+                yield up
+            yield barrier
@@ -0,0 +1,137 @@
+"""Measure how fast tfpipe builds and renders large workflows.
+
+    python -m tfpipe.pipeline.benchmark [--jobs N] [--chain N] [--slurm]
+    python -m tfpipe.pipeline.benchmark --startup [--repeat N]
+
+Builds N jobs in dependency chains of the given length, then times creating
+the WorkFlow and streaming its submission script to a temporary file.  The
+throughput target for rendering is 20000 jobs per second, i.e. under a
+minute for 10^6 jobs, with memory bounded by the job graph rather than the
+script.
+
+With --startup, times importing tfpipe in fresh interpreters instead, for
+driver scripts that are started many times.
+
+"""
+import os
+import sys
+import shutil
+import resource
+import tempfile
+from time import time
+from subprocess import check_output
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline.engine import WorkFlow
+
+TARGET_JOBS_PER_SECOND = 20000
+
+STARTUP_STATEMENTS = [
+    'pass',
+    'import tfpipe',
+    'from tfpipe.modules.cli import CLI',
+    'import tfpipe.modules; tfpipe.modules.get_tool("Gsnap")',
+    'from tfpipe.pipeline import WorkFlow']
+
+
+def build_jobs(count, chain=10):
+    """Return count sort jobs, each depending on the one before in its chain.
+
+    """
+    jobs = []
+    for i in range(count):
+        job = CLI(cmd='sort', name='sort%d' % i)
+        job.add_argument('-o', 'sorted%d.txt' % i, 'output')
+        job.add_positional_argument('input%d.txt' % i, 'input')
+        if i % chain:
+            job.add_dependencies(done=[jobs[-1]])
+        jobs.append(job)
+    return jobs
+
+
+def peak_memory_mb():
+    """Return the peak resident memory of this process in megabytes.
+
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(count, chain=10, slurm=False):
+    """Time building, initializing and rendering a workflow.
+
+    Returns {stage: seconds} with the script size and peak memory.
+
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        start = time()
+        jobs = build_jobs(count, chain)
+        built = time()
+        wf = WorkFlow(jobs, lsf=not slurm, slurm=slurm,
+                      name=os.path.join(tmp, 'benchmark.sh'))
+        initialized = time()
+        wf._write_shell_script()
+        rendered = time()
+        size = os.path.getsize(wf._shell_script)
+    finally:
+        shutil.rmtree(tmp)
+    return {'build': built - start, 'init': initialized - built,
+            'render': rendered - initialized, 'script_bytes': size,
+            'peak_memory_mb': peak_memory_mb()}
+
+
+def startup(statements=STARTUP_STATEMENTS, repeat=5):
+    """Time each statement in fresh interpreters.
+
+    Returns [(statement, seconds importing, seconds for the process)], the
+    best of repeat runs each.
+
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root)
+    probe = "from time import time; t = time(); %s; print time() - t"
+    results = []
+    for statement in statements:
+        runs = []
+        for _ in range(repeat):
+            start = time()
+            inside = float(check_output(
+                [sys.executable, '-c', probe % statement], env=env))
+            runs.append((inside, time() - start))
+        results.append((statement, min(r[0] for r in runs),
+                        min(r[1] for r in runs)))
+    return results
+
+
+def main(argv):
+    """Print the benchmark results; exit 1 if rendering misses the target.
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.pipeline.benchmark')
+    parser.add_argument('--jobs', type=int, default=100000)
+    parser.add_argument('--chain', type=int, default=10)
+    parser.add_argument('--slurm', action='store_true')
+    parser.add_argument('--startup', action='store_true')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.startup:
+        for statement, inside, process in startup(repeat=args.repeat):
+            print "%6.1fms import %6.1fms process  %s" % (
+                inside * 1000, process * 1000, statement)
+        return 0
+    result = run(args.jobs, args.chain, args.slurm)
+    rate = args.jobs / max(result['render'], 1e-9)
+    print "jobs:       %d" % args.jobs
+    print "build:      %.2fs (%.0f jobs/s)" % (
+        result['build'], args.jobs / max(result['build'], 1e-9))
+    print "init:       %.2fs" % result['init']
+    print "render:     %.2fs (%.0f jobs/s, target %d)" % (
+        result['render'], rate, TARGET_JOBS_PER_SECOND)
+    print "script:     %.1fM" % (result['script_bytes'] / 1048576.0)
+    print "peak rss:   %.0fM" % result['peak_memory_mb']
+    return 0 if rate >= TARGET_JOBS_PER_SECOND else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,266 @@
+"""Run BLAST searches in parallel over query and database shards.
+
+ParallelBlast turns one BlastN, BlastP or BlastX job into a search per
+query chunk and database shard, and a job merging their tabular hits:
+
+    >>> search = BlastN(name='screen')
+    >>> search.add_argument('-query', 'contigs.fa', 'input')
+    >>> search.add_argument('-db', 'nt')
+    >>> search.add_argument('-outfmt', '"6 std staxids"')
+    >>> search.add_argument('-out', 'contigs.nt.tsv', 'output')
+    >>> pb = ParallelBlast(search, 32, volumes=24, db_shards=6, top=10,
+    ...                    dbsize=350000000000)
+    >>> wf = WorkFlow(pb.jobs, slurm=True, lsf=False)
+
+Query chunks are record ranges of the query FASTA, read from the original
+file through tfpipe.utils.seqindex, so the query is not copied.  Database
+shards group the volumes of a multi-volume database (nt.00, nt.01 and so on)
+under aliases made by blastdb_aliastool; volumes are given as names or, for
+the standard naming, as a count.
+
+Bit scores do not depend on the size of the database searched, so the merge
+ranks the hits of each query by bit score, and then e-value, and keeps the
+top subjects.  E-values do, so give dbsize, the number of letters in the
+whole database (blastdbcmd -info), to have every shard report e-values of a
+search of the whole database.  Shards keep their own top subjects, which
+contain the top subjects overall.
+
+"""
+import sys
+from math import ceil
+from os.path import basename, dirname, join
+from tfpipe.base import Job
+from tfpipe.modules.blast import BlastDBAliasTool, BlastN
+from tfpipe.utils import logger, InvalidInput, python_module
+from tfpipe.pipeline.scatter import IndexFastq, MIN_CHUNK_TIME
+from tfpipe.pipeline.scatter import split_extension, _retarget
+from tfpipe.pipeline.sizing import seconds, format_walltime
+
+# The columns of -outfmt 6 and 7 without a column list
+STANDARD_COLUMNS = ('qseqid', 'sseqid', 'pident', 'length', 'mismatch',
+                    'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue',
+                    'bitscore')
+
+
+def tabular_columns(outfmt):
+    """Return the column names of a tabular -outfmt value.
+
+    """
+    fields = (outfmt or '').strip('"\'').split()
+    if not fields or fields[0] not in ('6', '7'):
+        raise InvalidInput("-outfmt must be tabular, 6 or 7: %r" % outfmt)
+    columns = []
+    for field in fields[1:] or ['std']:
+        columns.extend(STANDARD_COLUMNS if field == 'std' else [field])
+    for needed in ('qseqid', 'sseqid', 'evalue', 'bitscore'):
+        if needed not in columns:
+            raise InvalidInput("-outfmt needs the %s column to merge: %r" %
+                               (needed, outfmt))
+    return columns
+
+
+def _rows(path):
+    """Yield the split hit lines of a tabular BLAST output.
+
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                yield line.rstrip('\n').split('\t')
+
+
+def merge_hits(shards, out, columns, top=None):
+    """Write the hits of shards, a list of lists of tabular outputs, to out.
+
+    Each inner list holds the outputs of one query chunk searched against
+    every database shard.  The hits of a query are ranked by bit score and
+    e-value and cut to its top subjects.
+
+    """
+    query, subject, evalue, bitscore = [columns.index(name) for name in
+                                        ('qseqid', 'sseqid', 'evalue',
+                                         'bitscore')]
+
+    def rank(row):
+        return (-float(row[bitscore]), float(row[evalue]))
+    for parts in shards:
+        order, hits = [], {}
+        for path in parts:
+            for row in _rows(path):
+                if row[query] not in hits:
+                    order.append(row[query])
+                    hits[row[query]] = []
+                hits[row[query]].append(row)
+        for name in order:
+            rows = sorted(hits[name], key=rank)
+            if top:
+                kept = set()
+                for row in rows:
+                    if len(kept) == top:
+                        break
+                    kept.add(row[subject])
+                rows = [row for row in rows if row[subject] in kept]
+            for row in rows:
+                out.write('\t'.join(row) + '\n')
+
+
+class MergeBlast(Job):
+    """MergeBlast merges the tabular outputs of ParallelBlast searches.
+
+    """
+    _cmd = ''
+    _runtime_estimate = 10 * 60
+    _memory_req_slurm = '4G'
+    _time_str_slurm = '"02:00:00"'
+
+    def __init__(self, output, shards, columns, name, top=None):
+        """Initialize MergeBlast writing shards to output.
+
+        """
+        Job.__init__(self, name=name,
+                     cmd=python_module('tfpipe.pipeline.blast'))
+        self.output_file = output
+        self.add_argument('--columns', ','.join(columns))
+        if top:
+            self.add_argument('--top', str(top))
+        self.add_positional_argument(output)
+        for parts in shards:
+            self.add_positional_argument(','.join(parts))
+
+
+def _volume_names(db, volumes):
+    """Return the volume names of db, given as names or a count.
+
+    """
+    if isinstance(volumes, (int, long)):
+        return ['%s.%02d' % (db, i) for i in range(volumes)]
+    return list(volumes)
+
+
+class ParallelBlast(object):
+    """ParallelBlast runs a BLAST job as many searches of query chunks
+    against database shards.
+
+    The template is not run itself.  Its dependencies are passed on to the
+    index and search jobs, and jobs downstream should depend on merge.
+
+    """
+    def __init__(self, template, chunks, volumes=None, db_shards=None,
+                 top=None, dbsize=None):
+        """Initialize ParallelBlast.
+
+        The template names the query FASTA with -query and declares its
+        tabular output, by -out or redirect_output.  chunks query chunks are
+        each searched against db_shards groups of the database volumes, by
+        default one shard per volume.  top cuts each query's hits to its
+        best subjects, as -max_target_seqs does.
+
+        """
+        query = template.args.get('-query')
+        output = template.output_file or template.redirect_output_file
+        db = template.args.get('-db')
+        if not query or not output or not db:
+            raise InvalidInput("%s: the template needs -query, -db and a "
+                               "declared output file" % template.name)
+        if chunks < 1:
+            raise InvalidInput("%s: chunks must be at least 1" % template.name)
+        columns = tabular_columns(template.args.get('-outfmt'))
+        names = _volume_names(db, volumes or [db])
+        db_shards = min(db_shards or len(names), len(names))
+        self.template = template
+        upstream = dict((c, list(jobs)) for c, jobs in template.dep.items())
+        self.index = None
+        if chunks > 1:
+            self.index = IndexFastq(query, chunks, '%s_index' % template.name)
+            self.index.add_dependencies(**upstream)
+        self.aliases, databases = [], []
+        dbtype = 'nucl' if isinstance(template, BlastN) else 'prot'
+        for d in range(db_shards):
+            group = names[d * len(names) // db_shards:
+                          (d + 1) * len(names) // db_shards]
+            if len(group) == 1 or db_shards == 1:
+                databases.append(group[0] if len(group) == 1 else db)
+                continue
+            alias = join(dirname(output), '%s_shard%02d' % (basename(db), d))
+            job = BlastDBAliasTool(name='%s_alias%02d' % (template.name, d))
+            job.add_argument('-dblist', '"%s"' % " ".join(group))
+            job._runtime_shell = True
+            job.add_argument('-dbtype', dbtype)
+            job.add_argument('-title', basename(alias))
+            job.add_argument('-out', alias)
+            job.output_file = alias + ('.nal' if dbtype == 'nucl' else '.pal')
+            job.add_dependencies(**upstream)
+            self.aliases.append(job)
+            databases.append(alias)
+        if db_shards > 1 and not dbsize:
+            logger.warn("%s: without dbsize, e-values are those of each "
+                        "database shard", template.name)
+        runtime = template.runtime_estimate
+        searches = chunks * db_shards
+        limit = max(MIN_CHUNK_TIME,
+                    2.0 * seconds(template.time_str_slurm) / searches)
+        stem, ext = split_extension(output)
+        self.searches, shards = [], []
+        for i in range(chunks):
+            parts = []
+            for d, database in enumerate(databases):
+                job = template.clone('%s_q%03d_d%02d' % (template.name, i, d))
+                part = '%s.q%03d.d%02d%s' % (stem, i, d, ext)
+                _retarget(job, output, part)
+                # Quoted values such as -outfmt '"6 std"' are escaped
+                job._runtime_shell = True
+                if self.index:
+                    job.add_argument('-query', self.index.chunks[i])
+                    job._bash = True
+                parts.append(part)
+                job.add_argument('-db', database)
+                if top:
+                    job.add_argument('-max_target_seqs', str(top))
+                if dbsize and db_shards > 1:
+                    job.add_argument('-dbsize', str(dbsize))
+                job.add_dependencies(**upstream)
+                done = [self.index] if self.index else []
+                done += [alias for alias in self.aliases
+                         if alias.args['-out'] == database]
+                if done:
+                    job.add_dependencies(done=done)
+                if runtime:
+                    job.runtime_estimate = int(ceil(float(runtime) /
+                                                    searches))
+                job.time_str_slurm = format_walltime(limit)
+                job.time_limit_set = template.time_limit_set
+                self.searches.append(job)
+            shards.append(parts)
+        self.merge = MergeBlast(output, shards, columns,
+                                '%s_merge' % template.name, top)
+        self.merge.add_dependencies(done=list(self.searches))
+
+    @property
+    def jobs(self):
+        """Return the index, alias, search and merge jobs.
+
+        """
+        return ([self.index] if self.index else []) + self.aliases + \
+            self.searches + [self.merge]
+
+
+def main(argv):
+    """Merge the tabular outputs of ParallelBlast searches.
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.pipeline.blast')
+    parser.add_argument('--columns', default=','.join(STANDARD_COLUMNS))
+    parser.add_argument('--top', type=int)
+    parser.add_argument('output')
+    parser.add_argument('shards', nargs='+',
+                        help="comma-separated outputs of each query chunk")
+    args = parser.parse_args(argv)
+    with open(args.output, 'w') as out:
+        merge_hits([shard.split(',') for shard in args.shards], out,
+                   args.columns.split(','), args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
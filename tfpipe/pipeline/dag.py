@@ -0,0 +1,226 @@
+"""Job dependency graph built from Job.dep.
+
+"""
+import copy
+import heapq
+from tfpipe.base import Job
+from tfpipe.utils import logger, CyclicDependency
+from tfpipe.pipeline.resources import job_runtime
+
+
+def format_seconds(seconds):
+    """Return seconds as an HH:MM:SS string.
+
+    """
+    seconds = int(round(seconds))
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def replace_jobs(jobs, replaced):
+    """Return jobs with each key of replaced swapped for its value.
+
+    Jobs depending on a replaced job, directly or through other jobs, are
+    swapped for copies depending on the replacements, so the jobs passed in
+    keep their dependencies and can be used to build another graph.
+
+    """
+    replaced = dict(replaced)
+    children = {}
+    for job in list(jobs) + list(replaced.values()):
+        for job_list in (job._dep or {}).values():
+            for up in job_list:
+                children.setdefault(up, []).append(job)
+    # Replacements may depend on replaced jobs as well
+    copies = list(replaced.values())
+    stack = list(replaced)
+    while stack:
+        for child in children.get(stack.pop(), ()):
+            if child not in replaced:
+                replaced[child] = copy.copy(child)
+                copies.append(replaced[child])
+                stack.append(child)
+
+    def final(job):
+        while job in replaced:
+            job = replaced[job]
+        return job
+    for job in copies:
+        dep = dict((condition, [final(up) for up in job_list])
+                   for condition, job_list in (job._dep or {}).items())
+        if dep != (job._dep or {}):
+            job._dep = dep
+            job._dep_str_lsf = job._dep_str_slurm = None
+    result, seen = [], set()
+    for job in jobs:
+        job = final(job)
+        if job not in seen:
+            seen.add(job)
+            result.append(job)
+    return result
+
+
+class DAG(object):
+    """DAG holds the dependency graph of a list of jobs.
+
+    Edges point from upstream to downstream jobs.  Dependencies on objects
+    that are not jobs of the graph (names, external jobs) are not edges.
+    Jobs without a runtime_estimate count default_runtime seconds.
+
+    """
+    def __init__(self, jobs, default_runtime=3600):
+        """Initialize DAG.
+
+        """
+        self.jobs = list(jobs)
+        self.default_runtime = default_runtime
+        self.index = dict((job, i) for i, job in enumerate(self.jobs))
+        self.parents = dict((job, []) for job in self.jobs)
+        self.children = dict((job, []) for job in self.jobs)
+        for job in self.jobs:
+            for job_list in job.dep.values():
+                for up in job_list:
+                    if isinstance(up, Job) and up in self.index \
+                            and up not in self.parents[job]:
+                        self.parents[job].append(up)
+                        self.children[up].append(job)
+        self._bottom_level = None
+
+    def runtime(self, job):
+        """Return the estimated runtime of job in seconds.
+
+        """
+        return job_runtime(job, self.default_runtime)
+
+    def topological_order(self, key=None):
+        """Return jobs with every job after the jobs it depends on.
+
+        Among jobs whose dependencies are placed, the smallest key(job) goes
+        first; by default the original list order is kept.
+
+        """
+        key = key or self.index.get
+        pending = dict((job, len(self.parents[job])) for job in self.jobs)
+        heap = [(key(job), self.index[job], job)
+                for job in self.jobs if not pending[job]]
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            job = heapq.heappop(heap)[2]
+            order.append(job)
+            for child in self.children[job]:
+                pending[child] -= 1
+                if not pending[child]:
+                    heapq.heappush(heap, (key(child), self.index[child], child))
+        if len(order) != len(self.jobs):
+            cycle = [job.name for job in self.jobs if pending[job]]
+            raise CyclicDependency("Dependency cycle among jobs: %s" %
+                                   ", ".join(cycle))
+        return order
+
+    @property
+    def bottom_level(self):
+        """Map each job to the length of its longest path to a sink.
+
+        The length includes the job's own runtime, so the largest value is the
+        critical path of the workflow.
+
+        """
+        if self._bottom_level is None:
+            level = {}
+            for job in reversed(self.topological_order()):
+                level[job] = self.runtime(job) + max(
+                    [level[child] for child in self.children[job]] or [0])
+            self._bottom_level = level
+        return self._bottom_level
+
+    def priority(self, job):
+        """Sort key placing jobs with the longest remaining path first.
+
+        """
+        return (-self.bottom_level[job], self.index[job])
+
+    def priority_order(self):
+        """Return a topological order that favours the critical path.
+
+        """
+        level = self.bottom_level
+        # Ties are broken by list order inside topological_order
+        return self.topological_order(key=lambda job: -level[job])
+
+    def descendants(self, jobs):
+        """Return jobs and every job downstream of them, in list order.
+
+        """
+        found = set(jobs)
+        stack = list(found)
+        while stack:
+            for child in self.children[stack.pop()]:
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return [job for job in self.jobs if job in found]
+
+    def critical_path(self):
+        """Return the jobs on the longest path through the graph.
+
+        """
+        level = self.bottom_level
+        path = []
+        candidates = [job for job in self.jobs if not self.parents[job]]
+        while candidates:
+            job = max(candidates, key=lambda j: (level[j], -self.index[j]))
+            path.append(job)
+            candidates = self.children[job]
+        return path
+
+    def makespan(self, slots=None):
+        """Predict the wall time of the workflow in seconds.
+
+        Without slots the graph is assumed to have unlimited resources and
+        the makespan is the critical path length.  With slots, jobs are list
+        scheduled by priority onto that many cores.
+
+        """
+        if not self.jobs:
+            return 0
+        if not slots:
+            return max(self.bottom_level.values())
+        pending = dict((job, len(self.parents[job])) for job in self.jobs)
+        ready = [self.priority(job) + (job,)
+                 for job in self.jobs if not pending[job]]
+        heapq.heapify(ready)
+        running = []
+        free, now = slots, 0
+        while ready or running:
+            waiting = []
+            while ready:
+                item = heapq.heappop(ready)
+                job = item[-1]
+                cpus = min(slots, max(1, job.numberofprocesses or 1))
+                if cpus <= free:
+                    free -= cpus
+                    heapq.heappush(running, (now + self.runtime(job),
+                                             self.index[job], cpus, job))
+                else:
+                    waiting.append(item)
+            for item in waiting:
+                heapq.heappush(ready, item)
+            now, _, cpus, job = heapq.heappop(running)
+            free += cpus
+            for child in self.children[job]:
+                pending[child] -= 1
+                if not pending[child]:
+                    heapq.heappush(ready, self.priority(child) + (child,))
+        return now
+
+    def report(self, slots=None):
+        """Return a one line summary of the predicted makespan.
+
+        """
+        path = self.critical_path()
+        summary = "predicted makespan %s, critical path %s (%d jobs: %s)" % (
+            format_seconds(self.makespan(slots)),
+            format_seconds(self.makespan()),
+            len(path), " -> ".join(job.name for job in path))
+        logger.info("DAG: %s", summary)
+        return summary
@@ -1,29 +1,130 @@
 """Defines functionality for pipeline.
 
 """
+import gc
 from re import findall
-from os import system
+from contextlib import contextmanager
+from os import system, makedirs
+from os.path import abspath, splitext, dirname, join, basename, isdir
+from pipes import quote
 from sys import exit
+from math import ceil
 from datetime import datetime
-from tfpipe.utils import logger, DuplicateJobNames
+from tfpipe.utils import logger, DuplicateJobNames, InvalidObjectCall, \
+    memory_to_mb
+from tfpipe.base import Job, jobid
+from tfpipe.pipeline.dag import DAG, replace_jobs
+from tfpipe.pipeline.arrays import ArrayPlan, JobArray, WHOLE, CORRESPONDING
+from tfpipe.pipeline.local import LocalExecutor
+from tfpipe.pipeline.manifest import Manifest
+from tfpipe.pipeline.metrics import MetricsStore
+from tfpipe.pipeline.sizing import Sizer, format_walltime, seconds
+from tfpipe.pipeline.resources import cpu_count
+from tfpipe.pipeline.state import StateStore, PENDING, RUNNING, DONE, EXIT
+from tfpipe.pipeline import retry
+from tfpipe.pipeline import pilot as pilot_mode
+from tfpipe.pipeline import barriers, fusion, staging
+
+# Buffer size of the streamed shell script
+WRITE_BUFFER = 1 << 20
+
+
+@contextmanager
+def _gc_paused():
+    """Pause the cyclic garbage collector.
+
+    Rendering allocates millions of short-lived, acyclic strings, which
+    would otherwise trigger full collections over the whole job graph.
+
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 class WorkFlow(object):
     """WorkFlow creates and executes job submission statements.
 
     """
-    def __init__(self, job_list=[], lsf=True, slurm=False, name=None, additionalmodules={}):
+    def __init__(self, job_list=[], lsf=True, slurm=False, name=None, additionalmodules={},
+                 local=False, max_workers=None, max_memory=None, arrays=False,
+                 incremental=False, manifest=None, pilot=None, fuse=False,
+                 fifo=False, metrics=False, autosize=False, state=False,
+                 max_fan_in=50):
         """Initialize WorkFlow.
 
         Method sets job lists and environment.  Depending on the environment, 
         job names are checked before submission.
 
+        When local is True the job graph is run on this host by a
+        LocalExecutor instead of being submitted to LSF or SLURM.  Jobs are
+        packed onto max_workers cores and max_memory memory (e.g. '240G'),
+        which default to the resources of the host.
+
+        When arrays is True, jobs that differ only in file arguments are
+        submitted as a single SLURM or LSF job array.
+
+        When incremental is True, jobs whose command, declared inputs and
+        outputs match the fingerprints recorded in the manifest directory
+        (default: tfpipe_manifest next to the shell script) are skipped.
+
+        When pilot is a Pilot, jobs are not submitted one by one.  Instead
+        pilot.allocations large allocations are requested from LSF or SLURM,
+        each running a worker that takes jobs from the shared job graph.
+
+        When fuse is True, linear chains where a job's output file is read
+        only by the next job are run as one piped command, e.g. samtools
+        view | samtools sort, without writing the intermediate file.  Jobs
+        depending on the end of a chain are rewired to the fused job.
+
+        When fifo is True, such chains are also fused when the tools need
+        file paths: the jobs run side by side on one node and the
+        intermediate file is replaced by a named pipe.  Tools that seek in
+        their files (_seeks = True) keep the real file.
+
+        Jobs marked with Job.use_scratch run against copies of their files
+        on node-local scratch space.
+
+        When metrics is True, or the path of a store, every job records its
+        wall time, CPU time, peak memory and I/O in a JSON lines metrics
+        store (default: <script>.metrics.jsonl).
+
+        When autosize is True, or a Sizer, the memory and time requests of
+        jobs are predicted from the runs of their module class recorded in
+        the metrics store, scaled by input size and padded by a safety
+        margin.  Jobs with autosize set to False keep their own requests.
+
+        When state is True, or the path of a database, run records the jobs
+        and their scheduler IDs in a SQLite state database (default:
+        <script>.state.db) and wait polls their states.
+
+        Dependencies implied by other dependencies are dropped.  A job
+        submitted with more than max_fan_in upstream jobs waits for Barrier
+        jobs instead, each covering up to max_fan_in of them; None turns
+        this off.  Job arrays, pilot and local mode need no barriers.
+
         """
-        if not((not slurm and lsf) or (slurm and not lsf)):
-            raise RuntimeError('You can only choose LSF or SLURM',
-                                 'Can not process a workflow as only LSF or SLURM may be invoked')
-        self.jobs = job_list
+        # The local backend overrides the LSF default
+        if local:
+            lsf = slurm = False
+        if not(local or (not slurm and lsf) or (slurm and not lsf)):
+            raise RuntimeError('You can only choose LSF, SLURM or local',
+                                 'Can not process a workflow as only LSF, SLURM or local may be invoked')
+        if fuse or fifo:
+            job_list = fusion.fuse(job_list, pipes=fuse, fifos=fifo)
+        job_list = staging.stage(job_list)
+        self.max_fan_in = None
+        if not (local or arrays or pilot):
+            self.max_fan_in = max_fan_in
+        self.jobs = barriers.bound_fan_in(job_list, self.max_fan_in)
         #LSF for the moment overides SLURM
-        if lsf and not slurm:
+        if local:
+            self.lsf = False
+            self.slurm = False
+        elif lsf and not slurm:
             self.lsf = True
             self.slurm = False
         elif not lsf and slurm:
@@ -31,6 +132,11 @@ class WorkFlow(object):
             self.slurm = True
         else:
             assert False
+        self.local = local
+        self.max_workers = max_workers
+        self.max_memory = max_memory
+        self.arrays = arrays
+        self._support_files = {}
         self._check_jobnames()
         self.additionalmodules = additionalmodules
         now = datetime.now()
@@ -39,6 +145,30 @@ class WorkFlow(object):
                 now.strftime("%Y%m%d%H%M%S")
         else:
             self._shell_script = name
+        self.manifest = None
+        if incremental:
+            self.manifest = Manifest(manifest or join(
+                dirname(abspath(self._shell_script)), 'tfpipe_manifest'))
+        self._skipped = set()
+        self._rescue = None
+        self._bound = {}
+        self.pilot = pilot
+        self.metrics = None
+        if metrics:
+            self.metrics = MetricsStore(
+                metrics if isinstance(metrics, basestring) else
+                splitext(self._shell_script)[0] + '.metrics.jsonl')
+        self.sizer = autosize or None
+        if autosize is True:
+            self.sizer = Sizer(self.metrics or MetricsStore(
+                splitext(self._shell_script)[0] + '.metrics.jsonl'))
+        self.state = None
+        if state:
+            self.state = StateStore(
+                state if isinstance(state, basestring) else
+                splitext(self._shell_script)[0] + '.state.db')
+        self._units = {}
+        self._last_command = (None, None)
         logger.info("WorkFlow created")
 
     def _check_jobnames(self):
@@ -59,31 +189,159 @@ class WorkFlow(object):
         Use lsf scheduler, bsub, if self.lsf is True.
 
         """
+        if self.local:
+            self.current_submit_str = self._command(job) + "\n"
+            return self.current_submit_str
+        dep_str = None
+        if self._skipped:
+            terms = [(condition, up, WHOLE)
+                     for condition, job_list in job.dep.items()
+                     for up in job_list if up not in self._skipped]
+            if self.lsf:
+                dep_str = self._build_dep_str_lsf(terms)
+            else:
+                dep_str = self._build_dep_str_slurm(terms)
         if self.lsf:
-            jobsched_str = self._build_bsub(job) or ''
+            jobsched_str = self._build_bsub(job, dep_str) or ''
         elif self.slurm:
-            jobsched_str = self._build_sbatch_pre(job) or ''
+            jobsched_str = self._build_sbatch_pre(job, dep_str) or ''
         else:
             assert False
         if job.redirect_output or job.redirect_error:
-            job_str = '"' + str(job) + '"'
+            job_str = self._quoted_command(job)
         else:
-            job_str = str(job)
+            job_str = self._job_command(job)
         if self.slurm:
             self.current_submit_str = jobsched_str + job_str + self._build_sbatch_post(job) + "\n"
         else:
             self.current_submit_str = jobsched_str + job_str + "\n"
+        self.current_submit_str += self._record_id(job)
+        self.current_submit_str += self._retry_watcher(job)
+        self._units[job] = (job.jobid, None, job.name)
         return self.current_submit_str
 
-    def _build_sbatch_pre(self, job):
+    def _ids_path(self):
+        """Return the file the script writes SLURM scheduler IDs to.
+
+        """
+        return abspath(splitext(self._shell_script)[0] + '.ids')
+
+    def _record_id(self, unit):
+        """Return the line recording the scheduler ID of a submitted unit.
+
+        LSF jobs are looked up by name instead.
+
+        """
+        if not (self.state and self.slurm):
+            return ''
+        return 'echo "%s $%s" >> %s\n' % (unit.jobid, unit.jobid,
+                                           quote(self._ids_path()))
+
+    def _retry_watcher(self, job):
+        """Return the watcher submission of a job with a retry policy.
+
+        """
+        if not job.retry_policy:
+            return ''
+        memory_slurm, memory_lsf, time_str, walltime = self._requests([job])
+        if self.slurm:
+            return retry.watcher(job, memory_to_mb(memory_slurm, 'M'),
+                                 seconds(time_str))
+        return retry.watcher(job, memory_to_mb(memory_lsf, 'G'),
+                             seconds(walltime) if walltime else None,
+                             slurm=False)
+
+    def _quoted_command(self, job):
+        """Return the job command in double quotes.
+
+        Commands of jobs that expand shell variables on the node, such as
+        StagedJob, are escaped so the submitting shell leaves them alone.
+        Commands of jobs with _bash set, such as those reading process
+        substitutions, run under bash -c, as sbatch --wrap and bsub use sh.
+        Commands under the metrics wrapper are quoted for its bash -c and
+        escaped likewise.
+
+        """
+        command = self._job_command(job)
+        bash = getattr(job, '_bash', False)
+        if bash:
+            command = "bash -c %s" % quote(command)
+        if bash or self.metrics or getattr(job, '_runtime_shell', False):
+            for char in '\\"$`':
+                command = command.replace(char, '\\' + char)
+        return '"' + command + '"'
+
+    def _job_command(self, job):
+        """Return the command line submitted for a job.
+
+        With metrics the command runs under the metrics wrapper.  In
+        incremental mode the job records its fingerprints on success.
+
+        """
+        command = self._local_command(job)
+        if self.manifest:
+            return "%s && %s" % (command, self.manifest.record_command(
+                job, self._command(job)))
+        return command
+
+    def _local_command(self, job):
+        """Return the command line a job runs, without manifest records.
+
+        """
+        if self.metrics:
+            return self.metrics.command(job, self._command(job))
+        return self._command(job)
+
+    def _command(self, job):
+        """Return str(job), built once for the job being rendered.
+
+        Only the last command is kept, so rendering needs constant memory.
+        Graph passes and arrays edit job arguments in place, so commands are
+        not cached beyond one rendering.
+
+        """
+        if self._last_command[0] is not job:
+            self._last_command = (job, str(job))
+        return self._last_command[1]
+
+    def _requests(self, jobs):
+        """Return the SLURM memory, LSF memory, SLURM and LSF time of jobs.
+
+        Requests predicted by the sizer, the largest over jobs, replace the
+        jobs' own.  The LSF time is None unless predicted.
+
+        """
+        job = jobs[0]
+        requests = (job.memory_req_slurm, job.memory_req_lsf,
+                    job.time_str_slurm, None)
+        if self.sizer:
+            sizes = [self.sizer.predict(j) for j in jobs]
+            if None not in sizes:
+                memory = max(m for m, t in sizes)
+                runtime = max(t for m, t in sizes)
+                requests = ("%dM" % memory, str(int(ceil(memory / 1024.0))),
+                            format_walltime(runtime),
+                            format_walltime(runtime, lsf=True))
+        return requests
+
+    def _build_sbatch_pre(self, job, dep_str=None):
         """Create the sbatch (SLURM) command submission string for the first part.
 
         """
+        if dep_str is None:
+            dep_str = job.get_dep_str_slurm
+        memory, _, time_str, _ = self._requests([job])
         sbatch = "%s=$(sbatch -J %s %s -o %s --time %s " % (job.jobid, job.name,
-                                             job.get_dep_str_slurm,
-                                                job.job_output_file,job.time_str_slurm)
-        if job.memory_req_slurm and len(job.memory_req_slurm)>0:
-            sbatch += "--mem=%s " % (job.memory_req_slurm)
+                                             dep_str,
+                                                job.job_output_file,time_str)
+        if memory and len(memory)>0:
+            sbatch += "--mem=%s " % (memory)
+        if job.retry_policy:
+            sbatch += "--requeue "
+        # Dependents wait while a failed job is requeued by its watcher
+        if [up for job_list in job.dep.values() for up in job_list
+                if getattr(up, 'retry_policy', None)]:
+            sbatch += "--kill-on-invalid-dep=no "
         if job.numberofprocesses > 1:
             sbatch += "-n %s " % str(job.numberofprocesses)
         sbatch += "--wrap="
@@ -95,80 +353,463 @@ class WorkFlow(object):
         """
         return ")\n%s=$(echo $%s | cut -d ' ' -f4)" % (job.jobid,job.jobid)
 
-    def _build_bsub(self, job):
+    def _build_bsub(self, job, dep_str=None):
         """Create bsub (LSF) command submission string.
 
         """
+        if dep_str is None:
+            dep_str = job.get_dep_str
         bsub = "bsub -J %s %s -o %s " % (job.name,
-                                         job.get_dep_str,
+                                         dep_str,
                                                 job.job_output_file)
-        if job.memory_req_lsf:
-            bsub += "-M %s " % (job.memory_req_lsf)
+        _, memory, _, walltime = self._requests([job])
+        if memory:
+            bsub += "-M %s " % (memory)
+        if walltime:
+            bsub += "-W %s " % (walltime)
         if job.numberofprocesses > 1:
             bsub += '-n %d -R "span[hosts=1]" ' % (job.numberofprocesses)
         return bsub
 
+    def _build_dep_str_slurm(self, terms):
+        """Build a SLURM dependency string from ArrayPlan dependency terms.
+
+        """
+        afterok, aftercorr = [], []
+        for condition, unit, index in terms:
+            if index is CORRESPONDING:
+                aftercorr.append("$%s" % unit.jobid)
+            elif index is WHOLE:
+                afterok.append("$%s" % unit.jobid)
+            else:
+                afterok.append("${%s}_%d" % (unit.jobid, index))
+        dep = []
+        if afterok:
+            dep.append("afterok:" + ":".join(afterok))
+        if aftercorr:
+            dep.append("aftercorr:" + ":".join(aftercorr))
+        return "--dependency=" + ",".join(dep) if dep else ""
+
+    def _build_dep_str_lsf(self, terms):
+        """Build an LSF dependency string from ArrayPlan dependency terms.
+
+        """
+        conditions = []
+        for condition, unit, index in terms:
+            if index is WHOLE:
+                conditions.append("%s(%s)" % (condition, unit.name))
+            else:
+                conditions.append("%s(%s[%s])" % (condition, unit.name, index))
+        return '-w "%s"' % "&&".join(conditions) if conditions else ""
+
+    def _create_array_submit_str(self, array, terms):
+        """Build the submission string of a job array.
+
+        Writes of the argument table and element driver script are deferred
+        to run.
+
+        """
+        base = splitext(self._shell_script)[0]
+        table = "%s.%s.args" % (base, array.name)
+        driver = "%s.%s.sh" % (base, array.name)
+        suffix = ''
+        if self.manifest:
+            column = array.add_column([
+                self.manifest.record_command(job, self._command(job))
+                for job in array.members])
+            suffix = ' && ${ARGS[%d]}' % column
+        command = None
+        if self.metrics:
+            column = array.add_column([self.metrics.prefix(job)
+                                       for job in array.members])
+            command = 'eval "WRAPPER=(${ARGS[%d]})"; ' \
+                '"${WRAPPER[@]}" bash -c %s "${ARGS[@]}"' % (
+                    column, quote(array.template(placeholder='"${%d}"')))
+        self._support_files[table] = array.table()
+        self._support_files[driver] = array.driver(abspath(table), suffix,
+                                                   command)
+        for member in array.members:
+            self._units[member] = (array.jobid, array.index(member),
+                                   "%s[%d]" % (array.name, array.index(member)))
+        job = array.template_job
+        memory_slurm, memory_lsf, time_str, walltime = self._requests(
+            array.members)
+        if self.slurm:
+            sub = "%s=$(sbatch -J %s --array=1-%d %s -o %s_%%a.out --time %s " % (
+                array.jobid, array.name, len(array),
+                self._build_dep_str_slurm(terms), array.name, time_str)
+            if memory_slurm:
+                sub += "--mem=%s " % (memory_slurm)
+            if job.numberofprocesses > 1:
+                sub += "-n %s " % str(job.numberofprocesses)
+            return sub + driver + self._build_sbatch_post(array) + "\n" + \
+                self._record_id(array)
+        sub = 'bsub -J "%s[1-%d]" %s -o %s.%%I.out ' % (
+            array.name, len(array), self._build_dep_str_lsf(terms), array.name)
+        if memory_lsf:
+            sub += "-M %s " % (memory_lsf)
+        if walltime:
+            sub += "-W %s " % (walltime)
+        if job.numberofprocesses > 1:
+            sub += '-n %d -R "span[hosts=1]" ' % (job.numberofprocesses)
+        return sub + "bash %s\n" % driver
+
+    def _create_array_plan_submit_str(self, plan, unit):
+        """Build the submission string of a unit of an ArrayPlan.
+
+        """
+        terms = plan.unit_dependencies(unit)
+        if isinstance(unit, JobArray):
+            return self._create_array_submit_str(unit, terms)
+        if self.slurm:
+            dep_str = self._build_dep_str_slurm(terms)
+        else:
+            dep_str = self._build_dep_str_lsf(terms)
+        if self.lsf:
+            jobsched_str = self._build_bsub(unit, dep_str)
+        else:
+            jobsched_str = self._build_sbatch_pre(unit, dep_str)
+        job_str = self._quoted_command(unit)
+        self._units[unit] = (unit.jobid, None, unit.name)
+        if self.slurm:
+            return jobsched_str + job_str + self._build_sbatch_post(unit) + \
+                "\n" + self._record_id(unit) + self._retry_watcher(unit)
+        return jobsched_str + job_str + "\n" + self._retry_watcher(unit)
+
     def add_job(self, newjob):
         """Add job to list.
 
         """
         self.jobs.append(newjob)
-        logger.info("WorkFlow ADD: %s" % newjob)
+        logger.debug("WorkFlow ADD: %s", newjob)
+
+    def merge(self, *graphs):
+        """Add the jobs of independently built workflows or job lists.
+
+        Graphs can be built in parallel threads or worker processes, e.g.
+        one per sample in a multiprocessing pool, and merged here.  A job
+        with the ID and name of a job already merged, such as a copy of a
+        shared upstream job sent back by a worker, is taken to be that job
+        and dependencies on the copy are rewired to it.  Other jobs whose
+        IDs clash are given new IDs.
+
+        """
+        known = dict(((job.jobid, job.name), job) for job in self.jobs)
+        ids = set(job.jobid for job in self.jobs)
+        replaced = {}
+        added = []
+        for graph in graphs:
+            if isinstance(graph, WorkFlow):
+                jobs = graph.jobs
+            else:
+                jobs = staging.stage(list(graph))
+            for job in jobs:
+                key = (job.jobid, job.name)
+                if key in known:
+                    if known[key] is not job:
+                        replaced[job] = known[key]
+                    continue
+                if job.jobid in ids:
+                    job._jobid = jobid.Instance().getjobid()
+                    key = (job.jobid, job.name)
+                known[key] = job
+                ids.add(job.jobid)
+                added.append(job)
+        members = set(known.values())
+        for job in added:
+            for job_list in (job._dep or {}).values():
+                for up in job_list:
+                    if isinstance(up, Job) and up not in members:
+                        match = known.get((up.jobid, up.name))
+                        if match is not None:
+                            replaced[up] = match
+        self.jobs = barriers.bound_fan_in(
+            replace_jobs(self.jobs + added, replaced), self.max_fan_in)
+        self._check_jobnames()
+        logger.info("WorkFlow MERGE: %d jobs added", len(added))
 
     def _build_shell_script_to_text(self):
         """Builds and returns a shell script as a string.
 
+        Jobs are submitted longest remaining path first, after the jobs they
+        depend on.
+
         :return: A string composed of the executable shell script.
         """
-        mods = []
-        output = "#!/bin/bash\n"
+        with _gc_paused():
+            return "".join(self._render())
+
+    def _write_shell_script(self):
+        """Stream the shell script to its file.
+
+        The script is written as it is rendered and never held in memory
+        as a whole.
+
+        """
+        with open(self._shell_script, 'w', WRITE_BUFFER) as f, _gc_paused():
+            f.writelines(self._render())
+
+    def _module(self, job):
+        """Return the module a job loads on the cluster, or None.
+
+        SLURM falls back to the LSF module when there is no SLURM specific
+        one.
+
+        """
+        try:
+            if self.slurm and hasattr(job, 'module_slurm'):
+                return job.module_slurm
+            if self.slurm or self.lsf:
+                return job.module
+        except AttributeError:
+            # If there is no module then do nothing.
+            pass
+        return None
+
+    def _render(self):
+        """Yield the shell script in chunks, one per submission.
+
+        """
+        self._units = {}
+        self._last_command = (None, None)
+        yield "#!/bin/bash\n"
         if self.lsf:
-            output += ". /nas02/apps/Modules/default/init/bash\n"
+            yield ". /nas02/apps/Modules/default/init/bash\n"
+        loaded = set()
         for job in self.jobs:
-            try:
-                if self.slurm:
-                    if hasattr(job,'module_slurm'):
-                        if job.module_slurm not in mods:
-                            output += "module load %s\n" % job.module_slurm
-                            mods.append(job.module_slurm)
-                    else:
-                        # If you can't find a slurm specific module, then use the default (LSF)
-                        if job.module not in mods:
-                            output += "module load %s\n" % job.module
-                            mods.append(job.module)
-                elif self.lsf:
-                    if job.module not in mods:
-                        output += "module load %s\n" % job.module
-                        mods.append(job.module)
-                elif not self.lsf and not self.slurm:
-                    assert False
-            except AttributeError:
-                # If there is no module then do nothing.
-                pass
+            for stage in getattr(job, 'stages', (job,)):
+                module = self._module(stage)
+                if module is not None and module not in loaded:
+                    loaded.add(module)
+                    yield "module load %s\n" % module
         for module in self.additionalmodules:
-            try:
-                if module not in mods:
-                    output += "module load %s\n" % module
-                    mods.append(module)
-            except AttributeError:
-                pass
-        for job in self.jobs:
-            output += self._create_submit_str(job)
+            if module not in loaded:
+                loaded.add(module)
+                yield "module load %s\n" % module
+        dag = DAG(self.jobs_to_run())
+        # Upstream jobs of a rescue that are still queued keep their IDs
+        if self.slurm:
+            for job, jobid in sorted(self._bound.items(), key=lambda b: b[1]):
+                yield "%s=%s\n" % (job.jobid, jobid)
+        rescuing = self._rescue is not None
+        if self.pilot and not self.local and not rescuing:
+            yield self._build_pilot_submissions(dag)
+        elif self.arrays and not self.local and not rescuing:
+            self._support_files = {}
+            plan = ArrayPlan(dag)
+            for unit in plan.submission_order():
+                yield self._create_array_plan_submit_str(plan, unit)
+        else:
+            for job in dag.priority_order():
+                yield self._create_submit_str(job)
+        self._last_command = (None, None)
+
+    def _pilot_dir(self):
+        """Return the plan directory shared by pilot workers.
+
+        """
+        return abspath(splitext(self._shell_script)[0] + '.pilot')
+
+    def _build_pilot_submissions(self, dag):
+        """Build the worker allocation submissions of pilot mode.
+
+        The plan, with jobs in priority order, is written by run.
+
+        """
+        plan_dir = self._pilot_dir()
+        walltime = seconds(self.pilot.walltime)
+        for job in dag.jobs:
+            if (job.runtime_estimate or 0) > walltime:
+                logger.warn("WorkFlow PILOT: %s needs more than the %s wall "
+                            "time of a pilot", job.name, self.pilot.walltime)
+        self._support_files = {join(plan_dir, 'plan.json'): pilot_mode.plan_text(
+            dag.priority_order(), self._job_command)}
+        base = splitext(basename(self._shell_script))[0]
+        output = ''
+        for i in range(self.pilot.allocations):
+            name = "%s_pilot%d" % (base, i + 1)
+            if self.slurm:
+                output += self.pilot.sbatch(name, plan_dir)
+            else:
+                output += self.pilot.bsub(name, plan_dir)
         return output
 
+    def dag(self):
+        """Return the dependency graph of the workflow's jobs.
+
+        """
+        return DAG(self.jobs)
+
+    def jobs_to_run(self):
+        """Return the jobs that have to run.
+
+        Outside incremental mode this is every job.  Otherwise the manifest
+        decides which jobs are out of date; the rest are skipped.
+
+        """
+        if self._rescue is not None:
+            return self._rescue
+        if not self.manifest:
+            return self.jobs
+        stale = self.manifest.stale(self.dag())
+        run = set(stale)
+        self._skipped = set(job for job in self.jobs if job not in run)
+        for job in self.jobs:
+            if job in self._skipped:
+                logger.debug("WorkFlow SKIP: %s is up to date", job.name)
+        return stale
+
     def show(self):
         """Method prints out the shell script to stdout
 
+        The script is followed by a comment with the predicted makespan.
+
         """
         submit_str = self._build_shell_script_to_text()
         print submit_str
-        logger.info("WorkFlow SHOW: %s" % submit_str)
+        logger.info("WorkFlow SHOW: %s", submit_str)
+        slots = (self.max_workers or cpu_count()) if self.local else None
+        print "# %s" % self.dag().report(slots)
+        if self.manifest:
+            print "# %d of %d jobs up to date and skipped" % (
+                len(self._skipped), len(self.jobs))
             
     def run(self):
         """Method submits command list to shell.
 
+        In local mode the jobs are executed on this host and the method
+        returns once the whole graph has finished.  With a state database
+        the submitted jobs and their scheduler IDs are recorded for wait.
+
         """
-        with open(self._shell_script, 'w') as f:
-            f.write(self._build_shell_script_to_text())
+        if self.local:
+            return self._run_local()
+        self._write_shell_script()
+        if self.manifest:
+            self.manifest.record_unrecorded()
+        if self.pilot:
+            pilot_mode.reset_plan(self._pilot_dir())
+        for path, text in self._support_files.items():
+            if dirname(path) and not isdir(dirname(path)):
+                makedirs(dirname(path))
+            with open(path, 'w') as f:
+                f.write(text)
+        if self.state:
+            if self.pilot:
+                logger.warn("WorkFlow STATE: pilot jobs are not tracked")
+            self._record_jobs(self._units)
+            open(self._ids_path(), 'w').close()
         system("bash %s" % self._shell_script)
-        logger.info("WorkFlow SUBMIT: %s" % self._shell_script)
+        if self.state and self.slurm:
+            self.state.load_ids(self._ids_path())
+        logger.info("WorkFlow SUBMIT: %s", self._shell_script)
+
+    def _record_jobs(self, units):
+        """Record jobs, mapped to (unit, element, LSF name), in the state DB.
+
+        """
+        self.state.add([(job.name,) + unit for job, unit in units.items()],
+                       [(job.name, up.name) for job in units
+                        for job_list in job.dep.values() for up in job_list
+                        if up in units])
+
+    def rescue(self):
+        """Resubmit the jobs that failed in the previous run.
+
+        Job states come from the state database, polled once.  Jobs that
+        exited, were skipped or never ran are submitted again together with
+        every job downstream of them; queued copies of those are cancelled
+        first.  Dependencies on completed jobs count as satisfied and rescued
+        jobs still wait for upstream jobs that are running.  Rescued jobs
+        are submitted one by one, not as arrays or pilots.
+
+        """
+        if not self.state:
+            raise InvalidObjectCall("WorkFlow.rescue needs "
+                                    "WorkFlow(state=...)")
+        active = ()
+        if not self.local:
+            self.state.poll(self.slurm)
+            active = (PENDING, RUNNING)
+        states = self.state.states()
+        dag = self.dag()
+        failed = [job for job in self.jobs
+                  if states.get(job.name) not in (DONE,) + active]
+        rescue = dag.descendants(failed)
+        logger.info("WorkFlow RESCUE: %d jobs failed, resubmitting %d of %d",
+                    len(failed), len(rescue), len(self.jobs))
+        if not rescue:
+            return None
+        queued = [job.name for job in rescue if states.get(job.name) in active]
+        if queued:
+            self.state.cancel(queued, self.slurm)
+        ids = self.state.scheduler_ids()
+        upstream = set(up for job in rescue for up in dag.parents[job])
+        self._rescue = rescue
+        self._skipped = set(job for job in self.jobs
+                            if states.get(job.name) == DONE)
+        self._bound = dict((job, ids[job.name]) for job in upstream
+                           if job not in rescue and job not in self._skipped
+                           and job.name in ids)
+        try:
+            return self.run()
+        finally:
+            self._rescue = None
+            self._skipped = set()
+            self._bound = {}
+
+    def wait(self, interval=30, max_interval=600, backoff=2.0,
+             cancel_orphans=False):
+        """Poll the scheduler until the submitted jobs have finished.
+
+        Each poll is one sacct or bjobs call for all unfinished jobs; see
+        StateStore.wait.  Returns {job name: state}.
+
+        """
+        if not self.state:
+            raise InvalidObjectCall("WorkFlow.wait needs WorkFlow(state=...)")
+        return self.state.wait(self.slurm, interval, max_interval, backoff,
+                               cancel_orphans)
+
+    def status(self):
+        """Poll the scheduler once and return {job name: state}.
+
+        """
+        if not self.state:
+            raise InvalidObjectCall("WorkFlow.status needs "
+                                    "WorkFlow(state=...)")
+        if not self.local:
+            self.state.poll(self.slurm)
+        return self.state.states()
+
+    def _local_job_finished(self, job, returncode):
+        """Record a successful local job in the manifest.
+
+        """
+        if self.manifest and returncode == 0:
+            self.manifest.record(job)
+        if self.state:
+            self.state.set(job.name, DONE if returncode == 0 else EXIT,
+                           str(returncode))
+
+    def _run_local(self):
+        """Execute the job graph with a LocalExecutor.
+
+        """
+        jobs = self.jobs_to_run()
+        if self.manifest:
+            self.manifest.record_unrecorded()
+        if self.state:
+            self._record_jobs(dict((job, (None, None, None)) for job in jobs))
+        executor = LocalExecutor(jobs, max_workers=self.max_workers,
+                                 memory=self.max_memory,
+                                 on_finish=self._local_job_finished,
+                                 command=self._local_command)
+        logger.info("WorkFlow LOCAL: %d jobs, %d cpus, %sM memory",
+                    len(jobs), executor.pool.cpus, executor.pool.memory)
+        status = executor.run()
+        for job in executor.failed():
+            logger.error("WorkFlow LOCAL %s: %s", status[job], job.name)
+            if self.state and status[job] != EXIT:
+                self.state.set(job.name, status[job])
+        return status
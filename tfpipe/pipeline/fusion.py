@@ -0,0 +1,304 @@
+"""Fuse linear job chains into single commands.
+
+Consecutive jobs of a chain are linked by a pipe, when both tools can stream,
+or by a named pipe (FIFO) created in place of the intermediate file.  Either
+way the stages run at the same time on one node and the intermediate file is
+never written.
+
+A module declares how it streams through two class attributes:
+
+    _stdin   how the tool reads its input_file from standard input:
+             'drop' leaves out the argument naming the input file,
+             '-' replaces the file name with '-'.
+    _stdout  the same for writing output_file to standard output.
+
+Files given as shell redirections ('<' and '>' arguments, redirect_output)
+stream for every tool.  Tools that seek in their input or output set
+_seeks = True and keep a real file.
+
+"""
+import copy
+from logging import DEBUG
+from tfpipe.base import Job
+from tfpipe.utils import logger
+from tfpipe.pipeline.dag import DAG, replace_jobs
+from tfpipe.pipeline.resources import job_memory_mb, job_runtime
+from tfpipe.pipeline.sizing import seconds, format_walltime
+
+
+def _own_command_line(job):
+    """Jobs that render their own command line cannot be rewritten.
+
+    """
+    return type(job).__str__.__func__ is not Job.__str__.__func__
+
+
+def _find(job, value):
+    """Return ('arg', key) or ('pos', index) of the argument holding value.
+
+    """
+    for key, arg in job.args.items():
+        if arg == value:
+            return ('arg', key)
+    for index, arg in enumerate(job.pos_args):
+        if arg == value:
+            return ('pos', index)
+    return None
+
+
+def _rewrite(job, value, mode):
+    """Apply a 'drop' or '-' stream mode to the argument holding value.
+
+    """
+    where = _find(job, value)
+    if where is None:
+        return False
+    kind, key = where
+    if kind == 'arg' and key in ('<', '>'):
+        mode = 'drop'
+    if mode not in ('drop', '-'):
+        return False
+    if kind == 'arg':
+        if mode == 'drop':
+            del job.args[key]
+        else:
+            job.args[key] = '-'
+    elif mode == 'drop':
+        del job.pos_args[key]
+    else:
+        job.pos_args[key] = '-'
+    return True
+
+
+def _replace(job, value, new):
+    """Point the argument or redirection holding value at new.
+
+    """
+    if job.redirect_output_file == value:
+        job.redirect_output_file = new
+        return True
+    where = _find(job, value)
+    if where is None:
+        return False
+    kind, key = where
+    if kind == 'arg':
+        job.args[key] = new
+    else:
+        job.pos_args[key] = new
+    return True
+
+
+def _stage(job):
+    """Return a copy of job whose arguments can be rewritten.
+
+    """
+    stage = copy.copy(job)
+    stage.args = dict(job.args)
+    stage.pos_args = list(job.pos_args)
+    return stage
+
+
+def to_stdout(job):
+    """Return a copy of job writing its output_file to stdout, or None.
+
+    """
+    stage = _stage(job)
+    if job.output_file and job.redirect_output_file == job.output_file:
+        stage.redirect_output_file = ''
+        return stage
+    if _rewrite(stage, job.output_file, getattr(job, '_stdout', None)):
+        return stage
+    return None
+
+
+def from_stdin(job):
+    """Return a copy of job reading its input_file from stdin, or None.
+
+    """
+    stage = _stage(job)
+    if _rewrite(stage, job.input_file, getattr(job, '_stdin', None)):
+        return stage
+    return None
+
+
+def fifo_path(path):
+    """Return the named pipe replacing intermediate file path.
+
+    """
+    return path + '.fifo'
+
+
+def _through_fifo(producer, consumer):
+    """Return copies of producer and consumer connected through a FIFO.
+
+    """
+    fifo = fifo_path(producer.output_file)
+    producer, consumer = _stage(producer), _stage(consumer)
+    if _replace(producer, producer.output_file, fifo) and \
+            _replace(consumer, consumer.input_file, fifo):
+        return producer, consumer
+    return None
+
+
+PIPE = 'pipe'
+FIFO = 'fifo'
+
+
+class FusedJob(Job):
+    """FusedJob runs a chain of jobs as one shell command.
+
+    The fused job takes the name and job ID of the last stage, so jobs that
+    depended on it keep their dependency.  It asks for the combined cores
+    and memory of its stages, which run concurrently.
+
+    """
+    _cmd = ''
+
+    def __init__(self, stages, links=None):
+        """Initialize FusedJob from the jobs of a chain, in order.
+
+        links[i] is PIPE or FIFO and connects stages i and i + 1; by default
+        all stages are piped.
+
+        """
+        first, last = stages[0], stages[-1]
+        Job.__init__(self, name=last.name)
+        self.stages = list(stages)
+        self.links = list(links or [PIPE] * (len(stages) - 1))
+        self._jobid = last.jobid
+        self.input_file = first.input_file
+        self.output_file = last.output_file
+        self.redirect_output_file = last.redirect_output_file
+        self.append_output_file = last.append_output_file
+        self.job_output_file = last.job_output_file
+        self.queue = last.queue
+        self.numberofprocesses = sum(s.numberofprocesses or 1 for s in stages)
+        memory = [job_memory_mb(s) for s in stages]
+        if any(memory):
+            total = sum(m or 0 for m in memory)
+            self.memory_req_slurm = "%dM" % total
+            self.memory_req_lsf = str(-(-total // 1024))
+        limits = [seconds(s.time_str_slurm) for s in stages
+                  if s.time_str_slurm]
+        if limits:
+            self.time_str_slurm = format_walltime(max(limits))
+            self.time_limit_set = any(s.time_limit_set for s in stages)
+        self.runtime_estimate = max(job_runtime(s) for s in stages)
+        self.scratch = ([s.scratch for s in stages if s.scratch] or [None])[0]
+        internal = set(stages)
+        for stage in stages:
+            for condition, job_list in stage.dep.items():
+                external = [up for up in job_list if up not in internal]
+                if external:
+                    self.add_dependencies(**{condition: external})
+        self._command = self._pipeline()
+
+    def _pipeline(self):
+        """Build the command line.
+
+        Piped stages form segments; segments connected by FIFOs run in the
+        background, except the last.  When a segment ends it opens its FIFOs
+        once, so a neighbour that failed before opening its end does not
+        leave the other blocked.  The FIFOs are removed afterwards and the
+        command fails if any segment failed.
+
+        """
+        stages = list(self.stages)
+        fifos = []
+        for i, link in enumerate(self.links):
+            if link == PIPE:
+                stages[i] = to_stdout(stages[i])
+                stages[i + 1] = from_stdin(stages[i + 1])
+            else:
+                stages[i], stages[i + 1] = _through_fifo(stages[i],
+                                                         stages[i + 1])
+                fifos.append(fifo_path(self.stages[i].output_file))
+        segments = [[]]
+        for i, stage in enumerate(stages):
+            segments[-1].append(" ".join(str(stage).split()))
+            if i < len(self.links) and self.links[i] == FIFO:
+                segments.append([])
+        segments = [" | ".join(commands) for commands in segments]
+        if not fifos:
+            return segments[0]
+        failed = fifos[0][:-len('.fifo')] + '.failed'
+        paths = " ".join(fifos)
+        commands = []
+        for k, segment in enumerate(segments):
+            unblock = "".join(": <> %s; " % fifo
+                              for fifo in fifos[max(k - 1, 0):k + 1])
+            commands.append("{ %s || touch %s; %s}" % (segment, failed,
+                                                       unblock))
+        return ("rm -f %s %s && mkfifo %s && { %s; wait; rm -f %s; "
+                "[ ! -e %s ] || { rm -f %s; false; }; }" %
+                (paths, failed, paths, " & ".join(commands), paths, failed,
+                 failed))
+
+    def __str__(self):
+        return self._command
+
+
+def _link(producer, consumer, dag, readers, pipes, fifos):
+    """Return how consumer can read producer's output, or None.
+
+    The output must be read by consumer only and consumer must be
+    producer's only dependent.  A PIPE needs both tools to stream, a FIFO
+    needs neither to seek.
+
+    """
+    output = producer.output_file
+    if not output or output != consumer.input_file:
+        return None
+    if readers.get(output, 0) != 1 or dag.children[producer] != [consumer]:
+        return None
+    if [c for c, jobs in consumer.dep.items() if producer in jobs] != ['done']:
+        return None
+    if _own_command_line(producer) or _own_command_line(consumer):
+        return None
+    if pipes and to_stdout(producer) is not None and \
+            from_stdin(consumer) is not None:
+        return PIPE
+    if fifos and not getattr(producer, '_seeks', False) and \
+            not getattr(consumer, '_seeks', False) and \
+            _through_fifo(producer, consumer) is not None:
+        return FIFO
+    return None
+
+
+def fuse(jobs, pipes=True, fifos=False):
+    """Return jobs with eligible linear chains replaced by FusedJobs.
+
+    Links are pipes if pipes is True, FIFOs if fifos is True; pipes are
+    preferred when both are allowed.
+
+    Jobs depending on the last stage of a chain are replaced by copies
+    depending on the fused job; the jobs passed in are left as they are.
+
+    """
+    dag = DAG(jobs)
+    readers = {}
+    for job in jobs:
+        values = [job.input_file] + list(job.args.values()) + job.pos_args
+        for value in set(v for v in values if v and v != job.output_file):
+            readers[value] = readers.get(value, 0) + 1
+    successor, link = {}, {}
+    for producer in jobs:
+        for consumer in dag.children[producer]:
+            kind = _link(producer, consumer, dag, readers, pipes, fifos)
+            if kind:
+                successor[producer] = consumer
+                link[producer] = kind
+    starts = set(successor) - set(successor.values())
+    replaced = {}
+    for start in starts:
+        chain = [start]
+        while chain[-1] in successor:
+            chain.append(successor[chain[-1]])
+        fused = FusedJob(chain, [link[stage] for stage in chain[:-1]])
+        for stage in chain:
+            replaced[stage] = fused
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("fuse: %s (%s)",
+                         " ".join(job.name for job in chain),
+                         " ".join(fused.links))
+    return replace_jobs(jobs, replaced)
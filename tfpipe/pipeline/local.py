@@ -0,0 +1,325 @@
+"""Execute a job graph on the local host.
+
+"""
+import os
+import signal
+import threading
+from Queue import Queue, Empty
+from subprocess import Popen, STDOUT
+from tfpipe.base import Job
+from tfpipe.utils import logger
+from tfpipe.pipeline.dag import DAG
+from tfpipe.pipeline.resources import ResourcePool
+from tfpipe.pipeline.retry import local_limit, escalate, TIME
+from tfpipe.pipeline.sizing import seconds
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+EXIT = 'EXIT'
+SKIPPED = 'SKIPPED'
+FINAL = (DONE, EXIT, SKIPPED)
+
+
+class LocalExecutor(object):
+    """LocalExecutor runs jobs as subprocesses from a bounded worker pool.
+
+    The job graph is taken from Job.dep.  A job is ready as soon as every
+    upstream job it depends on has reached a state satisfying the dependency
+    condition.  Ready jobs are taken longest remaining path first and packed
+    onto the CPU and memory budget of a ResourcePool using their
+    numberofprocesses and memory requirements.  Jobs whose dependencies can
+    no longer be satisfied are skipped.  As under a scheduler, a job running
+    past a time_str_slurm limit set for it, or past its class default limit
+    if it has a retry policy, is killed.  Jobs with a retry policy that
+    are killed, by the OOM killer or for their time limit, run again with
+    more memory or time; the raised limits are kept here, not on the jobs.
+
+    """
+    success_conditions = ('done', 'post_done')
+    failure_conditions = ('exit', 'post_err')
+    conditions = success_conditions + failure_conditions + ('started',
+                                                            'ended')
+
+    def __init__(self, jobs, max_workers=None, memory=None, shell='/bin/bash',
+                 pool=None, on_finish=None, command=str):
+        """Initialize LocalExecutor.
+
+        max_workers is the number of cores jobs may occupy at once and memory
+        the memory budget; they default to the cores and physical memory of
+        the host.  A preconfigured ResourcePool may be passed instead.
+        on_finish is called with each job and its return code as it finishes.
+        command(job) gives the command line a job runs.
+
+        """
+        self.dag = DAG(jobs)
+        self.jobs = self.dag.priority_order()
+        self.pool = pool or ResourcePool(cpus=max_workers, memory=memory)
+        self.shell = shell
+        self.on_finish = on_finish
+        self.command = command
+        self.status = dict((job, PENDING) for job in self.jobs)
+        self.returncodes = {}
+        self.attempts = dict((job, 1) for job in self.jobs)
+        self.limits = {}
+        self._finished = Queue()
+        self._running = 0
+        self._procs = {}
+        self._timed_out = set()
+        # Dependencies are settled as their upstream jobs change state, so
+        # each job is checked once, when its last one is settled
+        self._downstream = dict((job, []) for job in self.jobs)
+        self._waiting = {}
+        for job in self.jobs:
+            upstream = [(condition, up) for condition, up in
+                        self._upstream(job) if condition in self.conditions]
+            for condition, up in upstream:
+                self._downstream[up].append((condition, job))
+            self._waiting[job] = len(upstream)
+        self._started = set()
+        self._ready = set()
+        self._check([job for job in self.jobs if not self._waiting[job]])
+
+    def _upstream(self, job):
+        """Return (condition, upstream job) pairs inside this graph.
+
+        Dependencies on jobs that are not part of the graph are ignored.
+
+        """
+        return [(condition, up)
+                for condition, job_list in job.dep.items()
+                for up in job_list
+                if isinstance(up, Job) and up in self.status]
+
+    def _dependency_state(self, job):
+        """Return True if job can run, False if it never can, else None.
+
+        """
+        ready = True
+        for condition, up in self._upstream(job):
+            state = self.status[up]
+            if condition == 'started':
+                satisfied = up in self._started
+                broken = state == SKIPPED
+            elif condition in self.success_conditions:
+                satisfied = state == DONE
+                broken = state in (EXIT, SKIPPED)
+            elif condition in self.failure_conditions:
+                satisfied = state == EXIT
+                broken = state in (DONE, SKIPPED)
+            elif condition == 'ended':
+                satisfied = state in (DONE, EXIT)
+                broken = state == SKIPPED
+            else:
+                logger.warn("%s: '%s' dependency cannot be checked locally",
+                            job.name, condition)
+                satisfied, broken = True, False
+            if broken:
+                return False
+            ready = ready and satisfied
+        return True if ready else None
+
+    def _set_status(self, job, status):
+        """Set the status of job and settle the dependencies on it.
+
+        """
+        self.status[job] = status
+        self._check(self._settle(job))
+
+    def _settle(self, job):
+        """Settle the dependencies on job that its status decides.
+
+        Dependencies on a job starting are settled when it first leaves
+        PENDING, the others when it reaches a final state.  Returns the jobs
+        whose last dependency was settled.
+
+        """
+        status = self.status[job]
+        settled = []
+        if status != PENDING and job not in self._started:
+            self._started.add(job)
+            settled = [down for c, down in self._downstream[job]
+                       if c == 'started']
+        if status in FINAL:
+            self._ready.discard(job)
+            settled += [down for c, down in self._downstream[job]
+                        if c != 'started']
+        checked = []
+        for down in settled:
+            self._waiting[down] -= 1
+            if not self._waiting[down]:
+                checked.append(down)
+        return checked
+
+    def _check(self, jobs):
+        """Mark jobs whose dependencies are all settled ready or SKIPPED.
+
+        Skipping a job settles the dependencies on it in turn.
+
+        """
+        jobs = list(jobs)
+        while jobs:
+            job = jobs.pop()
+            if self.status[job] != PENDING:
+                continue
+            if self._dependency_state(job) is False:
+                logger.warn("%s: skipped, dependencies failed", job.name)
+                self.status[job] = SKIPPED
+                jobs.extend(self._settle(job))
+            else:
+                self._ready.add(job)
+
+    def _ready_jobs(self):
+        """Return pending jobs whose dependencies are satisfied.
+
+        """
+        ready = [job for job in self._ready if self.status[job] == PENDING]
+        ready.sort(key=self.dag.priority)
+        return ready
+
+    def time_limit(self, job):
+        """Return the time limit of job's current attempt in seconds.
+
+        Class default limits only apply to jobs with a retry policy.
+
+        """
+        runtime = self.limits.get(job, (None, None))[1]
+        if runtime:
+            return runtime
+        if not (job.time_limit_set or getattr(job, 'retry_policy', None)):
+            return None
+        return seconds(job.time_str_slurm) if job.time_str_slurm else None
+
+    def _execute(self, job):
+        """Run a single job and report its return code.
+
+        Output and error streams go to the job's output file, as they would
+        under LSF or SLURM.  The job runs in its own process group, killed
+        whole if the job runs out of time.
+
+        """
+        timer = None
+        try:
+            with open(job.job_output_file, 'w') as out:
+                proc = Popen(self.command(job), shell=True, executable=self.shell,
+                             stdout=out, stderr=STDOUT, preexec_fn=os.setsid)
+                self._procs[job] = proc
+                limit = self.time_limit(job)
+                if limit:
+                    timer = threading.Timer(limit, self._time_out, (job,))
+                    timer.daemon = True
+                    timer.start()
+                returncode = proc.wait()
+        except (OSError, IOError) as error:
+            logger.error("%s: could not be started: %s", job.name, error)
+            returncode = -1
+        if timer:
+            timer.cancel()
+        self._procs.pop(job, None)
+        self._finished.put((job, returncode))
+
+    def _kill(self, job):
+        """Kill the process group of a running job.
+
+        """
+        proc = self._procs.get(job)
+        if proc is not None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _time_out(self, job):
+        """Kill job for running past its time limit.
+
+        """
+        self._timed_out.add(job)
+        logger.warn("%s: killed after its %ds time limit", job.name,
+                    self.time_limit(job))
+        self._kill(job)
+
+    def _launch(self, job):
+        """Start job in a worker thread.
+
+        """
+        self._set_status(job, RUNNING)
+        self._running += 1
+        logger.debug("LocalExecutor START: %s", job.name)
+        worker = threading.Thread(target=self._execute, args=(job,))
+        worker.daemon = True
+        worker.start()
+
+    def _collect(self, timeout=None):
+        """Block until a running job finishes and record its state.
+
+        Returns the job, or None if timeout seconds passed first.
+
+        """
+        try:
+            job, returncode = self._finished.get(True, timeout)
+        except Empty:
+            return None
+        self._running -= 1
+        self.pool.release(job)
+        self.returncodes[job] = returncode
+        limit = TIME if job in self._timed_out else local_limit(returncode)
+        self._timed_out.discard(job)
+        if self._retry(job, limit):
+            return job
+        self._set_status(job, DONE if returncode == 0 else EXIT)
+        logger.debug("LocalExecutor %s: %s (exit %d)",
+                     self.status[job], job.name, returncode)
+        if self.on_finish:
+            self.on_finish(job, returncode)
+        return job
+
+    def _retry(self, job, limit):
+        """Requeue job with an escalated limit if its retry policy allows.
+
+        limit is the limit job hit, if any.
+
+        """
+        policy = getattr(job, 'retry_policy', None)
+        if not policy or not limit or \
+                self.attempts[job] >= policy['max_attempts']:
+            return False
+        memory, runtime = escalate(policy, limit, self.pool.request(job)[1],
+                                   self.time_limit(job))
+        self.limits[job] = (memory, runtime)
+        self.pool.memory_requests[job] = memory
+        self.attempts[job] += 1
+        self._set_status(job, PENDING)
+        logger.warn("LocalExecutor RETRY: %s hit its %s limit, attempt %d "
+                    "with %dM and %ss", job.name, limit, self.attempts[job],
+                    memory, runtime)
+        return True
+
+    def run(self):
+        """Run every job in the graph and return the final status map.
+
+        """
+        try:
+            while True:
+                for job in self.pool.select(self._ready_jobs()):
+                    self._launch(job)
+                if not self._running:
+                    break
+                self._collect()
+        except KeyboardInterrupt:
+            # Jobs run in their own process groups, out of reach of Ctrl-C
+            for job in list(self._procs):
+                self._kill(job)
+            raise
+        for job in self.jobs:
+            if self.status[job] == PENDING:
+                self.status[job] = SKIPPED
+                logger.warn("%s: skipped, dependencies never satisfied",
+                            job.name)
+        return self.status
+
+    def failed(self):
+        """Return jobs that exited non-zero or were skipped.
+
+        """
+        return [job for job in self.jobs
+                if self.status[job] in (EXIT, SKIPPED)]
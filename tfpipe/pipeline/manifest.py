@@ -0,0 +1,255 @@
+"""Fingerprint manifest for incremental re-execution of workflows.
+
+The manifest is a directory holding one JSON record per job name.  A record
+is written after the job succeeds and holds fingerprints of the job's
+command line, declared input files and declared output files.  Keeping one
+file per job lets cluster jobs record themselves concurrently.
+
+"""
+import os
+import sys
+import json
+import hashlib
+from pipes import quote
+from tfpipe.utils import logger, python_module
+
+BLOCK_SIZE = 64 * 1024
+SAMPLED_BLOCKS = 16
+
+CHANGED = 'CHANGED'
+MISSING = 'MISSING'
+CURRENT = 'CURRENT'
+
+
+def fingerprint_file(path, block_size=BLOCK_SIZE, blocks=SAMPLED_BLOCKS):
+    """Return a fingerprint of a file's size and content, or None.
+
+    Small files are hashed whole.  Larger files are hashed from a fixed
+    number of evenly spaced blocks, including the first and last, so that
+    multi-gigabyte FASTQ and BAM files cost a few reads.
+
+    """
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.sha1(str(size))
+        with open(path, 'rb') as f:
+            if size <= block_size * blocks:
+                digest.update(f.read())
+            else:
+                step = (size - block_size) // (blocks - 1)
+                for i in range(blocks):
+                    f.seek(i * step)
+                    digest.update(f.read(block_size))
+    except (OSError, IOError):
+        return None
+    return "%d:%s" % (size, digest.hexdigest())
+
+
+def fingerprint_command(command):
+    """Return a fingerprint of a command line.
+
+    """
+    return hashlib.sha1(" ".join(command.split())).hexdigest()
+
+
+def job_inputs(job):
+    """Return the declared input files of a job.
+
+    """
+    return [path for path in (job.input_file,) if path]
+
+
+def job_outputs(job):
+    """Return the declared output files of a job.
+
+    """
+    outputs = []
+    for path in (job.output_file, job.redirect_output_file):
+        if path and path not in outputs:
+            outputs.append(path)
+    return outputs
+
+
+class Manifest(object):
+    """Manifest records job fingerprints and finds out-of-date jobs.
+
+    """
+    def __init__(self, path):
+        """Initialize Manifest stored in directory path.
+
+        """
+        self.path = path
+        self._fingerprints = {}
+        self.unrecorded = []
+
+    def _record_path(self, name):
+        return os.path.join(self.path, "%s.json" % name)
+
+    def _fingerprint(self, path):
+        """Fingerprint a file once per planning pass.
+
+        """
+        if path not in self._fingerprints:
+            self._fingerprints[path] = fingerprint_file(path)
+        return self._fingerprints[path]
+
+    def load(self, name):
+        """Return the record of a job name, or None.
+
+        """
+        try:
+            with open(self._record_path(name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def write(self, name, command, inputs, outputs):
+        """Write a job record, fingerprinting its files now.
+
+        The record is renamed into place so readers never see half of it.
+
+        """
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+        record = {'name': name,
+                  'command': command,
+                  'inputs': dict((p, fingerprint_file(p)) for p in inputs),
+                  'outputs': dict((p, fingerprint_file(p)) for p in outputs)}
+        tmp = "%s.%d.tmp" % (self._record_path(name), os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(record, f, sort_keys=True)
+        os.rename(tmp, self._record_path(name))
+        return record
+
+    def record(self, job):
+        """Record a job that has just finished successfully.
+
+        """
+        return self.write(job.name, fingerprint_command(job.get_command()),
+                          job_inputs(job), job_outputs(job))
+
+    def record_command(self, job, command=None):
+        """Return a shell command that records job once it has run.
+
+        Used to append to jobs submitted to a cluster.  command is the job's
+        command line if already known.
+
+        """
+        files = ["-i %s" % quote(p) for p in job_inputs(job)]
+        files += ["-o %s" % quote(p) for p in job_outputs(job)]
+        return " ".join([python_module('tfpipe.pipeline.manifest'),
+                         quote(self.path), quote(job.name),
+                         fingerprint_command(command or job.get_command())] +
+                        files)
+
+    def _newer_outputs(self, job):
+        """Make rule: all outputs exist and are newer than all inputs.
+
+        """
+        outputs = job_outputs(job)
+        inputs = job_inputs(job)
+        if not outputs or not inputs:
+            return False
+        try:
+            oldest = min(os.path.getmtime(p) for p in outputs)
+            newest = max(os.path.getmtime(p) for p in inputs)
+        except OSError:
+            return False
+        return oldest >= newest
+
+    def state(self, job, produced=None):
+        """Return CURRENT, MISSING or CHANGED for a job.
+
+        CHANGED means the command or an input differs from the record, or
+        there is no record.  MISSING means only outputs are gone or differ.
+        produced maps intermediate files to the fingerprint recorded by the
+        job writing them, so a deleted intermediate does not count as an
+        input change.
+
+        """
+        record = self.load(job.name)
+        if record is None:
+            if self._newer_outputs(job):
+                return CURRENT
+            return CHANGED
+        if record['command'] != fingerprint_command(job.get_command()):
+            return CHANGED
+        recorded_inputs = record['inputs']
+        for path in job_inputs(job):
+            current = self._fingerprint(path)
+            if current is None and produced and path in produced:
+                current = produced[path]
+            if current is None or current != recorded_inputs.get(path):
+                return CHANGED
+        for path in job_outputs(job):
+            if self._fingerprint(path) != record['outputs'].get(path):
+                return MISSING
+        return CURRENT
+
+    def stale(self, dag):
+        """Return the jobs of a DAG that have to run, in DAG job order.
+
+        Changed jobs and everything downstream of them run.  Jobs whose
+        outputs are gone run only if they are final jobs or something
+        downstream runs and needs them; otherwise they and everything
+        upstream of unchanged jobs are skipped.
+
+        Nothing is written: jobs found up to date by their file times alone
+        are kept in unrecorded until record_unrecorded is called.
+
+        """
+        self._fingerprints = {}
+        produced = {}
+        states = {}
+        run = {}
+        for job in dag.topological_order():
+            record = self.load(job.name)
+            if record:
+                produced.update(record['outputs'])
+            states[job] = self.state(job, produced)
+            run[job] = states[job] == CHANGED or \
+                any(run[parent] for parent in dag.parents[job])
+        for job in reversed(dag.topological_order()):
+            if not run[job] and states[job] == MISSING and \
+                    (not dag.children[job] or
+                     any(run[child] for child in dag.children[job])):
+                run[job] = True
+        self.unrecorded = [job for job in dag.jobs if states[job] == CURRENT
+                           and self.load(job.name) is None]
+        stale = [job for job in dag.jobs if run[job]]
+        logger.info("Manifest %s: %d of %d jobs out of date",
+                    self.path, len(stale), len(dag.jobs))
+        return stale
+
+    def record_unrecorded(self):
+        """Record the jobs the last stale call found up to date without a
+        record, so that later runs compare their fingerprints.
+
+        """
+        for job in self.unrecorded:
+            self.record(job)
+        self.unrecorded = []
+
+
+def main(argv):
+    """Record a finished job: manifest name command [-i input] [-o output].
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.pipeline.manifest')
+    parser.add_argument('manifest')
+    parser.add_argument('name')
+    parser.add_argument('command')
+    parser.add_argument('-i', dest='inputs', action='append', default=[])
+    parser.add_argument('-o', dest='outputs', action='append', default=[])
+    args = parser.parse_args(argv)
+    Manifest(args.manifest).write(args.name, args.command,
+                                  args.inputs, args.outputs)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
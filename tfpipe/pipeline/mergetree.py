@@ -0,0 +1,155 @@
+"""Merge many BAM files through a tree of merge jobs.
+
+One samtools merge or MergeSamFiles job over thousands of BAM files opens
+them all at once and runs for hours on one core.  MergeTree merges them in
+groups of at most fan_in files instead: the leaf merges run in parallel,
+each as soon as the jobs writing its files are done, and their outputs are
+merged in turn up to the final output.
+
+    >>> tree = MergeTree(sort_jobs, 'cohort.bam')
+    >>> index.add_dependencies(done=[tree.merge])
+    >>> wf = WorkFlow(sort_jobs + tree.jobs + [index], slurm=True, lsf=False)
+
+Without fan_in, it is about the square root of the number of files, so a
+tree has two levels, lowered so that a leaf merge reads at most LEAF_BYTES
+when the file sizes are known, and at most MAX_FAN_IN to stay clear of open
+file limits.  Intermediate files are written with fast compression.
+
+"""
+from math import ceil, log, sqrt
+from os.path import exists, getsize
+from tfpipe.base import Job
+from tfpipe.modules.picard.tools import Picard
+from tfpipe.utils import logger, InvalidInput
+from tfpipe.pipeline.scatter import split_extension, _merge_job
+
+# Open files per merge
+MAX_FAN_IN = 256
+# Input bytes per leaf merge
+LEAF_BYTES = 64 * 1024 ** 3
+# Files merged by a single job
+MIN_TREE = 16
+
+
+def choose_fan_in(count, sizes=None, max_fan_in=MAX_FAN_IN,
+                  leaf_bytes=LEAF_BYTES):
+    """Return the fan-in of a tree merging count files of the given sizes.
+
+    The fan-in is then lowered as far as the depth of the tree allows, so
+    that its merges are about the same size.
+
+    """
+    if count <= min(MIN_TREE, max_fan_in):
+        return max(2, count)
+    fan_in = int(ceil(sqrt(count)))
+    if sizes:
+        average = float(sum(sizes)) / len(sizes)
+        if average:
+            fan_in = min(fan_in, int(leaf_bytes // average))
+    fan_in = max(2, min(fan_in, max_fan_in))
+    levels = int(ceil(log(count) / log(fan_in) - 1e-9))
+    return max(2, int(ceil(count ** (1.0 / levels) - 1e-9)))
+
+
+def _groups(items, fan_in):
+    """Split items into as few groups of at most fan_in items as possible,
+    of about equal size.
+
+    """
+    groups = (len(items) + fan_in - 1) // fan_in
+    return [items[g * len(items) // groups:(g + 1) * len(items) // groups]
+            for g in range(groups)]
+
+
+class MergeTree(object):
+    """MergeTree merges files into output through levels of merge jobs.
+
+    Inputs are paths or the jobs writing them, as their declared output
+    files; merges depend on the jobs writing the files they read.
+
+    """
+    def __init__(self, inputs, output, fan_in=None, merge=None,
+                 name='merge', directory=None, sizes=None):
+        """Initialize MergeTree.
+
+        Merges are clones of merge, a Job such as MergeSamFilesSLURM(), or
+        samtools merge jobs.  The last is named name and writes output, the
+        others write <output stem>.l<level>_<index>.bam to directory, by
+        default next to output.  sizes are the input sizes in bytes; they
+        are read from the files if they exist.
+
+        """
+        files, writers = [], {}
+        for item in inputs:
+            if isinstance(item, Job):
+                path = item.output_file or item.redirect_output_file
+                if not path:
+                    raise InvalidInput("%s: a merged job needs a declared "
+                                       "output file" % item.name)
+                writers[path] = item
+                item = path
+            files.append(item)
+        if not files:
+            raise InvalidInput("%s: nothing to merge" % name)
+        if fan_in is not None and fan_in < 2:
+            raise InvalidInput("%s: fan_in must be at least 2: %r" %
+                               (name, fan_in))
+        if sizes is None and all(exists(path) for path in files):
+            sizes = [getsize(path) for path in files]
+        self.fan_in = fan_in or choose_fan_in(len(files), sizes)
+        self.template = merge
+        self.levels = []
+        stem, ext = split_extension(output, directory)
+        level = files
+        while len(level) > 1:
+            groups = _groups(level, self.fan_in)
+            last = len(groups) == 1
+            jobs, outputs = [], []
+            for g, group in enumerate(groups):
+                if len(group) == 1:
+                    outputs.extend(group)
+                    continue
+                if last:
+                    target, job_name = output, name
+                else:
+                    target = '%s.l%d_%03d%s' % (stem, len(self.levels), g,
+                                                ext)
+                    job_name = '%s_l%d_%03d' % (name, len(self.levels), g)
+                job = self._merge(job_name, target, group, last)
+                done = [writers[path] for path in group if path in writers]
+                if done:
+                    job.add_dependencies(done=done)
+                writers[target] = job
+                jobs.append(job)
+                outputs.append(target)
+            self.levels.append(jobs)
+            level = outputs
+        if not self.levels:
+            # A single file is merged into output all the same
+            job = self._merge(name, output, files, True)
+            if files[0] in writers:
+                job.add_dependencies(done=[writers[files[0]]])
+            self.levels.append([job])
+        self.merge = self.levels[-1][0]
+        logger.info("%s: merging %d files in %d levels of up to %d",
+                    name, len(files), len(self.levels), self.fan_in)
+
+    def _merge(self, name, output, parts, last):
+        """Return a merge job merging parts into output.
+
+        """
+        merge = self.template.clone(name) if self.template else None
+        job = _merge_job(merge, name, output, parts)
+        if not last:
+            if isinstance(job, Picard):
+                job.add_positional_argument('COMPRESSION_LEVEL=1')
+            else:
+                job.add_argument('-l', '1')
+        return job
+
+    @property
+    def jobs(self):
+        """Return the merge jobs, leaves first.
+
+        """
+        return [job for level in self.levels for job in level]
@@ -0,0 +1,196 @@
+"""Record the resources used by each job.
+
+WorkFlow(metrics=True) runs every job command through this module:
+
+    python -m tfpipe.pipeline.metrics STORE JOBID NAME CLASS [options] --
+        bash -c COMMAND
+
+The wrapper runs the command and appends one JSON line to the metrics store
+with its wall time, user and system CPU time, maximum resident memory and
+bytes read and written, next to what the job requested.  It exits with the
+command's return code.
+
+"""
+import os
+import sys
+import json
+import pipes
+import socket
+from time import time
+from subprocess import Popen
+from tfpipe.utils import logger, python_module
+from tfpipe.pipeline.resources import job_memory_mb
+
+
+def job_class(job):
+    """Return the module class a job's metrics are filed under.
+
+    Wrapped jobs are filed under the jobs they wrap, fused chains under
+    their stages joined by '+'.
+
+    """
+    job = getattr(job, 'job', job)
+    stages = getattr(job, 'stages', [job])
+    return "+".join("%s.%s" % (type(s).__module__, type(s).__name__)
+                    for s in stages)
+
+
+def _proc_io():
+    """Return (bytes read, bytes written) by this process and its children.
+
+    """
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (IOError, ValueError):
+        return None
+    return counters.get('rchar', 0), counters.get('wchar', 0)
+
+
+def measure(argv):
+    """Run argv and return (return code, resource usage record).
+
+    """
+    io_before = _proc_io()
+    start = time()
+    proc = Popen(argv)
+    _, status, usage = os.wait4(proc.pid, 0)
+    end = time()
+    io_after = _proc_io()
+    if os.WIFSIGNALED(status):
+        returncode = 128 + os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    if io_before and io_after:
+        read, written = [a - b for a, b in zip(io_after, io_before)]
+    else:
+        read, written = usage.ru_inblock * 512, usage.ru_oublock * 512
+    return returncode, {'start': start, 'wall': end - start,
+                        'user': usage.ru_utime, 'sys': usage.ru_stime,
+                        'max_rss_mb': usage.ru_maxrss / 1024.0,
+                        'read_bytes': read, 'write_bytes': written,
+                        'returncode': returncode,
+                        'host': socket.gethostname()}
+
+
+class MetricsStore(object):
+    """MetricsStore is an append-only JSON lines file of job records.
+
+    Each record is written with a single append, so jobs on many nodes can
+    share one store.
+
+    """
+    def __init__(self, path):
+        """Initialize MetricsStore.
+
+        """
+        self.path = os.path.abspath(path)
+
+    def append(self, record):
+        """Append one record.
+
+        """
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, json.dumps(record, sort_keys=True) + "\n")
+        finally:
+            os.close(fd)
+
+    def records(self, cls=None):
+        """Return the stored records, optionally only those of class cls.
+
+        Lines that cannot be parsed, e.g. a record cut short, are skipped.
+
+        """
+        result = []
+        if not os.path.exists(self.path):
+            return result
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if cls is None or record.get('class') == cls:
+                    result.append(record)
+        return result
+
+    def summary(self):
+        """Return one line per class comparing requested and used resources.
+
+        """
+        by_class = {}
+        for record in self.records():
+            by_class.setdefault(record['class'], []).append(record)
+        lines = []
+        for cls in sorted(by_class):
+            records = by_class[cls]
+            requested = [r['memory_mb'] for r in records if r.get('memory_mb')]
+            lines.append("%s: %d runs, max rss %.0fM (requested %s), "
+                         "max wall %.0fs, cpu/wall %.2f" % (
+                             cls, len(records),
+                             max(r['max_rss_mb'] for r in records),
+                             "%dM" % max(requested) if requested else "-",
+                             max(r['wall'] for r in records),
+                             sum(r['user'] + r['sys'] for r in records) /
+                             max(sum(r['wall'] for r in records), 1e-9)))
+        return lines
+
+    def prefix(self, job):
+        """Return the wrapper command line for job, up to and including --.
+
+        """
+        args = [self.path, job.jobid, job.name, job_class(job),
+                '--cpus', str(job.numberofprocesses or 1)]
+        memory = job_memory_mb(job)
+        if memory:
+            args += ['--memory', str(memory)]
+        if job.input_file:
+            args += ['--input', str(job.input_file)]
+        return " ".join([python_module('tfpipe.pipeline.metrics')] +
+                        [pipes.quote(arg) for arg in args] + ['--'])
+
+    def command(self, job, command=None):
+        """Return command, by default str(job), wrapped for job.
+
+        """
+        if command is None:
+            command = str(job)
+        return "%s bash -c %s" % (self.prefix(job), pipes.quote(command))
+
+
+def main(argv):
+    """Run a command and record its resource usage.
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.pipeline.metrics')
+    parser.add_argument('store')
+    parser.add_argument('jobid')
+    parser.add_argument('name')
+    parser.add_argument('cls')
+    parser.add_argument('--cpus', type=int)
+    parser.add_argument('--memory', type=int)
+    parser.add_argument('--input', action='append', default=[])
+    parser.add_argument('command', nargs='+')
+    args = parser.parse_args(argv)
+    returncode, record = measure(args.command)
+    record.update({'jobid': args.jobid, 'name': args.name, 'class': args.cls,
+                   'cpus': args.cpus, 'memory_mb': args.memory,
+                   'input_bytes': sum(os.path.getsize(p) for p in args.input
+                                      if os.path.isfile(p))})
+    try:
+        MetricsStore(args.store).append(record)
+    except (IOError, OSError) as error:
+        logger.warn("%s: could not record metrics: %s", args.name, error)
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,318 @@
+"""Pilot mode: run many jobs inside a few large cluster allocations.
+
+WorkFlow writes the job graph to a plan directory and submits one worker per
+allocation.  Workers share the plan over the file system: a job is claimed
+by creating claims/<name> (mkdir is atomic, also on NFS) and its return code
+is written to status/<name> when it finishes.  Each worker packs the jobs it
+claims onto its allocation with a ResourcePool.
+
+The claim of a worker that ran out of wall time is taken over by creating a
+file named after its owner in the claim with O_EXCL, also atomic, so only
+one of the workers finding it expired runs the job again.  A worker leaves
+once the jobs it could start all need more wall time than it has left.
+
+"""
+import os
+import sys
+import json
+import shutil
+import socket
+from time import time, sleep
+from tfpipe.base import Job
+from tfpipe.utils import logger, memory_to_mb, python_module
+from tfpipe.pipeline.local import LocalExecutor
+from tfpipe.pipeline.local import PENDING, RUNNING, DONE, EXIT, SKIPPED
+from tfpipe.pipeline.resources import job_memory_mb
+from tfpipe.pipeline.sizing import seconds
+
+
+class Pilot(object):
+    """Pilot describes the allocations requested in pilot mode.
+
+    """
+    def __init__(self, allocations=1, cpus=16, memory='64G',
+                 walltime='24:00:00', poll=10):
+        """Initialize Pilot.
+
+        allocations workers are submitted, each holding cpus cores and memory
+        for walltime.  Workers check the shared plan every poll seconds while
+        waiting on jobs running elsewhere.
+
+        """
+        self.allocations = allocations
+        self.cpus = cpus
+        self.memory = memory
+        self.walltime = walltime
+        self.poll = poll
+
+    def worker_command(self, plan_dir):
+        """Return the command line starting a worker on plan_dir.
+
+        """
+        return ("%s %s --cpus %d --memory %s --walltime %d --poll %d" %
+                (python_module('tfpipe.pipeline.pilot'), plan_dir, self.cpus,
+                 self.memory, seconds(self.walltime), self.poll))
+
+    def sbatch(self, name, plan_dir):
+        """Return the SLURM submission of one worker allocation.
+
+        """
+        return ('sbatch -J %s -N 1 -n 1 -c %d --mem=%s --time %s -o %s.out '
+                '--wrap="%s"\n' % (name, self.cpus, self.memory, self.walltime,
+                                   name, self.worker_command(plan_dir)))
+
+    def bsub(self, name, plan_dir):
+        """Return the LSF submission of one worker allocation.
+
+        """
+        walltime = ":".join(str(self.walltime).strip('"\'').split(':')[:2])
+        return ('bsub -J %s -n %d -R "span[hosts=1]" -M %d -W %s -o %s.out '
+                '%s\n' % (name, self.cpus, memory_to_mb(self.memory) // 1024,
+                          walltime, name, self.worker_command(plan_dir)))
+
+
+class PilotTask(Job):
+    """Job rebuilt by a worker from the plan.
+
+    """
+    _cmd = ''
+
+
+def plan_text(jobs, command=str):
+    """Return the JSON plan of jobs.
+
+    command(job) gives the command line each job runs.
+
+    """
+    names = set(job.name for job in jobs)
+    tasks = []
+    for job in jobs:
+        memory = job_memory_mb(job)
+        tasks.append({
+            'name': job.name,
+            'command': command(job),
+            'output': job.job_output_file,
+            'cpus': job.numberofprocesses,
+            'memory': "%dM" % memory if memory else None,
+            'runtime': job.runtime_estimate,
+            'walltime': job.time_str_slurm if job.time_limit_set else None,
+            'retry': job.retry_policy,
+            'dep': dict((condition, [up.name for up in job_list
+                                     if isinstance(up, Job) and
+                                     up.name in names])
+                        for condition, job_list in job.dep.items())})
+    return json.dumps(tasks, indent=1)
+
+
+def reset_plan(plan_dir):
+    """Clear the claims and statuses of a previous run of plan_dir.
+
+    """
+    for sub in ('claims', 'status'):
+        path = os.path.join(plan_dir, sub)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+
+def load_plan(plan_dir):
+    """Rebuild the jobs of a plan as PilotTasks.
+
+    """
+    with open(os.path.join(plan_dir, 'plan.json')) as f:
+        tasks = json.load(f)
+    jobs = {}
+    for task in tasks:
+        job = PilotTask(cmd=str(task['command']), name=str(task['name']))
+        job.job_output_file = task['output']
+        job.numberofprocesses = task['cpus']
+        job.memory_req_slurm = task['memory']
+        job.runtime_estimate = task['runtime']
+        if task.get('walltime'):
+            job.time_str_slurm = str(task['walltime'])
+        job.retry_policy = task.get('retry')
+        jobs[job.name] = job
+    for task in tasks:
+        for condition, names in task['dep'].items():
+            if names:
+                jobs[task['name']].add_dependencies(
+                    **{str(condition): [jobs[n] for n in names]})
+    return [jobs[task['name']] for task in tasks]
+
+
+class PilotWorker(LocalExecutor):
+    """PilotWorker runs plan jobs claimed by this allocation.
+
+    Jobs claimed by other workers show as RUNNING until their status
+    appears.  Claims of a worker whose wall time has passed are taken over.
+    A job is only claimed if its runtime estimate fits in the wall time left.
+
+    """
+    def __init__(self, plan_dir, cpus=None, memory=None, walltime=None,
+                 poll=10):
+        """Initialize PilotWorker.
+
+        """
+        LocalExecutor.__init__(self, load_plan(plan_dir), max_workers=cpus,
+                               memory=memory, on_finish=self._write_status)
+        self.plan_dir = plan_dir
+        self.poll = poll
+        self.deadline = time() + walltime if walltime else None
+        self.mine = set()
+
+    def _path(self, kind, job):
+        return os.path.join(self.plan_dir, kind, job.name)
+
+    def _write_status(self, job, returncode):
+        """Publish a finished job's return code.
+
+        """
+        tmp = "%s.%s.%d" % (self._path('status', job), socket.gethostname(),
+                            os.getpid())
+        with open(tmp, 'w') as f:
+            f.write("%d\n" % returncode)
+        os.rename(tmp, self._path('status', job))
+
+    def _fits(self, job):
+        """True if job's runtime estimate fits in the wall time left.
+
+        """
+        return not self.deadline or \
+            time() + (job.runtime_estimate or 0) <= self.deadline
+
+    def _claim(self, job):
+        """Try to claim job for this worker.
+
+        """
+        if not self._fits(job):
+            return False
+        claim = self._path('claims', job)
+        try:
+            os.mkdir(claim)
+        except OSError:
+            if not self._take_over(claim):
+                return False
+            logger.warn("%s: taking over claim of expired worker", job.name)
+        owner = os.path.join(claim, 'owner')
+        tmp = "%s.%s.%d" % (owner, socket.gethostname(), os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(),
+                       'deadline': self.deadline}, f)
+        os.rename(tmp, owner)
+        self.mine.add(job)
+        return True
+
+    def _owner(self, claim):
+        """Return the owner record of claim, or None while it is written.
+
+        """
+        try:
+            with open(os.path.join(claim, 'owner')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _expired(self, claim, owner=None):
+        """True if the worker owning claim has run out of wall time.
+
+        """
+        owner = owner or self._owner(claim)
+        deadline = owner.get('deadline') if owner else None
+        return deadline is not None and time() > deadline + 60
+
+    def _take_over(self, claim):
+        """Try to take over the claim of an expired worker.
+
+        Workers finding the same owner expired race to create a file named
+        after it; O_EXCL lets only one of them succeed.
+
+        """
+        owner = self._owner(claim)
+        if not self._expired(claim, owner):
+            return False
+        taken = os.path.join(claim, 'taken.%s.%s' % (owner.get('host'),
+                                                     owner.get('pid')))
+        try:
+            os.close(os.open(taken, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError:
+            return False
+        return True
+
+    def _refresh(self):
+        """Update the state of jobs handled by other workers.
+
+        """
+        for job in self.jobs:
+            if job in self.mine or self.status[job] in (DONE, EXIT, SKIPPED):
+                continue
+            try:
+                with open(self._path('status', job)) as f:
+                    returncode = int(f.read())
+                self.returncodes[job] = returncode
+                self._set_status(job, DONE if returncode == 0 else EXIT)
+            except (IOError, ValueError):
+                claim = self._path('claims', job)
+                if os.path.isdir(claim) and not self._expired(claim):
+                    self._set_status(job, RUNNING)
+                else:
+                    self._set_status(job, PENDING)
+
+    def run(self):
+        """Claim and run jobs until the plan is finished or time runs out.
+
+        """
+        while True:
+            self._refresh()
+            ready = self._ready_jobs()
+            fits = [job for job in ready if self._fits(job)]
+            for job in self.pool.select(fits):
+                if self._claim(job):
+                    self._launch(job)
+                else:
+                    self.pool.release(job)
+            if self._running:
+                self._collect(self.poll)
+                continue
+            pending = [job for job in self.jobs
+                       if self.status[job] in (PENDING, RUNNING)]
+            if not pending:
+                break
+            if self.deadline and time() > self.deadline:
+                logger.warn("PilotWorker: wall time reached, %d jobs left",
+                            len(pending))
+                break
+            if [job for job in pending if self.status[job] == RUNNING]:
+                sleep(self.poll)
+                continue
+            if ready and not fits:
+                logger.error("PilotWorker: %d jobs need more wall time than "
+                             "is left: %s", len(ready),
+                             " ".join(job.name for job in ready))
+                break
+            if not ready:
+                break
+            sleep(self.poll)
+        return self.status
+
+
+def main(argv):
+    """Run a pilot worker: plan_dir [--cpus N] [--memory M] [--walltime S].
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.pipeline.pilot')
+    parser.add_argument('plan_dir')
+    parser.add_argument('--cpus', type=int)
+    parser.add_argument('--memory')
+    parser.add_argument('--walltime', type=int)
+    parser.add_argument('--poll', type=int, default=10)
+    args = parser.parse_args(argv)
+    worker = PilotWorker(args.plan_dir, cpus=args.cpus,
+                         memory=memory_to_mb(args.memory),
+                         walltime=args.walltime, poll=args.poll)
+    worker.run()
+    return 1 if worker.failed() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
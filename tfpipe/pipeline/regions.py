@@ -0,0 +1,261 @@
+"""Run genome-wide jobs in parallel by genomic region.
+
+RegionShards turns one genome-wide job, such as a Plink association test or
+an Fseq peak call, into a job per chromosome, or per fixed-size window, and
+a job merging their results:
+
+    >>> assoc = Plink(name='assoc')
+    >>> assoc.add_argument('--bfile', 'panel')
+    >>> assoc.add_argument('--assoc')
+    >>> assoc.add_argument('--out', 'gwas.{region}')
+    >>> assoc.output_file = 'gwas.{region}.assoc'
+    >>> shards = RegionShards(assoc, 'hg19.genome', window=10000000,
+    ...                       output='gwas.assoc')
+    >>> wf = WorkFlow(shards.jobs, slurm=True, lsf=False)
+
+The genome is a table of chromosome names and sizes, a file such as a
+bedtools .genome file, a chrom.sizes file or a samtools .fai index, or a
+list of (name, size) pairs.  '{chrom}', '{start}', '{end}' and '{region}'
+in the template's arguments and files are replaced in each shard; regions
+are 1-based and inclusive.  A declared output file without them is the
+merged output, and the shards write next to it.
+
+A module declares how it is restricted to a region through class
+attributes:
+
+    _region_args    (flag, value) arguments restricting the tool to a
+                    region, values formatted with chrom, start, end,
+                    start_kb and end_kb.
+    _region_input   'bed' to filter the BED input_file to the region.
+    _region_pad     bases read on each side of a window from a BED input,
+                    so that features crossing its edges are called whole;
+                    each is kept by the window holding its start.
+    _region_header  header lines of each output, kept once by the merge.
+    _region_sort    sort(1) keys putting the merged rows in order.
+
+Tools with neither _region_args nor _region_input, such as Mach1, are
+sharded by chromosome only, with '{chrom}' naming their per-chromosome
+input files.
+
+"""
+from math import ceil
+from pipes import quote
+from tfpipe.base import Job
+from tfpipe.utils import InvalidInput
+from tfpipe.pipeline.scatter import MIN_CHUNK_TIME, split_extension
+from tfpipe.pipeline.scatter import _retarget, _rewrite
+from tfpipe.pipeline.sizing import seconds, format_walltime
+
+PLACEHOLDERS = ('{chrom}', '{start}', '{end}', '{region}')
+
+
+def read_genome(genome):
+    """Return [(chromosome, size)] from a chromosome size table.
+
+    genome is a path or a list of pairs.  Only the first two columns of a
+    file are read, so .fai indexes work.
+
+    """
+    if not isinstance(genome, basestring):
+        return [(name, int(size)) for name, size in genome]
+    sizes = []
+    with open(genome) as f:
+        for line in f:
+            fields = line.split()
+            if fields and not fields[0].startswith('#'):
+                try:
+                    sizes.append((fields[0], int(fields[1])))
+                except (IndexError, ValueError):
+                    raise InvalidInput("%s: not a chromosome size table: %r"
+                                       % (genome, line))
+    return sizes
+
+
+def genome_regions(genome, window=None):
+    """Return the (chrom, start, end, name) regions of a genome.
+
+    Without window each chromosome is a region named after it; otherwise
+    windows are named chrom_0000, chrom_0001 and so on.
+
+    """
+    if window is not None and window < 1:
+        raise InvalidInput("window must be at least 1: %r" % window)
+    regions = []
+    for chrom, size in read_genome(genome):
+        if window is None:
+            regions.append((chrom, 1, size, chrom))
+            continue
+        for i, start in enumerate(range(1, size + 1, window)):
+            regions.append((chrom, start, min(size, start + window - 1),
+                            '%s_%04d' % (chrom, i)))
+    return regions
+
+
+def _kb(position):
+    return ('%.3f' % (position / 1000.0)).rstrip('0').rstrip('.')
+
+
+def _substitute(job, region):
+    """Replace the region placeholders wherever job names them.
+
+    """
+    chrom, start, end, name = region
+    for placeholder, value in zip(PLACEHOLDERS, (chrom, start, end, name)):
+        _rewrite(job, lambda text: text.replace(placeholder, str(value)))
+
+
+class MergeRegions(Job):
+    """MergeRegions concatenates the outputs of region shards and sorts them.
+
+    The header of the first part is kept, the others' dropped.
+
+    """
+    _cmd = ''
+    _runtime_estimate = 10 * 60
+    _memory_req_slurm = '2G'
+    _time_str_slurm = '"02:00:00"'
+
+    def __init__(self, output, parts, name, header=0, sort=None, clip=None):
+        """Initialize MergeRegions writing parts to output.
+
+        clip holds the (chrom, start, end) region of each part, for BED-like
+        parts: only the rows starting in its region are kept, so features
+        called by two overlapping shards are kept once.
+
+        """
+        Job.__init__(self, name=name)
+        self.output_file = output
+        self.parts = list(parts)
+        self.header = header
+        self.sort = sort
+        self.clip = list(clip) if clip else None
+        # The clip scripts' fields expand on the node
+        self._runtime_shell = bool(clip)
+
+    def __str__(self):
+        files = " ".join(quote(part) for part in self.parts)
+        if self.clip:
+            script = quote('FNR > h && $1 == c && $2 >= s - 1 && $2 < e')
+            rows = "{ %s; }" % "; ".join(
+                "awk -v h=%d -v c=%s -v s=%d -v e=%d %s %s" % (
+                    self.header, quote(chrom), start, end, script,
+                    quote(part))
+                for part, (chrom, start, end) in zip(self.parts, self.clip))
+        elif self.header:
+            rows = "tail -q -n +%d %s" % (self.header + 1, files)
+        elif self.sort:
+            return "LC_ALL=C sort %s %s > %s" % (self.sort, files,
+                                                 quote(self.output_file))
+        else:
+            return "cat %s > %s" % (files, quote(self.output_file))
+        if self.sort:
+            rows += " | LC_ALL=C sort %s" % self.sort
+        if self.header:
+            return "(head -n %d %s && %s) > %s" % (
+                self.header, quote(self.parts[0]), rows,
+                quote(self.output_file))
+        return "%s > %s" % (rows, quote(self.output_file))
+
+
+class RegionShards(object):
+    """RegionShards runs a template job once per genomic region.
+
+    The template is not run itself.  Its dependencies are passed on to the
+    shards, and jobs downstream should depend on merge.
+
+    """
+    def __init__(self, template, genome, window=None, output=None,
+                 merge=True, pad=None):
+        """Initialize RegionShards.
+
+        Shards are clones of template named <name>_<region>.  With merge,
+        their declared outputs are merged into output, by default the
+        template's output; merge is False for outputs that cannot be
+        concatenated, such as Mach1 haplotypes.  pad overrides the
+        template's _region_pad.
+
+        """
+        region_args = getattr(template, '_region_args', None)
+        region_input = getattr(template, '_region_input', None)
+        if window is not None and not (region_args or region_input):
+            raise InvalidInput("%s: %s can only be sharded by chromosome" %
+                               (template.name, type(template).__name__))
+        if region_input and not template.input_file:
+            raise InvalidInput("%s: the template needs a declared input "
+                               "file" % template.name)
+        declared = template.output_file or template.redirect_output_file
+        templated = declared and any(p in declared for p in PLACEHOLDERS)
+        if merge and not declared:
+            raise InvalidInput("%s: the template needs a declared output "
+                               "file" % template.name)
+        if merge and templated and not output:
+            raise InvalidInput("%s: name the merged output" % template.name)
+        if pad is None:
+            pad = getattr(template, '_region_pad', 0)
+        self.template = template
+        self.regions = genome_regions(genome, window)
+        if not self.regions:
+            raise InvalidInput("%s: the genome has no chromosomes" %
+                               template.name)
+        upstream = dict((c, list(jobs)) for c, jobs in template.dep.items())
+        runtime = template.runtime_estimate
+        limit = seconds(template.time_str_slurm)
+        total = float(sum(end - start + 1
+                          for _, start, end, _ in self.regions))
+        self.shards = []
+        parts = []
+        for region in self.regions:
+            chrom, start, end, name = region
+            job = template.clone('%s_%s' % (template.name, name))
+            _substitute(job, region)
+            if declared and not templated:
+                stem, ext = split_extension(declared)
+                _retarget(job, declared, '%s.%s%s' % (stem, name, ext))
+            for flag, value in region_args or ():
+                job.add_argument(flag, value.format(
+                    chrom=chrom, start=start, end=end, start_kb=_kb(start),
+                    end_kb=_kb(end)))
+            if region_input == 'bed':
+                self._filter_bed(job, template.input_file, region, pad)
+            if declared:
+                parts.append(job.output_file or job.redirect_output_file)
+            job.add_dependencies(**upstream)
+            share = (end - start + 1) / total
+            if runtime:
+                job.runtime_estimate = int(ceil(runtime * share))
+            job.time_str_slurm = format_walltime(
+                max(MIN_CHUNK_TIME, 2.0 * limit * share))
+            job.time_limit_set = template.time_limit_set
+            self.shards.append(job)
+        self.merge = None
+        if merge:
+            clip = None
+            if region_input == 'bed' and window is not None:
+                clip = [region[:3] for region in self.regions]
+            self.merge = MergeRegions(
+                output or declared, parts, '%s_merge' % template.name,
+                getattr(template, '_region_header', 0),
+                getattr(template, '_region_sort', None), clip)
+            self.merge.add_dependencies(done=list(self.shards))
+
+    @staticmethod
+    def _filter_bed(job, bed, region, pad=0):
+        """Have job read the reads of bed overlapping region, widened by pad
+        bases on each side.
+
+        """
+        chrom, start, end, _ = region
+        script = '$1 == c && $2 < e && $3 >= s'
+        _retarget(job, bed, "<(awk -v c=%s -v s=%d -v e=%d %s %s)" % (
+            quote(chrom), max(1, start - pad), end + pad, quote(script),
+            quote(bed)))
+        # Still reads the original file
+        job.input_file = bed
+        job._bash = True
+
+    @property
+    def jobs(self):
+        """Return the shard and merge jobs.
+
+        """
+        return self.shards + ([self.merge] if self.merge else [])
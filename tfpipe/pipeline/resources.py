@@ -0,0 +1,186 @@
+"""Resource accounting for jobs run outside of LSF or SLURM.
+
+"""
+import os
+from time import time
+from tfpipe.utils import logger, memory_to_mb
+
+# Units used by job memory requirements that carry no explicit suffix.
+# SLURM --mem defaults to megabytes; our LSF sites configure -M in gigabytes.
+SLURM_MEMORY_UNIT = 'M'
+LSF_MEMORY_UNIT = 'G'
+
+
+def physical_memory_mb():
+    """Return the physical memory of this host in megabytes.
+
+    """
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') *
+                   os.sysconf('SC_PHYS_PAGES') / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def cpu_count():
+    """Return the number of cores of this host.
+
+    """
+    # multiprocessing is slow to import and only needed here
+    from multiprocessing import cpu_count
+    return cpu_count()
+
+
+def job_memory_mb(job):
+    """Return the memory a job asks for in megabytes, or None.
+
+    The SLURM request is preferred since it carries units.
+
+    """
+    memory = memory_to_mb(job.memory_req_slurm, SLURM_MEMORY_UNIT)
+    if memory is None:
+        memory = memory_to_mb(job.memory_req_lsf, LSF_MEMORY_UNIT)
+    return memory
+
+
+def job_runtime(job, default=3600):
+    """Return a job's expected runtime in seconds.
+
+    """
+    return getattr(job, 'runtime_estimate', None) or default
+
+
+class ResourcePool(object):
+    """ResourcePool packs jobs onto a fixed CPU and memory budget.
+
+    Jobs are considered in priority order and started first-fit.  When the
+    highest priority job does not fit, it gets a reservation at the earliest
+    time enough running jobs are expected to finish (the shadow time).  Lower
+    priority jobs are then only backfilled if they are expected to finish
+    before the shadow time, or if they fit in capacity the reserved job will
+    not need, so large memory jobs are not starved by a stream of small ones.
+
+    """
+    def __init__(self, cpus=None, memory=None, default_memory=1024,
+                 default_runtime=3600):
+        """Initialize ResourcePool.
+
+        cpus defaults to the number of cores and memory (megabytes, or a
+        string such as '240G') to the physical memory of the host.  Jobs that
+        do not declare a memory requirement are charged default_memory, jobs
+        without a runtime estimate default_runtime seconds.
+
+        """
+        self.cpus = cpus or cpu_count()
+        self.memory = memory_to_mb(memory) or physical_memory_mb()
+        self.default_memory = default_memory
+        self.default_runtime = default_runtime
+        self.used_cpus = 0
+        self.used_memory = 0
+        self.reserved = None
+        self.memory_requests = {}
+        self._held = {}
+
+    def request(self, job):
+        """Return the (cpus, memory) a job will hold while running.
+
+        Requests larger than the pool are clamped so the job can still run
+        on its own.  memory_requests overrides the memory of jobs, as
+        retries raise it.
+
+        """
+        cpus = max(1, int(job.numberofprocesses or 1))
+        memory = self.memory_requests.get(job) or job_memory_mb(job)
+        if memory is None:
+            memory = self.default_memory
+        if cpus > self.cpus:
+            logger.warn("%s: requests %d cpus, pool has %d",
+                        job.name, cpus, self.cpus)
+            cpus = self.cpus
+        if self.memory and memory > self.memory:
+            logger.warn("%s: requests %dM memory, pool has %dM",
+                        job.name, memory, self.memory)
+            memory = self.memory
+        return cpus, memory
+
+    def _fits(self, cpus, memory):
+        """Check a request against free capacity.
+
+        """
+        if self.used_cpus + cpus > self.cpus:
+            return False
+        if self.memory and self.used_memory + memory > self.memory:
+            return False
+        return True
+
+    def _shadow(self, cpus, memory):
+        """Return (shadow time, spare cpus, spare memory) for a reservation.
+
+        The shadow time is when enough running jobs are expected to finish for
+        the request to fit; the spare capacity is what will be left over then.
+
+        """
+        free_cpus = self.cpus - self.used_cpus
+        free_memory = (self.memory or 0) - self.used_memory
+        shadow = time()
+        for end, held_cpus, held_memory in sorted(
+                (start + runtime, c, m)
+                for c, m, start, runtime in self._held.values()):
+            if free_cpus >= cpus and (not self.memory or free_memory >= memory):
+                break
+            shadow = end
+            free_cpus += held_cpus
+            free_memory += held_memory
+        return shadow, free_cpus - cpus, free_memory - memory
+
+    def acquire(self, job, cpus, memory):
+        """Charge a job's resources to the pool.
+
+        """
+        self.used_cpus += cpus
+        self.used_memory += memory
+        self._held[job] = (cpus, memory, time(),
+                           job_runtime(job, self.default_runtime))
+
+    def release(self, job):
+        """Return a finished job's resources to the pool.
+
+        """
+        cpus, memory, _, _ = self._held.pop(job, (0, 0, 0, 0))
+        self.used_cpus -= cpus
+        self.used_memory -= memory
+
+    def select(self, ready):
+        """Acquire resources for, and return, the ready jobs to start now.
+
+        ready must be in priority order.
+
+        """
+        started = []
+        self.reserved = None
+        for job in ready:
+            cpus, memory = self.request(job)
+            if not self._fits(cpus, memory):
+                if self.reserved is None:
+                    self.reserved = job
+                    shadow, spare_cpus, spare_memory = self._shadow(cpus, memory)
+                    logger.debug("ResourcePool RESERVE: %s (%d cpus, %dM)",
+                                 job.name, cpus, memory)
+                continue
+            if self.reserved is not None:
+                # Backfill: never delay the reserved job
+                ends = time() + job_runtime(job, self.default_runtime)
+                if ends > shadow:
+                    if cpus > spare_cpus or (self.memory and memory > spare_memory):
+                        continue
+                    spare_cpus -= cpus
+                    spare_memory -= memory
+            self.acquire(job, cpus, memory)
+            started.append(job)
+        return started
+
+    def idle(self):
+        """True when no job holds resources.
+
+        """
+        return not self._held
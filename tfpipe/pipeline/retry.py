@@ -0,0 +1,205 @@
+"""Retry jobs that hit their memory or time limit.
+
+A job with a retry policy (Job.add_retry) that is killed for exceeding its
+memory or time limit is run again with that limit multiplied, up to
+max_attempts runs.  Real tool errors are not retried.
+
+Locally the LocalExecutor requeues the job itself, and kills jobs that run
+past their time limit as a scheduler would.  On a cluster WorkFlow
+submits a small watcher job that only starts if the job fails:
+
+    python -m tfpipe.pipeline.retry {slurm,lsf} JOB NAME [options]
+
+The watcher asks the scheduler why the job ended.  If the job hit a limit,
+the watcher requeues the same job, so its ID, and the dependencies of its
+dependents, are kept.  It raises the limit and submits the watcher for the
+next attempt.
+
+"""
+import sys
+from subprocess import check_output, call, CalledProcessError
+from tfpipe.utils import logger, python_module
+from tfpipe.pipeline.sizing import format_walltime
+
+MEMORY = 'memory'
+TIME = 'time'
+
+# Exit codes of processes killed by SIGKILL, as the OOM killer does
+KILLED = (-9, 137)
+SLURM_STATES = {'OUT_OF_MEMORY': MEMORY, 'TIMEOUT': TIME}
+LSF_REASONS = {'TERM_MEMLIMIT': MEMORY, 'TERM_RUNLIMIT': TIME}
+
+
+def local_limit(returncode):
+    """Return the limit a local job with returncode hit, or None.
+
+    """
+    return MEMORY if returncode in KILLED else None
+
+
+def slurm_limit(state, exit_code=''):
+    """Return the limit a SLURM job ending in state hit, or None.
+
+    """
+    limit = SLURM_STATES.get(state.split()[0] if state else '')
+    if not limit and exit_code.split(':')[-1] == '9':
+        limit = MEMORY
+    return limit
+
+
+def lsf_limit(text):
+    """Return the limit named in LSF job information text, or None.
+
+    """
+    for reason, limit in LSF_REASONS.items():
+        if reason in text:
+            return limit
+    return None
+
+
+def escalate(policy, limit, memory, runtime):
+    """Return memory (MB) and runtime (seconds) raised for limit.
+
+    """
+    if limit == MEMORY and memory:
+        memory = int(memory * policy['memory_factor'])
+    if limit == TIME and runtime:
+        runtime = int(runtime * policy['time_factor'])
+    return memory, runtime
+
+
+def watcher_args(policy, attempt, memory, runtime):
+    """Return the watcher's options after JOB and NAME.
+
+    """
+    args = "--attempt %d --max-attempts %d --memory-factor %s " \
+           "--time-factor %s" % (attempt, policy['max_attempts'],
+                                 policy['memory_factor'],
+                                 policy['time_factor'])
+    if memory:
+        args += " --memory %d" % memory
+    if runtime:
+        args += " --time %d" % runtime
+    return args
+
+
+def slurm_watcher(jobref, name, args):
+    """Return the sbatch line of a watcher for SLURM job jobref.
+
+    """
+    return ('sbatch -J %s_retry --dependency=afternotok:%s '
+            '--kill-on-invalid-dep=yes -o %s_retry.out --time 00:10:00 '
+            '--mem=256M --wrap="%s slurm %s %s %s"\n' %
+            (name, jobref, name, python_module('tfpipe.pipeline.retry'),
+             jobref, name, args))
+
+
+def lsf_watcher(name, args):
+    """Return the bsub line of a watcher for LSF job name.
+
+    """
+    return ('bsub -J %s_retry -w "exit(%s)" -ti -o %s_retry.out -W 0:10 '
+            '%s lsf %s %s %s\n' %
+            (name, name, name, python_module('tfpipe.pipeline.retry'), name,
+             name, args))
+
+
+def watcher(job, memory, runtime, slurm=True):
+    """Return the submission of the first watcher of a job.
+
+    memory (MB) and runtime (seconds) are the limits the job was submitted
+    with.
+
+    """
+    args = watcher_args(job.retry_policy, 1, memory, runtime)
+    if slurm:
+        return slurm_watcher("$%s" % job.jobid, job.name, args)
+    return lsf_watcher(job.name, args)
+
+
+def slurm_requeue(jobid, memory, runtime):
+    """Return the commands requeuing SLURM job jobid with new limits.
+
+    """
+    update = ['scontrol', 'update', 'JobId=%s' % jobid]
+    if memory:
+        update.append('MinMemoryNode=%dM' % memory)
+    if runtime:
+        update.append('TimeLimit=%s' % format_walltime(runtime).strip('"'))
+    return [['scontrol', 'requeuehold', jobid], update,
+            ['scontrol', 'release', jobid]]
+
+
+def lsf_requeue(jobid, memory, runtime):
+    """Return the commands requeuing LSF job jobid with new limits.
+
+    """
+    modify = ['bmod']
+    if memory:
+        modify += ['-M', str(-(-memory // 1024))]
+    if runtime:
+        modify += ['-W', format_walltime(runtime, lsf=True)]
+    return [['brequeue', '-e', '-H', jobid], modify + [jobid],
+            ['bresume', jobid]]
+
+
+def main(argv):
+    """Requeue a failed job with a raised limit if it hit one.
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.pipeline.retry')
+    parser.add_argument('scheduler', choices=('slurm', 'lsf'))
+    parser.add_argument('job')
+    parser.add_argument('name')
+    parser.add_argument('--attempt', type=int, default=1)
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--memory', type=int)
+    parser.add_argument('--time', type=int)
+    parser.add_argument('--memory-factor', type=float, default=2.0)
+    parser.add_argument('--time-factor', type=float, default=2.0)
+    args = parser.parse_args(argv)
+    try:
+        if args.scheduler == 'slurm':
+            jobid = args.job
+            state, exit_code = check_output(
+                ['sacct', '-j', jobid, '-n', '-P', '-X', '-o',
+                 'State,ExitCode']).strip().splitlines()[-1].split('|')
+            limit = slurm_limit(state, exit_code)
+        else:
+            info = check_output(['bjobs', '-a', '-l', '-J', args.job])
+            jobid = info.split('<', 1)[1].split('>', 1)[0]
+            limit = lsf_limit(info)
+    except (CalledProcessError, OSError, IndexError, ValueError) as error:
+        logger.error("%s: could not query the scheduler: %s",
+                     args.name, error)
+        return 1
+    if not limit:
+        logger.info("%s: failed without hitting a limit, not retried",
+                    args.name)
+        return 0
+    if args.attempt >= args.max_attempts:
+        logger.error("%s: hit its %s limit after %d attempts",
+                     args.name, limit, args.attempt)
+        return 1
+    policy = {'max_attempts': args.max_attempts,
+              'memory_factor': args.memory_factor,
+              'time_factor': args.time_factor}
+    memory, runtime = escalate(policy, limit, args.memory, args.time)
+    logger.warn("%s: hit its %s limit, attempt %d with %sM and %ss",
+                args.name, limit, args.attempt + 1, memory, runtime)
+    requeue = slurm_requeue if args.scheduler == 'slurm' else lsf_requeue
+    for command in requeue(jobid, memory, runtime):
+        if call(command):
+            logger.error("%s: '%s' failed", args.name, " ".join(command))
+            return 1
+    options = watcher_args(policy, args.attempt + 1, memory, runtime)
+    if args.scheduler == 'slurm':
+        submit = slurm_watcher(jobid, args.name, options)
+    else:
+        submit = lsf_watcher(args.name, options)
+    return call(submit, shell=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
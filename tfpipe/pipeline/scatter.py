@@ -0,0 +1,306 @@
+"""Align reads in parallel chunks.
+
+ScatterGather turns one aligner job into many short ones.  The FASTQ files
+of a template job, such as a Gsnap or BowTie job set up for a whole sample,
+are split into record-aligned chunks, a clone of the template aligns each
+chunk and the chunk alignments are merged into the template's output:
+
+    >>> align = Gsnap(name='align_S1')
+    >>> align.add_argument('-A', 'sam')
+    >>> align.add_positional_argument('S1_R1.fq.gz', 'input')
+    >>> align.add_positional_argument('S1_R2.fq.gz')
+    >>> align.redirect_output('S1.sam', 'output')
+    >>> sg = ScatterGather(align, 16, fastqs=['S1_R1.fq.gz', 'S1_R2.fq.gz'],
+    ...                    merge=MergeSamFilesSLURM(name='merge_S1'))
+    >>> call_peaks.add_dependencies(done=[sg.merge])
+    >>> wf = WorkFlow(sg.jobs + [call_peaks], slurm=True, lsf=False)
+
+Records are dealt round-robin, so the chunks of paired files stay paired.
+Chunks keep the compression of their FASTQ file.  Without a merge job the
+chunk alignments, which are not sorted, are concatenated in their format:
+SAM chunks keep the header of the first, BAM and CRAM chunks go through
+samtools cat.
+
+With ranges=True nothing is copied.  Each FASTQ file is indexed by an
+IndexFastq job instead, and each aligner reads its range of records from
+the original file through bash process substitution, uncompressed; see
+tfpipe.utils.seqindex.  The template must name the FASTQ files directly,
+and compressed files must be BGZF.
+
+"""
+import re
+from math import ceil
+from pipes import quote
+from os.path import basename, dirname, join, splitext
+from tfpipe.base import Job
+from tfpipe.modules.picard.tools import Picard
+from tfpipe.modules.samtools import Merge
+from tfpipe.utils import InvalidInput, python_module
+from tfpipe.utils.seqindex import index_path
+from tfpipe.pipeline.sizing import seconds, format_walltime
+
+COMPRESSED = ('.gz', '.bz2')
+
+# Chunk time limits are twice the template's share, and at least this
+MIN_CHUNK_TIME = 10 * 60
+
+# Characters that can end a path within an argument, as in I=in.bam,
+# <(zcat in.fq.gz) or "a.txt b.txt"
+PATH_BOUNDARY = r'\s\'"=(),<>|;&:'
+
+
+def split_extension(path, directory=None):
+    """Return (stem, extension) of a file, counting a compression suffix as
+    part of the extension, with the stem moved to directory if given.
+
+    """
+    stem, ext = splitext(basename(path))
+    if ext in COMPRESSED:
+        stem, inner = splitext(stem)
+        ext = inner + ext
+    return join(directory or dirname(path), stem), ext
+
+
+def _chunk_name(path, directory=None):
+    """Return the (prefix, suffix) of the chunk paths of a file.
+
+    """
+    stem, ext = split_extension(path, directory)
+    return stem + '.part', ext
+
+
+def chunk_path(path, index, directory=None):
+    """Return the path of chunk index of a file, e.g. S1.part003.fq.gz.
+
+    """
+    prefix, suffix = _chunk_name(path, directory)
+    return '%s%03d%s' % (prefix, index, suffix)
+
+
+class SplitFastq(Job):
+    """SplitFastq deals the records of a FASTQ file round-robin into chunks.
+
+    Every chunk is created, even if there are fewer records than chunks.
+
+    """
+    _cmd = ''
+    _runtime_shell = True
+    _runtime_estimate = 30 * 60
+    _memory_req_slurm = '1G'
+    _time_str_slurm = '"04:00:00"'
+
+    def __init__(self, fastq, chunks, name, directory=None):
+        """Initialize SplitFastq writing chunks of fastq.
+
+        """
+        Job.__init__(self, name=name)
+        self.input_file = fastq
+        self.chunks = [chunk_path(fastq, i, directory) for i in range(chunks)]
+        self._command = self._split(*_chunk_name(fastq, directory))
+
+    def _split(self, prefix, suffix):
+        """Build the awk command line writing the chunks.
+
+        """
+        if suffix.endswith('.gz'):
+            write = '| ("gzip -c > " f)'
+        else:
+            write = '> f'
+        script = ('BEGIN {for (i = 0; i < n; i++) {f = p sprintf("%%03d", i) '
+                  's; printf "" %s}} NR %% 4 == 1 {f = p sprintf("%%03d", '
+                  'int(NR / 4) %% n) s} {print %s}' % (write, write))
+        return "zcat -f %s | awk -v n=%d -v p=%s -v s=%s %s" % (
+            quote(self.input_file), len(self.chunks), quote(prefix),
+            quote(suffix), quote(script))
+
+    def __str__(self):
+        return self._command
+
+
+class IndexFastq(Job):
+    """IndexFastq builds the record index of a FASTQ or FASTA file.
+
+    chunks are the process substitutions reading each chunk; jobs naming
+    them need _bash set.
+
+    """
+    _cmd = ''
+    _runtime_estimate = 5 * 60
+    _memory_req_slurm = '256M'
+    _time_str_slurm = '"01:00:00"'
+
+    def __init__(self, fastq, chunks, name):
+        """Initialize IndexFastq, read by chunks aligners.
+
+        """
+        seqindex = python_module('tfpipe.utils.seqindex')
+        Job.__init__(self, name=name, cmd='%s build' % seqindex)
+        self.input_file = fastq
+        self.output_file = index_path(fastq)
+        self.add_positional_argument(quote(fastq))
+        self.chunks = ['<(%s read %s %d %d)' % (seqindex, quote(fastq), i,
+                                                chunks)
+                       for i in range(chunks)]
+
+
+class ConcatAlignments(Job):
+    """ConcatAlignments concatenates chunk alignments into output.
+
+    SAM chunks keep the header of the first, BAM and CRAM chunks are joined
+    by samtools cat; neither needs the chunks sorted.
+
+    """
+    _cmd = ''
+    _runtime_estimate = 30 * 60
+    _memory_req_slurm = '1G'
+    _time_str_slurm = '"04:00:00"'
+
+    def __init__(self, output, parts, name):
+        """Initialize ConcatAlignments writing parts to output.
+
+        """
+        Job.__init__(self, name=name)
+        self.output_file = output
+        self.parts = list(parts)
+
+    def __str__(self):
+        files = " ".join(quote(part) for part in self.parts)
+        if self.output_file.endswith(('.bam', '.cram')):
+            return "samtools cat -o %s %s" % (quote(self.output_file), files)
+        return "awk %s %s > %s" % (quote('FNR == NR || !/^@/'), files,
+                                   quote(self.output_file))
+
+
+def _rewrite(job, rewrite):
+    """Apply rewrite to every string argument and file name of job.
+
+    Arguments shared with a template are only copied if rewrite changes
+    one of them.
+
+    """
+    for key, value in list(job._arg_items()):
+        if isinstance(value, basestring) and rewrite(value) != value:
+            job.args[key] = rewrite(value)
+    positional = list(job._positional())
+    rewritten = [rewrite(value) if isinstance(value, basestring) else value
+                 for value in positional]
+    if rewritten != positional:
+        job.pos_args[:] = rewritten
+    for attr in ('input_file', 'output_file', 'error_file',
+                 'redirect_output_file', 'append_output_file',
+                 'redirect_error_file'):
+        value = getattr(job, attr)
+        if value:
+            setattr(job, attr, rewrite(value))
+
+
+def _retarget(job, old, new):
+    """Replace the file old by new wherever job names it.
+
+    old is only replaced as a whole path, so out.bam.bai or x/out.bam are
+    left alone when retargeting out.bam.
+
+    """
+    pattern = re.compile('(?<![^%s])%s(?![^%s])' % (
+        PATH_BOUNDARY, re.escape(old), PATH_BOUNDARY))
+    _rewrite(job, lambda value: pattern.sub(lambda match: new, value))
+
+
+def _merge_job(merge, name, output, parts):
+    """Set up merge, or a samtools merge job, to merge parts into output.
+
+    Picard tools take I= and O= arguments.
+
+    """
+    if merge is None:
+        merge = Merge(name=name)
+    if isinstance(merge, Picard):
+        merge.add_positional_argument('O=%s' % output)
+        merge.output_file = output
+        for part in parts:
+            merge.add_positional_argument('I=%s' % part)
+    else:
+        merge.add_argument('-f')
+        merge.add_positional_argument(output, 'output')
+        for part in parts:
+            merge.add_positional_argument(part)
+    return merge
+
+
+class ScatterGather(object):
+    """ScatterGather aligns the FASTQ files of a template job in chunks.
+
+    The template is not run itself.  Its dependencies are passed on to the
+    split and aligner jobs, and jobs downstream of the alignment should
+    depend on merge.
+
+    """
+    def __init__(self, template, chunks, fastqs=None, merge=None,
+                 directory=None, ranges=False):
+        """Initialize ScatterGather.
+
+        fastqs defaults to the template's input_file; list both files of a
+        pair.  Aligner chunks are clones of template named <name>_part000
+        and so on.  The chunk alignments are merged by merge, a Job such as
+        MergeSamFilesSLURM(), or concatenated by ConcatAlignments.  Chunks are written to
+        directory, by default next to the files they are split from.  With
+        ranges, the FASTQ files are indexed instead of split, and split
+        holds the IndexFastq jobs.
+
+        """
+        fastqs = list(fastqs or [template.input_file])
+        output = template.output_file or template.redirect_output_file
+        if not all(fastqs) or not output:
+            raise InvalidInput("%s: the template needs declared input and "
+                               "output files" % template.name)
+        if chunks < 1:
+            raise InvalidInput("%s: chunks must be at least 1" % template.name)
+        self.template = template
+        upstream = dict((c, list(jobs)) for c, jobs in template.dep.items())
+        self.split = []
+        for k, fastq in enumerate(fastqs):
+            if ranges:
+                split = IndexFastq(fastq, chunks,
+                                   '%s_index%d' % (template.name, k))
+            else:
+                split = SplitFastq(fastq, chunks, '%s_split%d' % (
+                    template.name, k), directory)
+            split.add_dependencies(**upstream)
+            self.split.append(split)
+        runtime = template.runtime_estimate
+        limit = max(MIN_CHUNK_TIME,
+                    2.0 * seconds(template.time_str_slurm) / chunks)
+        self.aligners = []
+        parts = []
+        for i in range(chunks):
+            job = template.clone('%s_part%03d' % (template.name, i))
+            for fastq, split in zip(fastqs, self.split):
+                _retarget(job, fastq, split.chunks[i])
+            if ranges:
+                # Still reads the original file
+                job.input_file = template.input_file
+                job._bash = True
+            part = chunk_path(output, i, directory)
+            _retarget(job, output, part)
+            parts.append(part)
+            job.add_dependencies(**upstream)
+            job.add_dependencies(done=list(self.split))
+            if runtime:
+                job.runtime_estimate = int(ceil(float(runtime) / chunks))
+            job.time_str_slurm = format_walltime(limit)
+            job.time_limit_set = template.time_limit_set
+            self.aligners.append(job)
+        if merge is None:
+            self.merge = ConcatAlignments(output, parts,
+                                          '%s_merge' % template.name)
+        else:
+            self.merge = _merge_job(merge, '%s_merge' % template.name,
+                                    output, parts)
+        self.merge.add_dependencies(done=list(self.aligners))
+
+    @property
+    def jobs(self):
+        """Return the split or index, aligner and merge jobs.
+
+        """
+        return self.split + self.aligners + [self.merge]
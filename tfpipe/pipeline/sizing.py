@@ -0,0 +1,123 @@
+"""Size memory and time requests from the history in a metrics store.
+
+For each module class the successful runs recorded by the metrics wrapper
+give peak memory and wall time against input size.  A job's request is the
+fitted value for its input size plus the worst underestimate seen in the
+history, times a safety margin.  Without a usable input size the largest
+recorded value is used.
+
+"""
+import os
+from math import ceil
+from tfpipe.utils import logger
+from tfpipe.pipeline.metrics import MetricsStore, job_class
+
+
+def _fit(points):
+    """Least squares fit of y = a + b * x with b >= 0.
+
+    Returns (a, b, largest residual).
+
+    """
+    n = float(len(points))
+    mean_x = sum(x for x, y in points) / n
+    mean_y = sum(y for x, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, y in points)
+    b = 0.0
+    if var:
+        b = max(0.0, sum((x - mean_x) * (y - mean_y)
+                         for x, y in points) / var)
+    a = mean_y - b * mean_x
+    return a, b, max(y - (a + b * x) for x, y in points)
+
+
+def seconds(walltime):
+    """Return an 'HH:MM:SS' or 'HH:MM' wall time in seconds.
+
+    """
+    parts = [int(p) for p in str(walltime).strip('"\'').split(':')]
+    if len(parts) == 2:
+        parts.append(0)
+    hours, minutes, secs = parts
+    return hours * 3600 + minutes * 60 + secs
+
+
+def format_walltime(runtime, lsf=False):
+    """Return runtime seconds as a SLURM '"HH:MM:SS"' or LSF 'HH:MM' limit.
+
+    """
+    minutes = int(ceil(runtime / 60.0))
+    if lsf:
+        return "%d:%02d" % (minutes // 60, minutes % 60)
+    return '"%02d:%02d:00"' % (minutes // 60, minutes % 60)
+
+
+class Sizer(object):
+    """Sizer predicts memory and wall time requests from past runs.
+
+    A class needs min_runs successful runs before it is sized.  Predictions
+    are multiplied by margin and rounded up to memory_step megabytes and
+    whole minutes, within the given floors.  Jobs with autosize set to False
+    keep their own requests.
+
+    """
+    def __init__(self, store, margin=1.25, min_runs=3, memory_step=256,
+                 min_memory=256, min_time=5 * 60):
+        """Initialize Sizer.
+
+        store is a MetricsStore or the path of one.
+
+        """
+        if isinstance(store, basestring):
+            store = MetricsStore(store)
+        self.store = store
+        self.margin = margin
+        self.min_runs = min_runs
+        self.memory_step = memory_step
+        self.min_memory = min_memory
+        self.min_time = min_time
+        self._history = None
+
+    @property
+    def history(self):
+        """Map each class to its successful runs, read once.
+
+        """
+        if self._history is None:
+            self._history = {}
+            for record in self.store.records():
+                if record.get('returncode') == 0:
+                    self._history.setdefault(record['class'], []).append(
+                        record)
+        return self._history
+
+    def _predict(self, records, key, size):
+        """Predict records' key for input size, without margin.
+
+        """
+        points = [(r.get('input_bytes') or 0, r[key]) for r in records]
+        if not size or not [x for x, y in points if x]:
+            return max(y for x, y in points)
+        a, b, residual = _fit(points)
+        return a + b * size + residual
+
+    def predict(self, job):
+        """Return (memory in megabytes, wall time in seconds), or None.
+
+        """
+        if not getattr(job, 'autosize', True):
+            return None
+        records = self.history.get(job_class(job), [])
+        if len(records) < self.min_runs:
+            return None
+        size = None
+        if job.input_file and os.path.isfile(str(job.input_file)):
+            size = os.path.getsize(str(job.input_file))
+        memory = self._predict(records, 'max_rss_mb', size) * self.margin
+        memory = max(self.min_memory, int(ceil(memory / self.memory_step)) *
+                     self.memory_step)
+        runtime = self._predict(records, 'wall', size) * self.margin
+        runtime = max(self.min_time, int(ceil(runtime / 60.0)) * 60)
+        logger.debug("%s: sized from %d runs to %dM and %ss", job.name,
+                     len(records), memory, runtime)
+        return memory, runtime
@@ -0,0 +1,162 @@
+"""Run jobs on node-local scratch space.
+
+A job marked with Job.use_scratch is wrapped in a StagedJob.  Its inputs are
+copied in parallel to a fresh directory on the node (by default under
+$TMPDIR), optionally decompressed on the way, the job runs against the local
+copies, and its outputs are copied back next to their destination and moved
+into place, so a partial output never appears under the final name.
+
+"""
+import copy
+from os.path import basename
+from tfpipe.base import Job
+from tfpipe.pipeline.dag import replace_jobs
+from tfpipe.pipeline.fusion import FusedJob
+
+DECOMPRESS = {'.gz': 'gzip -dc', '.bz2': 'bzip2 -dc'}
+FILE_ATTRS = ('input_file', 'output_file', 'error_file',
+              'redirect_output_file', 'append_output_file',
+              'redirect_error_file')
+
+
+def scratch_inputs(job):
+    """Return the files copied to scratch before job runs.
+
+    """
+    paths = [job.input_file] + list(job.scratch['inputs'])
+    return [p for i, p in enumerate(paths) if p and p not in paths[:i]]
+
+
+def scratch_outputs(job):
+    """Return the files copied back from scratch after job runs.
+
+    """
+    paths = [job.output_file] + list(job.scratch['outputs'])
+    return [p for i, p in enumerate(paths) if p and p not in paths[:i]]
+
+
+def _local(value, local_path):
+    """Return value with the files it names swapped for their local copies.
+
+    A file is a word of the value, as in '--readFilesIn r1.fq r2.fq', or
+    follows an '=' in it, as in INPUT=path or --in=path.  The spacing of the
+    value is kept.
+
+    """
+    if not isinstance(value, basestring):
+        return value
+    words = value.split(' ')
+    for i, word in enumerate(words):
+        head, sep, tail = word.rpartition('=')
+        if word in local_path:
+            words[i] = local_path[word]
+        elif sep and tail in local_path:
+            words[i] = head + sep + local_path[tail]
+    return ' '.join(words)
+
+
+def localize(job, local_path):
+    """Return a copy of job naming the local copies of its files.
+
+    local_path maps paths to their local copies.  The stages of a FusedJob
+    are localized and fused again.
+
+    """
+    if isinstance(job, FusedJob):
+        return FusedJob([localize(stage, local_path) for stage in job.stages],
+                        job.links)
+    local = copy.copy(job)
+    local.args = dict((_local(key, local_path), _local(value, local_path))
+                      for key, value in job._arg_items())
+    local.pos_args = [_local(value, local_path)
+                      for value in job._positional()]
+    for attr in FILE_ATTRS:
+        setattr(local, attr, _local(getattr(job, attr), local_path))
+    return local
+
+
+class StagedJob(Job):
+    """StagedJob runs a job against node-local copies of its files.
+
+    Like FusedJob it takes the name, job ID, resources and dependencies of
+    the job it wraps.  Its command expands shell variables on the node, so
+    WorkFlow escapes it when submitting.
+
+    """
+    _cmd = ''
+    _runtime_shell = True
+
+    def __init__(self, job):
+        """Initialize StagedJob wrapping job.
+
+        """
+        Job.__init__(self, name=job.name)
+        self.job = job
+        self.stages = getattr(job, 'stages', [job])
+        self._jobid = job.jobid
+        for attr in ('input_file', 'output_file', 'redirect_output_file',
+                     'append_output_file', 'job_output_file', 'queue',
+                     'numberofprocesses', 'memory_req_slurm',
+                     'memory_req_lsf', 'time_str_slurm', 'runtime_estimate',
+                     'scratch', 'autosize', 'retry_policy'):
+            setattr(self, attr, getattr(job, attr))
+        self.dep = dict((c, list(jobs)) for c, jobs in job.dep.items())
+        self._command = self._staged()
+
+    def _staged(self):
+        """Build the staging command line.
+
+        Files are swapped for their local copies in the arguments and
+        redirections of a copy of the job.
+
+        """
+        scratch = self.scratch
+        local_path = {}
+        copy_in, copy_out, dirs = [], [], []
+        inputs, outputs = scratch_inputs(self), scratch_outputs(self)
+        for k, path in enumerate(inputs + outputs):
+            dirs.append('"$S/%d"' % k)
+            name = basename(path)
+            tool = None
+            if k < len(inputs) and scratch['decompress']:
+                for ext, command in DECOMPRESS.items():
+                    if name.endswith(ext):
+                        name, tool = name[:-len(ext)], command
+            local = '"$S/%d/%s"' % (k, name)
+            local_path[path] = local
+            if k >= len(inputs):
+                copy_out.append('{ cp %s %s.partial && mv %s.partial %s; } '
+                                '& P%d=$!' % (local, path, path, path, k))
+            elif tool:
+                copy_in.append('%s %s > %s & P%d=$!' % (tool, path, local, k))
+            else:
+                copy_in.append('cp %s %s & P%d=$!' % (path, local, k))
+        command = str(localize(self.job, local_path)).strip()
+
+        def wait(first, last):
+            return " && ".join("wait $P%d" % k for k in range(first, last))
+        parts = ['S=$(mktemp -d "%s/tfpipe.XXXXXX") || exit 1' %
+                 scratch['directory'],
+                 """trap 'rm -rf "$S"' EXIT"""]
+        if dirs:
+            parts.append("mkdir %s || exit 1" % " ".join(dirs))
+        if copy_in:
+            parts += copy_in + ["%s || exit 1" % wait(0, len(inputs))]
+        parts.append("%s || exit $?" % command)
+        if copy_out:
+            parts += copy_out + [wait(len(inputs), len(dirs))]
+        return "( %s )" % "; ".join(parts)
+
+    def __str__(self):
+        return self._command
+
+
+def stage(jobs):
+    """Return jobs with the ones marked by use_scratch wrapped in StagedJobs.
+
+    """
+    replaced = dict((job, StagedJob(job)) for job in jobs
+                    if getattr(job, 'scratch', None))
+    if not replaced:
+        return jobs
+    return replace_jobs(jobs, replaced)
@@ -0,0 +1,329 @@
+"""Keep the state of a workflow's jobs in a SQLite database.
+
+WorkFlow(state=True) records every job it submits in the database.  The
+submission script appends the scheduler ID of each SLURM job to an IDs file
+as it is submitted, and run loads them once submission is done.  LSF jobs are
+found by their unique job names.
+
+WorkFlow.wait polls the scheduler for all unfinished jobs with a single sacct
+(SLURM) or bjobs (LSF) call per interval.  The interval grows while nothing
+changes, so a 10000 job workflow costs one scheduler query per interval, not
+10000.  Pending jobs that depend on a failed job can never start; they are
+reported as orphaned and can be cancelled with one scancel or bkill call.
+bjobs forgets finished jobs after LSF's CLEAN_PERIOD, so jobs the scheduler
+no longer reports are EXIT once missing for MISSING_GRACE seconds.
+
+"""
+import re
+import sqlite3
+from time import time, sleep
+from subprocess import check_output, call, CalledProcessError
+from tfpipe.utils import logger
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+EXIT = 'EXIT'
+ORPHANED = 'ORPHANED'
+FINAL = (DONE, EXIT)
+# Scheduler state of jobs the scheduler no longer reports
+MISSING = 'MISSING'
+MISSING_GRACE = 600
+
+SLURM_STATES = {'PENDING': PENDING, 'REQUEUED': PENDING,
+                'REQUEUE_HOLD': PENDING, 'REQUEUE_FED': PENDING,
+                'RESV_DEL_HOLD': PENDING, 'SUSPENDED': RUNNING,
+                'RUNNING': RUNNING, 'CONFIGURING': RUNNING,
+                'COMPLETING': RUNNING, 'RESIZING': RUNNING,
+                'STAGE_OUT': RUNNING, 'SIGNALING': RUNNING,
+                'COMPLETED': DONE}
+LSF_STATES = {'PEND': PENDING, 'PSUSP': PENDING, 'WAIT': PENDING,
+              'RUN': RUNNING, 'USUSP': RUNNING, 'SSUSP': RUNNING,
+              'PROV': RUNNING, 'DONE': DONE, 'EXIT': EXIT}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    unit TEXT,
+    element INTEGER,
+    lsf_name TEXT,
+    scheduler_id TEXT,
+    state TEXT,
+    scheduler_state TEXT,
+    exit_code TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS deps (
+    name TEXT,
+    upstream TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_unit ON jobs (unit);
+"""
+
+
+def slurm_state(state):
+    """Return the workflow state of a SLURM job state.
+
+    Unknown states, such as FAILED, TIMEOUT or CANCELLED by ..., are EXIT.
+
+    """
+    return SLURM_STATES.get(state.split()[0] if state else '', EXIT)
+
+
+def _slurm_ids(jobid):
+    """Expand a sacct job ID such as 12_[3-5,7%2] into element IDs.
+
+    """
+    match = re.match(r'^(\d+)_\[([^\]]*)\]$', jobid)
+    if not match:
+        return [jobid]
+    base, ranges = match.group(1), match.group(2).split('%')[0]
+    ids = []
+    for part in ranges.split(','):
+        first, _, last = part.partition('-')
+        ids += ["%s_%d" % (base, i)
+                for i in range(int(first), int(last or first) + 1)]
+    return ids
+
+
+def slurm_states(ids):
+    """Return {scheduler ID: (state, exit code)} of SLURM jobs.
+
+    All jobs are queried with one sacct call.  Array elements are reported
+    under their 'ID_INDEX' IDs; of requeued jobs the latest run is kept.
+
+    """
+    bases = sorted(set(i.split('_')[0] for i in ids))
+    output = check_output(['sacct', '-n', '-P', '-X', '-o',
+                           'JobID,State,ExitCode', '-j', ",".join(bases)])
+    states = {}
+    for line in output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) != 3:
+            continue
+        for jobid in _slurm_ids(fields[0]):
+            states[jobid] = (fields[1], fields[2])
+    return states
+
+
+def lsf_states(names):
+    """Return {LSF job name: (state, exit code, job ID)} of LSF jobs.
+
+    All jobs of the user are listed with one bjobs call.  Of jobs sharing a
+    name, e.g. from an earlier run, the latest is kept.
+
+    """
+    output = check_output(['bjobs', '-a', '-noheader', '-o',
+                           "jobid job_name stat exit_code delimiter='|'"])
+    wanted = set(names)
+    states, latest = {}, {}
+    for line in output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) != 4 or fields[1] not in wanted:
+            continue
+        jobid, name, state, exit_code = fields
+        if jobid.isdigit() and int(jobid) >= latest.get(name, -1):
+            latest[name] = int(jobid)
+            index = re.search(r'\[(\d+)\]$', name)
+            if index:
+                jobid = "%s[%s]" % (jobid, index.group(1))
+            states[name] = (state, exit_code.strip('-'), jobid)
+    return states
+
+
+class StateStore(object):
+    """StateStore is the SQLite database of a workflow's jobs.
+
+    Each job is stored with its submission unit, the shell variable holding
+    the scheduler ID of the job or of the job array it is an element of.
+
+    """
+    def __init__(self, path, missing_grace=MISSING_GRACE):
+        """Initialize StateStore.
+
+        Unfinished jobs missing from the scheduler's reports for
+        missing_grace seconds are EXIT.
+
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.missing_grace = missing_grace
+        # When each unfinished job was first missing from a poll
+        self._missing = {}
+
+    def add(self, rows, deps):
+        """Record submitted jobs, replacing records of the same names.
+
+        rows are (name, unit, array element or None, LSF job name) tuples,
+        deps (name, upstream name) pairs.
+
+        """
+        names = [(row[0],) for row in rows]
+        with self.db:
+            self.db.executemany("DELETE FROM jobs WHERE name = ?", names)
+            self.db.executemany("DELETE FROM deps WHERE name = ?", names)
+            self.db.executemany(
+                "INSERT INTO jobs (name, unit, element, lsf_name, state, "
+                "updated) VALUES (?, ?, ?, ?, '%s', %f)" % (PENDING, time()),
+                rows)
+            self.db.executemany("INSERT INTO deps VALUES (?, ?)", deps)
+
+    def load_ids(self, path):
+        """Set the scheduler IDs listed as 'UNIT ID' lines in path.
+
+        Pending jobs left without an ID were never submitted and are EXIT.
+
+        """
+        ids = []
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2:
+                    ids.append((fields[1], fields[0]))
+        with self.db:
+            self.db.executemany(
+                "UPDATE jobs SET scheduler_id = CASE WHEN element IS NULL "
+                "THEN ?1 ELSE ?1 || '_' || element END WHERE unit = ?2", ids)
+            self.db.execute(
+                "UPDATE jobs SET state = ?, scheduler_state = "
+                "'NOT_SUBMITTED' WHERE scheduler_id IS NULL AND state = ?",
+                (EXIT, PENDING))
+
+    def set(self, name, state, exit_code=None):
+        """Set the state of one job, e.g. a job run locally.
+
+        """
+        with self.db:
+            self.db.execute("UPDATE jobs SET state = ?, exit_code = ?, "
+                            "updated = ? WHERE name = ?",
+                            (state, exit_code, time(), name))
+
+    def states(self):
+        """Return {job name: state} as last seen.
+
+        """
+        return dict(self.db.execute("SELECT name, state FROM jobs"))
+
+    def scheduler_ids(self):
+        """Return {job name: scheduler ID} of jobs with a known ID.
+
+        """
+        return dict(self.db.execute("SELECT name, scheduler_id FROM jobs "
+                                    "WHERE scheduler_id IS NOT NULL"))
+
+    def unfinished(self):
+        """Return (name, scheduler ID, LSF name) of jobs not yet finished.
+
+        """
+        return self.db.execute(
+            "SELECT name, scheduler_id, lsf_name FROM jobs WHERE state NOT "
+            "IN (?, ?)", FINAL).fetchall()
+
+    def poll(self, slurm=True):
+        """Query the scheduler once for all unfinished jobs.
+
+        Returns the number of jobs whose state changed.
+
+        """
+        jobs = self.unfinished()
+        if not jobs:
+            return 0
+        try:
+            if slurm:
+                ids = [jobid for name, jobid, lsf_name in jobs if jobid]
+                result = slurm_states(ids) if ids else {}
+            else:
+                result = lsf_states([lsf_name for name, jobid, lsf_name
+                                     in jobs])
+        except (CalledProcessError, OSError) as error:
+            logger.warn("WorkFlow STATE: could not query the scheduler: %s",
+                        error)
+            return 0
+        updates, now = [], time()
+        for name, jobid, lsf_name in jobs:
+            if slurm and jobid in result:
+                raw, exit_code = result[jobid]
+                state = slurm_state(raw)
+            elif not slurm and lsf_name in result:
+                raw, exit_code, jobid = result[lsf_name]
+                state = LSF_STATES.get(raw, PENDING)
+            elif slurm and not jobid:
+                continue
+            elif now - self._missing.setdefault(name, now) < \
+                    self.missing_grace:
+                continue
+            else:
+                logger.warn("WorkFlow STATE: %s no longer reported by the "
+                            "scheduler, assumed failed", name)
+                raw, exit_code, state = MISSING, None, EXIT
+            self._missing.pop(name, None)
+            updates.append((state, raw, exit_code, jobid, now, name,
+                            state, raw))
+        with self.db:
+            changed = self.db.executemany(
+                "UPDATE jobs SET state = ?, scheduler_state = ?, "
+                "exit_code = ?, scheduler_id = ?, updated = ? WHERE name = ? "
+                "AND (state IS NOT ? OR scheduler_state IS NOT ?)", updates)
+        return changed.rowcount
+
+    def orphans(self):
+        """Return the names of pending jobs that depend on a failed job.
+
+        """
+        states = self.states()
+        deps = {}
+        for name, upstream in self.db.execute("SELECT * FROM deps"):
+            deps.setdefault(name, []).append(upstream)
+        broken = set(name for name, state in states.items() if state == EXIT)
+        orphans = set()
+        changed = True
+        while changed:
+            changed = False
+            for name, upstream in deps.items():
+                if name not in orphans and states.get(name) == PENDING and \
+                        broken.intersection(upstream):
+                    orphans.add(name)
+                    broken.add(name)
+                    changed = True
+        return sorted(orphans)
+
+    def cancel(self, names, slurm=True):
+        """Cancel jobs with one scancel or bkill call.
+
+        """
+        known = self.scheduler_ids()
+        ids = sorted(known[name] for name in names if name in known)
+        if ids:
+            call(['scancel' if slurm else 'bkill'] + ids)
+
+    def wait(self, slurm=True, interval=30, max_interval=600, backoff=2.0,
+             cancel_orphans=False):
+        """Poll until every job has finished or is orphaned.
+
+        The polling interval starts at interval seconds and is multiplied
+        by backoff, up to max_interval, after each poll without changes.
+        Returns {job name: state}, with orphaned jobs as ORPHANED.
+
+        """
+        delay = interval
+        while True:
+            changed = self.poll(slurm)
+            orphans = self.orphans()
+            waiting = [name for name, jobid, lsf_name in self.unfinished()
+                       if name not in orphans]
+            if not waiting:
+                break
+            delay = interval if changed else min(delay * backoff,
+                                                 max_interval)
+            logger.info("WorkFlow STATE: %d jobs unfinished, next poll in "
+                        "%ds", len(waiting), delay)
+            sleep(delay)
+        if orphans:
+            logger.warn("WorkFlow STATE: %d jobs depend on failed jobs: %s",
+                        len(orphans), " ".join(orphans))
+            if cancel_orphans:
+                self.cancel(orphans, slurm)
+        states = self.states()
+        states.update((name, ORPHANED) for name in orphans)
+        return states
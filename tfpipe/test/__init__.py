@@ -1 +1,81 @@
+"""tfpipe unittests.
 
+Helpers shared by the test modules.  Logging goes to a temporary directory
+for the whole run rather than to tfpipe.log in the working directory.
+
+"""
+import os
+import atexit
+import shutil
+import tempfile
+import unittest
+from tfpipe.modules.cli import CLI
+from tfpipe.utils import configure_logging, stop_logging
+
+LOG_DIR = tempfile.mkdtemp(prefix='tfpipe-test.')
+LOG_FILE = os.path.join(LOG_DIR, 'tfpipe.log')
+
+
+def configure_test_logging():
+    """Log to LOG_FILE at the default level.
+
+    """
+    configure_logging(path=LOG_FILE)
+
+
+def _remove_logs():
+    """Close the log and remove LOG_DIR.
+
+    """
+    stop_logging()
+    shutil.rmtree(LOG_DIR, True)
+
+
+configure_test_logging()
+atexit.register(_remove_logs)
+
+
+def make_job(name, cmd='true', input_file=None, output_file=None,
+             parents=(), cpus=None, memory=None, runtime=None):
+    """Return a CLI job reading and writing through redirections, with
+    the given dependencies and resource requests.
+
+    """
+    job = CLI(cmd=cmd, name=name)
+    if input_file:
+        job.add_argument('<', input_file, 'input')
+    if output_file:
+        job.add_argument('>', output_file, 'output')
+    if parents:
+        job.add_dependencies(done=list(parents))
+    if cpus:
+        job.numberofprocesses = cpus
+    job.memory_req_slurm = memory
+    job.runtime_estimate = runtime
+    return job
+
+
+def copy_job(name, source, target):
+    """Return a CLI job copying source to target.
+
+    """
+    job = CLI(cmd='cp', name=name)
+    job.add_positional_argument(source, 'input')
+    job.add_positional_argument(target, 'output')
+    return job
+
+
+class TempDirTest(unittest.TestCase):
+    """TempDirTest runs each test inside a new temporary directory.
+
+    The directory is self.tmp and is removed after the test.
+
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
@@ -0,0 +1,135 @@
+"""ArrayPlan unittests.
+
+"""
+import os
+from subprocess import check_output
+from tfpipe.modules.fastx_toolkit import FastxTrimmer, FastqQualityFilter
+from tfpipe.modules.picard import MergeSamFiles
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.arrays import ArrayPlan, JobArray, WHOLE, CORRESPONDING
+from tfpipe.pipeline.dag import DAG
+from tfpipe.test import TempDirTest
+
+
+class ArrayPlanTest(TempDirTest):
+    """Per-sample trim and filter jobs merged into one job.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.jobs, self.trims, self.quals = [], [], []
+        for sample in ('a', 'b', 'c'):
+            trim = FastxTrimmer(name='%s_trim' % sample)
+            trim.add_argument('-Q', '33')
+            trim.add_argument('-i', '/data/%s.fq' % sample, 'input')
+            trim.add_argument('-o', '/out/t%s.fq' % sample, 'output')
+            qual = FastqQualityFilter(name='%s_quality' % sample)
+            qual.add_argument('-Q', '33')
+            qual.add_argument('-i', trim.get_output_file(), 'input')
+            qual.add_argument('-o', '/out/q%s.fq' % sample, 'output')
+            qual.add_dependencies(done=[trim])
+            self.trims.append(trim)
+            self.quals.append(qual)
+            self.jobs += [trim, qual]
+        self.merge = MergeSamFiles(name='merge')
+        self.merge.add_dependencies(done=list(self.quals))
+        self.jobs.append(self.merge)
+
+    def test_groups(self):
+        plan = ArrayPlan(DAG(self.jobs))
+        trim, qual = plan.arrays()
+        self.assertEqual(trim.members, self.trims)
+        self.assertEqual(trim.name, 'trim')
+        self.assertEqual(qual.name, 'quality')
+        self.assertTrue(plan.unit[self.merge] is self.merge)
+        self.assertEqual(plan.submission_order(), [trim, qual, self.merge])
+
+    def test_dependencies(self):
+        plan = ArrayPlan(DAG(self.jobs))
+        trim, qual = plan.arrays()
+        self.assertEqual(plan.unit_dependencies(qual),
+                         [('done', trim, CORRESPONDING)])
+        self.assertEqual(plan.unit_dependencies(self.merge),
+                         [('done', qual, WHOLE)])
+
+    def test_template_and_table(self):
+        plan = ArrayPlan(DAG(self.jobs))
+        trim = plan.arrays()[0]
+        self.assertEqual(trim.table(),
+                         "/data/a.fq\x1f/out/ta.fq\n"
+                         "/data/b.fq\x1f/out/tb.fq\n"
+                         "/data/c.fq\x1f/out/tc.fq\n")
+        template = trim.template()
+        self.assertTrue('-i "${ARGS[0]}"' in template)
+        self.assertTrue('-o "${ARGS[1]}"' in template)
+        self.assertTrue('-Q 33' in template)
+
+    def test_driver_empty_values(self):
+        trim = ArrayPlan(DAG(self.trims)).arrays()[0]
+        trim.add_column(['', 'x y', ''])
+        trim.add_column(['p', 'q', 'r'])
+        with open('trim.args', 'w') as f:
+            f.write(trim.table())
+        driver = trim.driver('trim.args',
+                             command='echo "${ARGS[2]}|${ARGS[3]}"')
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID='2')
+        self.assertEqual(check_output(['bash', '-c', driver], env=env),
+                         'x y|q\n')
+        env['SLURM_ARRAY_TASK_ID'] = '1'
+        self.assertEqual(check_output(['bash', '-c', driver], env=env),
+                         '|p\n')
+
+    def test_max_size(self):
+        """Groups larger than max_size are split, and so are their
+        element-wise dependents.
+
+        """
+        plan = ArrayPlan(DAG(self.jobs), max_size=2)
+        trim, qual = plan.arrays()
+        self.assertEqual(trim.members, self.trims[:2])
+        self.assertEqual(qual.members, self.quals[:2])
+        self.assertEqual(plan.unit_dependencies(qual),
+                         [('done', trim, CORRESPONDING)])
+        self.assertTrue(plan.unit[self.trims[2]] is self.trims[2])
+        self.assertEqual(plan.unit_dependencies(self.quals[2]),
+                         [('done', self.trims[2], WHOLE)])
+
+    def test_constant_arguments_differ(self):
+        """Jobs with different non-file arguments are not grouped.
+
+        """
+        self.trims[1].add_argument('-Q', '64')
+        plan = ArrayPlan(DAG(self.trims))
+        self.assertEqual(plan.arrays()[0].members,
+                         [self.trims[0], self.trims[2]])
+        self.assertTrue(plan.unit[self.trims[1]] is self.trims[1])
+
+    def test_element_dependency(self):
+        """A single job may depend on one element of an array.
+
+        """
+        odd = MergeSamFiles(name='odd')
+        odd.add_dependencies(done=[self.quals[1]])
+        plan = ArrayPlan(DAG(self.jobs + [odd]))
+        qual = plan.unit[self.quals[0]]
+        self.assertEqual(plan.unit_dependencies(odd), [('done', qual, 2)])
+
+    def test_workflow_slurm(self):
+        wf = WorkFlow(self.jobs, slurm=True, lsf=False, arrays=True,
+                      name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('sbatch -J trim --array=1-3' in script)
+        self.assertTrue('--array=1-3 --dependency=aftercorr:$%s ' %
+                        self.trims[0].jobid in script)
+        self.assertTrue('--dependency=afterok:$%s ' %
+                        self.quals[0].jobid in script)
+        self.assertEqual(sorted(wf._support_files),
+                         ['wf.quality.args', 'wf.quality.sh',
+                          'wf.trim.args', 'wf.trim.sh'])
+
+    def test_workflow_lsf(self):
+        wf = WorkFlow(self.jobs, arrays=True, name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('bsub -J "trim[1-3]"' in script)
+        self.assertTrue('-w "done(trim[*])"' in script)
+        self.assertTrue('bsub -J merge -w "done(quality)"' in script)
@@ -0,0 +1,104 @@
+"""Dependency fan-in unittests.
+
+"""
+import re
+import unittest
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.barriers import Barrier, bound_fan_in
+from tfpipe.utils import InvalidInput
+
+
+def dependency_counts(script):
+    """Return the number of afterok terms of each submission in script.
+
+    """
+    return [len(m.split(':')) - 1 for m in
+            re.findall(r'--dependency=(afterok:\S+)', script)]
+
+
+class ReductionTest(unittest.TestCase):
+    """Dropping implied dependencies.
+
+    """
+    def setUp(self):
+        self.a = CLI(cmd='true', name='a')
+        self.b = CLI(cmd='true', name='b')
+        self.c = CLI(cmd='true', name='c')
+
+    def test_implied_by_chain(self):
+        self.b.add_dependencies(done=[self.a])
+        self.c.add_dependencies(done=[self.a, self.b, self.b, 'external'])
+        jobs = bound_fan_in([self.a, self.b, self.c])
+        self.assertEqual(jobs[:2], [self.a, self.b])
+        self.assertEqual(jobs[2].dep['done'], ['external', self.b])
+        self.assertEqual(jobs[2].jobid, self.c.jobid)
+        # The jobs passed in keep their dependencies
+        self.assertEqual(self.c.dep['done'],
+                         [self.a, self.b, self.b, 'external'])
+
+    def test_caller_jobs_unchanged(self):
+        """A second workflow from the same jobs keeps the real dependencies.
+
+        """
+        self.b.add_dependencies(done=[self.a])
+        self.c.add_dependencies(done=[self.a, self.b])
+        WorkFlow([self.a, self.b, self.c], name='wf.sh')
+        self.assertEqual(self.c.dep['done'], [self.a, self.b])
+        script = WorkFlow([self.a, self.c],
+                          name='wf.sh')._build_shell_script_to_text()
+        self.assertTrue('-w "done(b)&&done(a)"' in script)
+
+    def test_ended_does_not_imply_done(self):
+        self.b.add_dependencies(ended=[self.a])
+        self.c.add_dependencies(done=[self.a, self.b])
+        jobs = bound_fan_in([self.a, self.b, self.c])
+        self.assertEqual(jobs[2].dep['done'], [self.a, self.b])
+
+
+class BarrierTest(unittest.TestCase):
+    """A merge over many samples.
+
+    """
+    def setUp(self):
+        self.samples = [CLI(cmd='align %d' % i, name='align%d' % i)
+                        for i in range(120)]
+        self.merge = CLI(cmd='merge', name='merge')
+        self.merge.add_dependencies(done=self.samples)
+        self.jobs = self.samples + [self.merge]
+
+    def test_barriers(self):
+        wf = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh')
+        barriers = [job for job in wf.jobs if isinstance(job, Barrier)]
+        self.assertEqual(len(barriers), 3)
+        self.assertEqual(wf.jobs[-1].dep['done'], barriers)
+        self.assertEqual(self.merge.dep['done'], self.samples)
+        script = wf._build_shell_script_to_text()
+        self.assertEqual(sorted(dependency_counts(script)), [3, 40, 40, 40])
+        self.assertTrue(script.index('-J merge_barrier0_2 ') <
+                        script.index('-J merge '))
+
+    def test_levels(self):
+        wf = WorkFlow(self.jobs, slurm=False, lsf=True, name='wf.sh',
+                      max_fan_in=4)
+        for job in wf.jobs:
+            self.assertTrue(len(job.dep.get('done', [])) <= 4)
+        self.assertEqual(len(wf.jobs), 121 + 30 + 8 + 2)
+        self.assertRaises(InvalidInput, bound_fan_in, self.jobs, 1)
+
+    def test_rebuilt_workflows_share_barriers(self):
+        first = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh')
+        script = first._build_shell_script_to_text()
+        second = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh')
+        self.assertEqual(sorted(dependency_counts(
+            second._build_shell_script_to_text())), [3, 40, 40, 40])
+        again = WorkFlow(first.jobs, slurm=True, lsf=False, name='wf.sh')
+        self.assertEqual(again.jobs, first.jobs)
+        local = WorkFlow(first.jobs, local=True, name='wf.sh')
+        self.assertEqual(local.jobs[-1].dep['done'], self.samples)
+        self.assertEqual(first._build_shell_script_to_text(), script)
+
+    def test_arrays_need_no_barriers(self):
+        wf = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh',
+                      arrays=True)
+        self.assertEqual(wf.jobs, self.jobs)
@@ -0,0 +1,120 @@
+"""Job core unittests.
+
+"""
+import copy
+import pickle
+import unittest
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.gmap import Gsnap
+
+
+class JobCoreTest(unittest.TestCase):
+    """Slots and lazily created containers.
+
+    """
+    def test_no_instance_dict_by_default(self):
+        job = CLI(cmd='sort', name='sort')
+        job.add_argument('-o', 'out.txt', 'output')
+        job.add_positional_argument('in.txt', 'input')
+        self.assertEqual(job.__dict__, {})
+        self.assertEqual(str(job), 'sort -o out.txt in.txt  ')
+        job.memory_req_slurm = '2G'
+        self.assertEqual(job.__dict__, {'_memory_req_slurm': '2G'})
+
+    def test_class_defaults(self):
+        job = Gsnap()
+        self.assertEqual(job.time_str_slurm, '"05:00:00"')
+        self.assertEqual(CLI(cmd='ls').memory_req_lsf, None)
+
+    def test_lazy_containers(self):
+        job = CLI(cmd='ls')
+        self.assertEqual(job._args, None)
+        self.assertEqual(job._dep, None)
+        self.assertEqual(job.args, {})
+        self.assertEqual(job.pos_args, [])
+        job.add_dependencies(done=['a'])
+        job.add_dependencies(done=['b'])
+        self.assertEqual(job.dep, {'done': ['a', 'b']})
+
+    def test_io_flag_handler(self):
+        job = CLI(cmd='cat')
+        job.io_flag_handler['input']('in.txt')
+        self.assertEqual(job.input_file, 'in.txt')
+        self.assertEqual(job.io_flag_handler[None], None)
+
+    def test_copy(self):
+        job = CLI(cmd='cat', name='cat')
+        job.add_positional_argument('in.txt', 'input')
+        other = copy.copy(job)
+        self.assertEqual(str(other), str(job))
+        self.assertEqual(other.input_file, 'in.txt')
+
+
+    def test_pickle(self):
+        upstream = CLI(cmd='true', name='upstream')
+        job = CLI(cmd='sort', name='sort')
+        job.add_argument('-o', 'out.txt', 'output')
+        job.add_positional_argument('in.txt', 'input')
+        job.add_dependencies(done=[upstream])
+        job.memory_req_slurm = '2G'
+        job.add_retry()
+        clone = job.clone('sort2')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copied = pickle.loads(pickle.dumps(job, protocol))
+            self.assertEqual(str(copied), str(job))
+            self.assertEqual((copied.name, copied.jobid, copied.output_file,
+                              copied.input_file, copied.retry_policy),
+                             (job.name, job.jobid, job.output_file,
+                              job.input_file, job.retry_policy))
+            self.assertEqual(copied.__dict__, {'_memory_req_slurm': '2G'})
+            self.assertEqual(copied.dep['done'][0].name, 'upstream')
+            copied = pickle.loads(pickle.dumps(clone, protocol))
+            self.assertEqual(copied._args, None)
+            self.assertEqual(str(copied), str(clone))
+            lazy = pickle.loads(pickle.dumps(CLI(cmd='ls'), protocol))
+            self.assertEqual((lazy._args, lazy._dep), (None, None))
+
+
+class CloneTest(unittest.TestCase):
+    """Per-sample jobs cloned from a template.
+
+    """
+    def setUp(self):
+        self.template = CLI(cmd='align', name='template')
+        self.template.add_argument('--threads', '8')
+        self.template.add_positional_argument('ref.fa')
+        self.template.memory_req_slurm = '8G'
+        self.clones = []
+        for sample in ('a', 'b'):
+            job = self.template.clone('align_%s' % sample)
+            job.add_argument('-o', '%s.bam' % sample, 'output')
+            job.add_positional_argument('%s.fq' % sample, 'input')
+            self.clones.append(job)
+
+    def test_shared_arguments(self):
+        a, b = self.clones
+        self.assertTrue(a._template is b._template)
+        self.assertEqual(a._args, {'-o': 'a.bam'})
+        plain = CLI(cmd='align', args={'--threads': '8', '-o': 'a.bam'})
+        plain.pos_args = ['ref.fa', 'a.fq']
+        self.assertEqual(str(a), str(plain))
+        self.assertEqual((a.name, a.output_file, a.input_file),
+                         ('align_a', 'a.bam', 'a.fq'))
+        self.assertEqual(a.memory_req_slurm, '8G')
+        self.assertNotEqual(a.jobid, b.jobid)
+        self.assertEqual(self.template.args, {'--threads': '8'})
+
+    def test_copy_on_write(self):
+        a, b = self.clones
+        a.args['--threads'] = '16'
+        a.pos_args.remove('ref.fa')
+        self.assertEqual(a.args, {'--threads': '16', '-o': 'a.bam'})
+        self.assertEqual(a.pos_args, ['a.fq'])
+        self.assertEqual(b.args, {'--threads': '8', '-o': 'b.bam'})
+        self.assertEqual(b.pos_args, ['ref.fa', 'b.fq'])
+
+    def test_template_changes_after_cloning(self):
+        self.template.add_argument('--fast')
+        later = self.template.clone('later')
+        self.assertEqual(self.clones[0].args.get('--fast'), None)
+        self.assertEqual(later.args, {'--threads': '8', '--fast': ''})
@@ -0,0 +1,120 @@
+"""Parallel BLAST unittests.
+
+"""
+import re
+from StringIO import StringIO
+from tfpipe.modules.blast import BlastN, BlastP
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import ParallelBlast, WorkFlow
+from tfpipe.pipeline.blast import merge_hits, tabular_columns, main
+from tfpipe.utils import InvalidInput, python_module
+from tfpipe.test import TempDirTest
+
+COLUMNS = ['qseqid', 'sseqid', 'evalue', 'bitscore']
+
+
+def write_hits(path, rows):
+    """Write tabular hits, a list of (query, subject, evalue, bitscore).
+
+    """
+    with open(path, 'w') as f:
+        f.write('# BLASTN 2.2.31+\n')
+        for row in rows:
+            f.write('\t'.join(row) + '\n')
+
+
+class ParallelBlastTest(TempDirTest):
+    """Sharding a BlastN search and merging its hits.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.search = BlastN(name='screen')
+        self.search.add_argument('-query', 'contigs.fa', 'input')
+        self.search.add_argument('-db', 'nt')
+        self.search.add_argument('-outfmt',
+                                 '"6 qseqid sseqid evalue bitscore"')
+        self.search.add_argument('-out', 'contigs.tsv', 'output')
+
+    def test_columns(self):
+        self.assertEqual(tabular_columns('7')[-2:], ['evalue', 'bitscore'])
+        self.assertEqual(tabular_columns("'6 std staxids'")[-1], 'staxids')
+        self.assertRaises(InvalidInput, tabular_columns, '5')
+        self.assertRaises(InvalidInput, tabular_columns, '6 qseqid sseqid')
+
+    def test_wiring(self):
+        upstream = CLI(cmd='true', name='assemble')
+        self.search.add_dependencies(done=[upstream])
+        pb = ParallelBlast(self.search, 2, volumes=5, db_shards=2, top=3,
+                           dbsize=1000)
+        self.assertEqual([job.name for job in pb.jobs], [
+            'screen_index', 'screen_alias00', 'screen_alias01',
+            'screen_q000_d00', 'screen_q000_d01', 'screen_q001_d00',
+            'screen_q001_d01', 'screen_merge'])
+        self.assertEqual(pb.aliases[1].args['-dblist'], '"nt.02 nt.03 nt.04"')
+        self.assertEqual(pb.aliases[0].output_file, 'nt_shard00.nal')
+        search = pb.searches[3]
+        self.assertEqual(search.args['-query'], '<(%s read contigs.fa 1 2)' %
+                         python_module('tfpipe.utils.seqindex'))
+        self.assertTrue(search._bash)
+        self.assertEqual((search.args['-db'], search.args['-dbsize'],
+                          search.args['-max_target_seqs']),
+                         ('nt_shard01', '1000', '3'))
+        self.assertEqual(search.output_file, 'contigs.q001.d01.tsv')
+        self.assertEqual(search.input_file, 'contigs.fa')
+        self.assertEqual(search.dep['done'],
+                         [upstream, pb.index, pb.aliases[1]])
+        self.assertEqual(pb.merge.pos_args, [
+            'contigs.tsv', 'contigs.q000.d00.tsv,contigs.q000.d01.tsv',
+            'contigs.q001.d00.tsv,contigs.q001.d01.tsv'])
+        self.assertEqual(self.search.args['-query'], 'contigs.fa')
+
+    def test_single_shards(self):
+        pb = ParallelBlast(self.search, 1)
+        self.assertEqual([job.name for job in pb.jobs],
+                         ['screen_q000_d00', 'screen_merge'])
+        self.assertEqual(pb.searches[0].args['-db'], 'nt')
+        self.assertFalse('-dbsize' in pb.searches[0].args)
+        protein = BlastP(name='p')
+        protein.add_argument('-query', 'q.fa')
+        protein.add_argument('-db', 'nr')
+        protein.add_argument('-outfmt', '6')
+        protein.redirect_output('q.tsv', 'output')
+        pb = ParallelBlast(protein, 1, volumes=4, db_shards=1)
+        self.assertEqual((pb.aliases, pb.searches[0].args['-db']), ([], 'nr'))
+        pb = ParallelBlast(protein, 1, volumes=4, db_shards=2)
+        self.assertEqual(pb.aliases[0].args['-dbtype'], 'prot')
+        self.assertEqual(pb.searches[1].redirect_output_file, 'q.q000.d01.tsv')
+        self.assertRaises(InvalidInput, ParallelBlast, CLI(cmd='blastn'), 2)
+
+    def test_render(self):
+        """Quoted -dblist and -outfmt values stay inside --wrap.
+
+        """
+        pb = ParallelBlast(self.search, 1, volumes=4, db_shards=2)
+        wf = WorkFlow(pb.jobs, slurm=True, lsf=False, name='wf.sh')
+        wraps = re.findall(r'--wrap=("(?:[^"\\]|\\.)*")',
+                           wf._build_shell_script_to_text())
+        self.assertEqual(len(wraps), 5)
+        self.assertTrue(r'-dblist \"nt.00 nt.01\"' in wraps[0])
+        for wrap in wraps[2:4]:
+            self.assertTrue(r'-outfmt \"6 qseqid sseqid evalue bitscore\"'
+                            in wrap)
+
+    def test_merge(self):
+        write_hits('a0.tsv', [('q1', 's1', '1e-50', '200'),
+                              ('q1', 's2', '1e-10', '80'),
+                              ('q1', 's1', '1e-5', '60')])
+        write_hits('a1.tsv', [('q2', 's9', '1e-3', '40'),
+                              ('q1', 's3', '1e-30', '150')])
+        write_hits('b0.tsv', [('q3', 's4', '0.0', '500')])
+        write_hits('b1.tsv', [])
+        out = StringIO()
+        merge_hits([['a0.tsv', 'a1.tsv'], ['b0.tsv', 'b1.tsv']], out,
+                   COLUMNS, top=2)
+        # s2 ranks third for q1, the second HSP of s1 stays with it
+        self.assertEqual(out.getvalue().split('\n'), [
+            'q1\ts1\t1e-50\t200', 'q1\ts3\t1e-30\t150', 'q1\ts1\t1e-5\t60',
+            'q2\ts9\t1e-3\t40', 'q3\ts4\t0.0\t500', ''])
+        main(['--columns', ','.join(COLUMNS), 'all.tsv', 'a0.tsv,a1.tsv'])
+        self.assertEqual(len(open('all.tsv').readlines()), 5)
@@ -0,0 +1,73 @@
+"""DAG unittests.
+
+"""
+import unittest
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.dag import DAG, format_seconds
+from tfpipe.utils import CyclicDependency
+from tfpipe.test import make_job
+
+
+class DAGTest(unittest.TestCase):
+    """Two chains: a short one listed first, a long one listed second.
+
+    """
+    def setUp(self):
+        self.short1 = make_job('short1', runtime=10)
+        self.short2 = make_job('short2', runtime=10, parents=[self.short1])
+        self.long1 = make_job('long1', runtime=100)
+        self.long2 = make_job('long2', runtime=200, parents=[self.long1])
+        self.merge = make_job('merge', runtime=5,
+                              parents=[self.short2, self.long2])
+        self.jobs = [self.short1, self.short2, self.long1, self.long2,
+                     self.merge]
+        self.dag = DAG(self.jobs)
+
+    def test_edges(self):
+        self.assertEqual(self.dag.parents[self.merge], [self.short2, self.long2])
+        self.assertEqual(self.dag.children[self.long1], [self.long2])
+
+    def test_bottom_level(self):
+        level = self.dag.bottom_level
+        self.assertEqual(level[self.long1], 305)
+        self.assertEqual(level[self.short1], 25)
+        self.assertEqual(level[self.merge], 5)
+
+    def test_priority_order(self):
+        """Long chain goes first, dependencies are respected.
+
+        """
+        self.assertEqual(self.dag.priority_order(),
+                         [self.long1, self.long2, self.short1, self.short2,
+                          self.merge])
+
+    def test_critical_path(self):
+        self.assertEqual(self.dag.critical_path(),
+                         [self.long1, self.long2, self.merge])
+
+    def test_makespan(self):
+        """Unlimited slots give the critical path, one slot the total work.
+
+        """
+        self.assertEqual(self.dag.makespan(), 305)
+        self.assertEqual(self.dag.makespan(slots=1), 325)
+        self.assertEqual(self.dag.makespan(slots=2), 305)
+
+    def test_cycle(self):
+        a = make_job('a', runtime=1)
+        b = make_job('b', runtime=1, parents=[a])
+        a.add_dependencies(done=[b])
+        self.assertRaises(CyclicDependency, DAG([a, b]).topological_order)
+
+    def test_workflow_submission_order(self):
+        """Submission script lists the critical path first.
+
+        """
+        wf = WorkFlow(self.jobs, slurm=True, lsf=False)
+        script = wf._build_shell_script_to_text()
+        names = [line.split()[2] for line in script.splitlines()
+                 if 'sbatch' in line]
+        self.assertEqual(names, ['long1', 'long2', 'short1', 'short2', 'merge'])
+
+    def test_format_seconds(self):
+        self.assertEqual(format_seconds(3725), "01:02:05")
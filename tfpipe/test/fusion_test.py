@@ -0,0 +1,157 @@
+"""Stream fusion unittests.
+
+"""
+import os
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.samtools import View, Sort, Index
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.fusion import fuse, FusedJob
+from tfpipe.test import TempDirTest, make_job
+
+
+class FusionTest(TempDirTest):
+    """view | sort chains and shell filters.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.view = View(name='view')
+        self.view.add_argument('-b', '')
+        self.view.add_positional_argument('in.sam', 'input')
+        self.view.add_argument('-o', 'in.bam', 'output')
+        self.view.numberofprocesses = 2
+        self.view.memory_req_slurm = '4G'
+        self.sort = Sort(name='sort')
+        self.sort.add_positional_argument('in.bam', 'input')
+        self.sort.add_argument('-o', 'sorted.bam', 'output')
+        self.sort.add_dependencies(done=[self.view])
+        self.index = Index(name='index')
+        self.index.add_positional_argument('sorted.bam', 'input')
+        self.index.add_dependencies(done=[self.sort])
+
+    def test_view_sort(self):
+        jobs = fuse([self.view, self.sort, self.index])
+        self.assertEqual(len(jobs), 2)
+        fused = jobs[0]
+        self.assertTrue(isinstance(fused, FusedJob))
+        self.assertEqual(str(fused), "samtools view -b in.sam | "
+                         "samtools sort -o sorted.bam -")
+        self.assertEqual(fused.name, 'sort')
+        self.assertEqual(fused.jobid, self.sort.jobid)
+        self.assertEqual(fused.numberofprocesses, 3)
+        self.assertEqual(fused.memory_req_slurm, "%dM" % (4096 + 102400))
+        self.assertEqual(jobs[1].dep['done'], [fused])
+        self.assertEqual(jobs[1].name, 'index')
+        self.assertEqual(self.index.dep['done'], [self.sort])
+
+    def test_time_limit(self):
+        """The longest stage limit wins, compared as times, not strings.
+
+        """
+        self.view.time_str_slurm = '"9:00:00"'
+        self.sort.time_str_slurm = '"10:30:00"'
+        fused = fuse([self.view, self.sort])[0]
+        self.assertEqual(fused.time_str_slurm, '"10:30:00"')
+
+    def test_shared_output_not_fused(self):
+        """An intermediate read by two jobs has to be written.
+
+        """
+        other = View(name='other')
+        other.add_positional_argument('in.bam', 'input')
+        other.add_dependencies(done=[self.view])
+        jobs = fuse([self.view, self.sort, other])
+        self.assertEqual(jobs, [self.view, self.sort, other])
+
+    def test_workflow_local(self):
+        with open('in.txt', 'w') as f:
+            f.write("b\na\nb\n")
+        first = make_job('first', 'sort', 'in.txt', 'sorted.txt')
+        second = make_job('second', 'uniq', 'sorted.txt', 'uniq.txt',
+                          [first])
+        third = make_job('third', 'tr a-z A-Z', 'uniq.txt', 'out.txt',
+                         [second])
+        wf = WorkFlow([first, second, third], local=True, fuse=True,
+                      name='wf.sh')
+        self.assertEqual(len(wf.jobs), 1)
+        self.assertEqual(wf.jobs[0].stages, [first, second, third])
+        wf.run()
+        self.assertEqual(open('out.txt').read(), "A\nB\n")
+        self.assertFalse(os.path.exists('sorted.txt'))
+        self.assertFalse(os.path.exists('uniq.txt'))
+
+    def test_seeking_tool_keeps_file(self):
+        jobs = fuse([self.sort, self.index], fifos=True)
+        self.assertEqual(jobs, [self.sort, self.index])
+
+    def test_workflow_slurm_modules(self):
+        wf = WorkFlow([self.view, self.sort, self.index], slurm=True,
+                      lsf=False, fuse=True, name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue("module load samtools/1.3\n" in script)
+        self.assertTrue('-n 3' in script)
+        self.assertTrue('--dependency=afterok:$%s' % self.sort.jobid
+                        in script)
+
+    def test_workflows_from_one_list(self):
+        """Fusing leaves the jobs as they were for the next WorkFlow.
+
+        """
+        jobs = [self.view, self.sort, self.index]
+        first = WorkFlow(jobs, slurm=True, lsf=False, fuse=True, name='a.sh')
+        second = WorkFlow(jobs, slurm=True, lsf=False, name='b.sh')
+        self.assertEqual(self.index.dep['done'], [self.sort])
+        self.assertEqual(len(first.jobs), 2)
+        self.assertEqual(second.jobs, jobs)
+        script = second._build_shell_script_to_text()
+        self.assertTrue(script.index('%s=' % self.sort.jobid) <
+                        script.index('afterok:$%s' % self.sort.jobid))
+
+
+class FifoTest(TempDirTest):
+    """Tools reading and writing file paths, connected through a FIFO.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        with open('in.txt', 'w') as f:
+            f.write("b\na\nb\n")
+
+    def chain(self, input_file='in.txt'):
+        first = CLI(cmd='sort', name='first')
+        first.add_argument('-o', 'mid.txt', 'output')
+        first.add_positional_argument(input_file, 'input')
+        second = CLI(cmd='uniq', name='second')
+        second.add_positional_argument('mid.txt', 'input')
+        second.add_positional_argument('out.txt', 'output')
+        second.add_dependencies(done=[first])
+        return [first, second]
+
+    def test_not_without_fifo(self):
+        jobs = self.chain()
+        self.assertEqual(fuse(jobs), jobs)
+
+    def test_command(self):
+        fused = fuse(self.chain(), fifos=True)[0]
+        self.assertEqual(fused.links, ['fifo'])
+        self.assertTrue(str(fused).startswith(
+            "rm -f mid.txt.fifo mid.txt.failed && mkfifo mid.txt.fifo && "
+            "{ { sort -o mid.txt.fifo in.txt || touch mid.txt.failed; "
+            ": <> mid.txt.fifo; } & { uniq mid.txt.fifo out.txt"))
+
+    def test_workflow_local(self):
+        wf = WorkFlow(self.chain(), local=True, fifo=True, name='wf.sh')
+        status = wf.run()
+        self.assertEqual(status.values(), ['DONE'])
+        self.assertEqual(open('out.txt').read(), "a\nb\n")
+        self.assertEqual(sorted(os.listdir('.')), ['in.txt', 'out.txt',
+                                                   'second.out'])
+
+    def test_failed_producer(self):
+        """A producer failing before it opens the FIFO fails the job.
+
+        """
+        wf = WorkFlow(self.chain('missing.txt'), local=True, fifo=True,
+                      name='wf.sh')
+        self.assertEqual(wf.run().values(), ['EXIT'])
+        self.assertFalse(os.path.exists('mid.txt.failed'))
@@ -0,0 +1,113 @@
+"""LocalExecutor unittests.
+
+"""
+import os
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow, LocalExecutor
+from tfpipe.test import TempDirTest
+
+
+class QuickCLI(CLI):
+    """CLI with a one second class default time limit.
+
+    """
+    _time_str_slurm = '"00:00:01"'
+
+
+class LocalExecutorTest(TempDirTest):
+    """Run small shell job graphs on the local host.
+
+    """
+    def test_dependencies_run_in_order(self):
+        """Downstream job sees the output of its upstream job.
+
+        """
+        first = CLI(cmd="echo one > a.txt", name='first')
+        second = CLI(cmd="cat a.txt > b.txt", name='second')
+        second.add_dependencies(done=[first,])
+        status = LocalExecutor([second, first], max_workers=2).run()
+        self.assertEqual(status[first], 'DONE')
+        self.assertEqual(status[second], 'DONE')
+        self.assertEqual(open('b.txt').read(), "one\n")
+
+    def test_failure_skips_dependents(self):
+        """Jobs depending on a failed job are skipped, others still run.
+
+        """
+        bad = CLI(cmd="exit 3", name='bad')
+        child = CLI(cmd="touch child", name='child')
+        child.add_dependencies(done=[bad,])
+        other = CLI(cmd="touch other", name='other')
+        executor = LocalExecutor([bad, child, other], max_workers=1)
+        status = executor.run()
+        self.assertEqual(status[bad], 'EXIT')
+        self.assertEqual(executor.returncodes[bad], 3)
+        self.assertEqual(status[child], 'SKIPPED')
+        self.assertEqual(status[other], 'DONE')
+        self.assertFalse(os.path.exists('child'))
+        self.assertEqual(set(executor.failed()), set([bad, child]))
+
+    def test_exit_condition(self):
+        """An exit dependency only runs when upstream fails.
+
+        """
+        bad = CLI(cmd="false", name='bad')
+        cleanup = CLI(cmd="true", name='cleanup')
+        cleanup.add_dependencies(exit=[bad,])
+        status = LocalExecutor([bad, cleanup]).run()
+        self.assertEqual(status[cleanup], 'DONE')
+
+    def test_long_chain_skipped(self):
+        """A failure at the head of a long chain skips the whole chain.
+
+        """
+        jobs = [CLI(cmd="false", name='j0')]
+        for i in range(1, 2000):
+            job = CLI(cmd="true", name='j%d' % i)
+            job.add_dependencies(done=[jobs[-1]])
+            jobs.append(job)
+        started = CLI(cmd="true", name='started')
+        started.add_dependencies(started=[jobs[0]])
+        executor = LocalExecutor(jobs + [started])
+        self.assertEqual(executor._ready_jobs(), [jobs[0]])
+        status = executor.run()
+        self.assertEqual(status[jobs[-1]], 'SKIPPED')
+        self.assertEqual(status[started], 'DONE')
+        self.assertEqual(len(executor.failed()), 2000)
+
+    def test_job_output_file(self):
+        """Job stdout is captured in job_output_file.
+
+        """
+        job = CLI(cmd="echo hello", name='hello')
+        LocalExecutor([job]).run()
+        self.assertEqual(open('hello.out').read(), "hello\n")
+
+    def test_workflow_local(self):
+        """WorkFlow with local=True runs jobs instead of submitting them.
+
+        """
+        job = CLI(cmd="touch ran", name='touch_job')
+        wf = WorkFlow([job], local=True, max_workers=1)
+        self.assertFalse(wf.lsf)
+        self.assertFalse(wf.slurm)
+        self.assertEqual(wf._create_submit_str(job), str(job) + "\n")
+        status = wf.run()
+        self.assertEqual(status[job], 'DONE')
+        self.assertTrue(os.path.exists('ran'))
+
+    def test_default_time_limit(self):
+        """Class default limits only apply to jobs with a retry policy.
+
+        """
+        job = QuickCLI(cmd="sleep 2", name='quick')
+        self.assertFalse(job.time_limit_set)
+        executor = LocalExecutor([job])
+        self.assertEqual(executor.time_limit(job), None)
+        self.assertEqual(executor.run()[job], 'DONE')
+        job.add_retry(max_attempts=1)
+        self.assertEqual(LocalExecutor([job]).run()[job], 'EXIT')
+        job = QuickCLI(cmd="sleep 2", name='quick')
+        job.time_str_slurm = '"00:00:01"'
+        self.assertTrue(job.clone('copy').time_limit_set)
+        self.assertEqual(LocalExecutor([job]).run()[job], 'EXIT')
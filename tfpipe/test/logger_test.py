@@ -0,0 +1,88 @@
+"""Logging unittests.
+
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from multiprocessing import Pool
+from tfpipe.utils import logger, configure_logging, stop_logging
+from tfpipe.test import configure_test_logging
+
+
+def log_from_worker(i):
+    """Log a message from a multiprocessing worker.
+
+    """
+    logger.info("worker %d", i)
+    return os.getpid()
+
+
+class LoggerTest(unittest.TestCase):
+    """Logging to a temporary file.
+
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'tfpipe.log')
+
+    def tearDown(self):
+        configure_test_logging()
+        shutil.rmtree(self.tmp)
+
+    def lines(self):
+        """Return the lines written once logging is stopped.
+
+        """
+        stop_logging()
+        if not os.path.exists(self.path):
+            return []
+        return open(self.path).read().splitlines()
+
+    def test_jsonl(self):
+        configure_logging(level='INFO', path=self.path, fmt='jsonl')
+        logger.debug("hidden")
+        logger.info("%s: added", 'sort')
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            logger.exception("failed")
+        entries = [json.loads(line) for line in self.lines()]
+        self.assertEqual([e['message'] for e in entries],
+                         ['sort: added', 'failed'])
+        self.assertEqual(entries[0]['level'], 'INFO')
+        self.assertEqual(entries[0]['logger'], 'tfpipe')
+        self.assertTrue('ValueError: bad' in entries[1]['exception'])
+
+    def test_level_gating(self):
+        configure_logging(level='WARNING', path=self.path)
+        logger.info("hidden")
+        self.assertFalse(logger.isEnabledFor(20))
+        self.assertEqual(self.lines(), [])
+
+    def test_unqueued(self):
+        configure_logging(level=10, path=self.path, fmt='text',
+                          queued=False)
+        logger.debug("written")
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith(' - tfpipe - DEBUG - written'))
+
+    def test_forked_workers(self):
+        """Records of forked workers are written once, as are the parent's.
+
+        """
+        configure_logging(level='INFO', path=self.path)
+        logger.info("before")
+        pool = Pool(2)
+        try:
+            pids = pool.map(log_from_worker, range(4))
+        finally:
+            pool.close()
+            pool.join()
+        logger.info("after")
+        lines = [line.split(' - ')[-1] for line in self.lines()]
+        self.assertFalse(os.getpid() in pids)
+        self.assertEqual(sorted(lines), ['after', 'before', 'worker 0',
+                                         'worker 1', 'worker 2', 'worker 3'])
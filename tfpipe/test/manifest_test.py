@@ -0,0 +1,114 @@
+"""Manifest unittests.
+
+"""
+import os
+import shlex
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.manifest import Manifest, fingerprint_file, main
+from tfpipe.utils import python_module
+from tfpipe.test import TempDirTest, make_job
+
+
+class ManifestTest(TempDirTest):
+    """Re-running a small local chain.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        with open('in.txt', 'w') as f:
+            f.write("data\n")
+
+    def chain(self, suffix=''):
+        first = make_job('first', 'cat', 'in.txt', 'mid.txt')
+        second = make_job('second', 'tr a-z A-Z' + suffix, 'mid.txt',
+                          'out.txt', [first])
+        return first, second
+
+    def workflow(self, jobs):
+        return WorkFlow(list(jobs), local=True, incremental=True,
+                        name='wf.sh')
+
+    def test_fingerprint_file(self):
+        self.assertEqual(fingerprint_file('missing'), None)
+        fp = fingerprint_file('in.txt')
+        self.assertTrue(fp.startswith('5:'))
+        with open('in.txt', 'w') as f:
+            f.write("DATA\n")
+        self.assertNotEqual(fingerprint_file('in.txt'), fp)
+
+    def test_skip_unchanged(self):
+        wf = self.workflow(self.chain())
+        self.assertEqual(len(wf.jobs_to_run()), 2)
+        wf.run()
+        self.assertEqual(open('out.txt').read(), "DATA\n")
+        self.assertEqual(self.workflow(self.chain()).jobs_to_run(), [])
+
+    def test_changed_command_reruns_downstream_only(self):
+        self.workflow(self.chain()).run()
+        first, second = self.chain(suffix=' ')
+        self.assertEqual(self.workflow([first, second]).jobs_to_run(), [])
+        first, second = self.chain(suffix=' | rev')
+        self.assertEqual(self.workflow([first, second]).jobs_to_run(),
+                         [second])
+
+    def test_changed_input_reruns_everything(self):
+        self.workflow(self.chain()).run()
+        with open('in.txt', 'w') as f:
+            f.write("other\n")
+        self.assertEqual(len(self.workflow(self.chain()).jobs_to_run()), 2)
+
+    def test_deleted_intermediate_is_skipped(self):
+        """Upstream of an unchanged job is skipped even without its output.
+
+        """
+        self.workflow(self.chain()).run()
+        os.remove('mid.txt')
+        self.assertEqual(self.workflow(self.chain()).jobs_to_run(), [])
+        os.remove('out.txt')
+        self.assertEqual(len(self.workflow(self.chain()).jobs_to_run()), 2)
+
+    def test_cluster_record_command(self):
+        """Submitted jobs record themselves once they succeed.
+
+        """
+        first, second = self.chain()
+        wf = WorkFlow([first, second], slurm=True, lsf=False,
+                      incremental=True, name='wf.sh')
+        manifest = wf.manifest
+        command = manifest.record_command(first)
+        self.assertTrue(command.startswith("%s %s first " % (
+            python_module('tfpipe.pipeline.manifest'), manifest.path)))
+        self.assertTrue(command.endswith("-i in.txt -o mid.txt"))
+        self.assertTrue(command in wf._build_shell_script_to_text())
+        os.system("cat in.txt > mid.txt")
+        main(shlex.split(command)[3:])
+        self.assertEqual(manifest.state(first), 'CURRENT')
+        spaced = make_job('spaced', 'cat', 'my in.txt', 'my out.txt')
+        self.assertTrue(manifest.record_command(spaced).endswith(
+            "-i 'my in.txt' -o 'my out.txt'"))
+
+    def test_planning_writes_nothing(self):
+        """Outputs newer than inputs are recorded when the workflow runs,
+        not when its script is built.
+
+        """
+        os.system("cat in.txt > mid.txt && tr a-z A-Z < mid.txt > out.txt")
+        wf = self.workflow(self.chain())
+        wf._build_shell_script_to_text()
+        self.assertEqual(wf.jobs_to_run(), [])
+        self.assertFalse(os.path.exists(wf.manifest.path))
+        wf.run()
+        self.assertEqual(sorted(os.listdir(wf.manifest.path)),
+                         ['first.json', 'second.json'])
+
+    def test_skipped_dependencies_dropped(self):
+        """Submitted jobs do not wait on skipped jobs.
+
+        """
+        self.workflow(self.chain()).run()
+        first, second = self.chain(suffix=' | rev')
+        wf = WorkFlow([first, second], slurm=True, lsf=False,
+                      incremental=True, name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertFalse(first.jobid in script)
+        self.assertTrue('sbatch -J second  -o' in script)
@@ -0,0 +1,109 @@
+"""Parallel job graph construction unittests.
+
+"""
+import os
+import pickle
+import threading
+import unittest
+from multiprocessing import Pool
+from tfpipe.base import jobid, set_job_namespace
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow
+from tfpipe.utils import InvalidInput
+
+INDEX = CLI(cmd='index ref.fa', name='index')
+
+
+def build_sample(sample):
+    """Return the jobs of one sample, pickled as a pool would send them.
+
+    """
+    align = CLI(cmd='align %s.fq' % sample, name='align_%s' % sample)
+    align.add_dependencies(done=[INDEX])
+    sort = CLI(cmd='sort %s.bam' % sample, name='sort_%s' % sample)
+    sort.add_dependencies(done=[align])
+    return pickle.dumps([align, sort], 2)
+
+
+class JobIdTest(unittest.TestCase):
+    """Allocating job IDs.
+
+    """
+    def tearDown(self):
+        set_job_namespace()
+
+    def test_threads(self):
+        ids = []
+
+        def allocate():
+            ids.extend(CLI(cmd='true').jobid for _ in range(2000))
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 8000)
+
+    def test_processes(self):
+        pool = Pool(2)
+        try:
+            ids = pool.map(worker_jobids, range(4))
+        finally:
+            pool.close()
+            pool.join()
+        ids = sum(ids, [])
+        self.assertEqual(len(set(ids)), len(ids))
+        # Workers prefix their IDs with their process ID
+        self.assertTrue(all(i.startswith('JOB') and '_' in i for i in ids))
+
+    def test_namespace(self):
+        set_job_namespace('S01')
+        self.assertEqual(CLI(cmd='true').jobid, 'JOBS01_0000')
+        self.assertRaises(InvalidInput, set_job_namespace, 'a b')
+        set_job_namespace()
+        self.assertTrue(CLI(cmd='true').jobid.startswith('JOB0'))
+
+
+def worker_jobids(_):
+    """Return job IDs allocated in a pool worker.
+
+    """
+    return [CLI(cmd='true').jobid for _ in range(3)]
+
+
+class MergeTest(unittest.TestCase):
+    """Merging job graphs built in a process pool.
+
+    """
+    def test_merge_from_pool(self):
+        pool = Pool(2)
+        try:
+            graphs = [pickle.loads(p) for p in
+                      pool.map(build_sample, ['a', 'b', 'c'])]
+        finally:
+            pool.close()
+            pool.join()
+        wf = WorkFlow([INDEX], slurm=True, lsf=False, name='wf.sh')
+        wf.merge(*graphs)
+        self.assertEqual(len(wf.jobs), 7)
+        self.assertEqual(len(set(job.jobid for job in wf.jobs)), 7)
+        aligns = [job for job in wf.jobs if job.name.startswith('align')]
+        self.assertTrue(all(job.dep['done'] == [INDEX] for job in aligns))
+        self.assertEqual(wf.dag().critical_path()[0], INDEX)
+
+    def test_clashing_ids(self):
+        set_job_namespace('X')
+        first = [CLI(cmd='true', name='a')]
+        set_job_namespace('X')
+        second = [CLI(cmd='true', name='b')]
+        after = CLI(cmd='true', name='c')
+        after.add_dependencies(done=second)
+        second.append(after)
+        set_job_namespace()
+        self.assertEqual(first[0].jobid, second[0].jobid)
+        wf = WorkFlow(first, slurm=True, lsf=False, name='wf.sh')
+        wf.merge(WorkFlow(second, slurm=True, lsf=False, name='other.sh'))
+        self.assertEqual(len(set(job.jobid for job in wf.jobs)), 3)
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('--dependency=afterok:$%s ' % second[0].jobid
+                        in script)
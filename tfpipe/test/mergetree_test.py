@@ -0,0 +1,78 @@
+"""Merge tree unittests.
+
+"""
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.picard import MergeSamFilesSLURM
+from tfpipe.pipeline import MergeTree
+from tfpipe.pipeline.mergetree import choose_fan_in
+from tfpipe.utils import InvalidInput
+from tfpipe.test import TempDirTest
+
+
+class MergeTreeTest(TempDirTest):
+    """Planning merges of many BAM files.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.sorts = []
+        for i in range(10):
+            job = CLI(cmd='sort', name='sort%d' % i)
+            job.output_file = 'S%d.bam' % i
+            self.sorts.append(job)
+
+    def test_fan_in(self):
+        self.assertEqual(choose_fan_in(12), 12)
+        self.assertEqual(choose_fan_in(1000), 32)
+        # Ten gigabyte files make smaller leaves and a deeper tree
+        self.assertEqual(choose_fan_in(1000, [10 * 1024 ** 3] * 1000), 6)
+        self.assertEqual(choose_fan_in(100000), 47)
+
+    def test_tree(self):
+        tree = MergeTree(self.sorts, 'cohort.bam', fan_in=3)
+        self.assertEqual([[job.name for job in level]
+                          for level in tree.levels],
+                         [['merge_l0_000', 'merge_l0_001', 'merge_l0_002',
+                           'merge_l0_003'],
+                          ['merge_l1_000', 'merge_l1_001'], ['merge']])
+        leaf = tree.levels[0][1]
+        self.assertEqual(leaf.dep['done'], self.sorts[2:5])
+        self.assertEqual(str(leaf).split(), [
+            'samtools', 'merge', '-l', '1', '-f', 'cohort.l0_001.bam',
+            'S2.bam', 'S3.bam', 'S4.bam'])
+        self.assertEqual(tree.levels[1][0].dep['done'], tree.levels[0][:2])
+        self.assertEqual(tree.merge.dep['done'], tree.levels[1])
+        self.assertEqual(tree.merge.output_file, 'cohort.bam')
+        self.assertFalse('-l' in tree.merge.args)
+        self.assertEqual(len(tree.jobs), 7)
+
+    def test_sizes_from_files(self):
+        paths = []
+        for i in range(40):
+            paths.append('S%d.bam' % i)
+            with open(paths[-1], 'w') as f:
+                f.write('x' * 100)
+        tree = MergeTree(paths, 'out/cohort.bam')
+        self.assertEqual(tree.fan_in, 7)
+        tree = MergeTree(paths, 'out/cohort.bam', directory='tmp')
+        self.assertEqual(tree.levels[0][0].output_file,
+                         'tmp/cohort.l0_000.bam')
+        self.assertEqual(choose_fan_in(40, [100] * 40, leaf_bytes=250), 2)
+
+    def test_picard(self):
+        tree = MergeTree(self.sorts, 'cohort.bam', fan_in=5,
+                         merge=MergeSamFilesSLURM(name='template'))
+        self.assertEqual(tree.levels[0][0].pos_args, [
+            'O=cohort.l0_000.bam', 'I=S0.bam', 'I=S1.bam', 'I=S2.bam',
+            'I=S3.bam', 'I=S4.bam', 'COMPRESSION_LEVEL=1'])
+        self.assertEqual(tree.merge.pos_args, [
+            'O=cohort.bam', 'I=cohort.l0_000.bam', 'I=cohort.l0_001.bam'])
+
+    def test_small(self):
+        tree = MergeTree(self.sorts[:1], 'cohort.bam')
+        self.assertEqual(tree.jobs, [tree.merge])
+        self.assertEqual(tree.merge.dep['done'], self.sorts[:1])
+        self.assertEqual(len(MergeTree(self.sorts, 'cohort.bam').jobs), 1)
+        self.assertRaises(InvalidInput, MergeTree, [], 'cohort.bam')
+        self.assertRaises(InvalidInput, MergeTree, [CLI(cmd='ls')], 'x.bam')
+        self.assertRaises(InvalidInput, MergeTree, self.sorts, 'x.bam', 1)
@@ -0,0 +1,125 @@
+"""Metrics store unittests.
+
+"""
+import os
+import re
+import sys
+from subprocess import call
+import tfpipe
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.metrics import job_class
+from tfpipe.utils import python_module, set_interpreter
+from tfpipe.test import TempDirTest, copy_job
+
+
+class MetricsTest(TempDirTest):
+    """Jobs run under the metrics wrapper.
+
+    """
+    def setUp(self):
+        # The wrapper runs as python -m tfpipe.pipeline.metrics
+        self.pythonpath = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(os.path.abspath(tfpipe.__file__)))
+        TempDirTest.setUp(self)
+        for sample in ('a', 'b'):
+            with open('%s.txt' % sample, 'w') as f:
+                f.write(sample * 1000)
+
+    def tearDown(self):
+        if self.pythonpath is None:
+            del os.environ['PYTHONPATH']
+        else:
+            os.environ['PYTHONPATH'] = self.pythonpath
+        TempDirTest.tearDown(self)
+
+    def test_job_class(self):
+        job = CLI(cmd='true')
+        self.assertEqual(job_class(job), 'tfpipe.modules.cli.interface.CLI')
+
+    def test_local(self):
+        copy = copy_job('copy', 'a.txt', 'c.txt')
+        copy.memory_req_slurm = '2G'
+        bad = CLI(cmd="echo 'it''s' && exit 3", name='bad')
+        wf = WorkFlow([copy, bad], local=True, metrics=True, name='wf.sh')
+        status = wf.run()
+        self.assertEqual(status[bad], 'EXIT')
+        self.assertEqual(open('bad.out').read(), "its\n")
+        records = dict((r['name'], r) for r in wf.metrics.records())
+        self.assertEqual(records['copy']['returncode'], 0)
+        self.assertEqual(records['copy']['memory_mb'], 2048)
+        self.assertEqual(records['copy']['input_bytes'], 1000)
+        self.assertTrue(records['copy']['write_bytes'] >= 1000)
+        self.assertTrue(records['copy']['max_rss_mb'] > 0)
+        self.assertEqual(records['bad']['returncode'], 3)
+        self.assertEqual(records['bad']['jobid'], bad.jobid)
+        self.assertEqual(len(wf.metrics.summary()), 1)
+
+    def test_submission(self):
+        job = copy_job('copy', 'a.txt', 'c.txt')
+        wf = WorkFlow([job], slurm=True, lsf=False, metrics='m/store.jsonl',
+                      name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('--wrap="%s %s %s '
+                        'copy tfpipe.modules.cli.interface.CLI --cpus 1 '
+                        '--input a.txt -- bash -c \'cp' %
+                        (python_module('tfpipe.pipeline.metrics'),
+                         os.path.abspath('m/store.jsonl'), job.jobid)
+                        in script)
+
+    def test_quoted_submission(self):
+        """Quotes in the command and the store path survive --wrap.
+
+        """
+        job = CLI(cmd="echo 'it''s' > quoted.txt", name='quoted')
+        wf = WorkFlow([job], slurm=True, lsf=False,
+                      metrics='m s/store.jsonl', name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        wrap = re.search(r'--wrap=("(?:[^"\\]|\\.)*")', script).group(1)
+        # The submitting shell unquotes the wrap, sbatch runs it with sh
+        self.assertEqual(call(['sh', '-c', 'sh -c ' + wrap]), 0)
+        self.assertEqual(open('quoted.txt').read(), "its\n")
+        self.assertEqual([r['name'] for r in wf.metrics.records()],
+                         ['quoted'])
+
+    def test_interpreter(self):
+        self.assertEqual(python_module('tfpipe.pipeline.metrics'),
+                         '%s -m tfpipe.pipeline.metrics' % sys.executable)
+        set_interpreter('/opt/python 2.7/bin/python')
+        try:
+            self.assertEqual(python_module('tfpipe.pipeline.metrics'),
+                             "'/opt/python 2.7/bin/python' -m "
+                             "tfpipe.pipeline.metrics")
+        finally:
+            set_interpreter()
+
+    def test_array_driver(self):
+        jobs = [copy_job('a_copy', 'a.txt', 'a.out.txt'),
+                copy_job('b_copy', 'b.txt', 'b.out.txt')]
+        wf = WorkFlow(jobs, slurm=True, lsf=False, arrays=True, metrics=True,
+                      name='wf.sh')
+        wf._build_shell_script_to_text()
+        for path, text in wf._support_files.items():
+            with open(path, 'w') as f:
+                f.write(text)
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID='2')
+        self.assertEqual(call(['bash', 'wf.copy.sh'], env=env), 0)
+        self.assertEqual(open('b.out.txt').read(), 'b' * 1000)
+        self.assertEqual([r['name'] for r in wf.metrics.records()],
+                         ['b_copy'])
+
+    def test_array_driver_quoted_store(self):
+        jobs = [copy_job('a_copy', 'a.txt', 'a.out.txt'),
+                copy_job('b_copy', 'b.txt', 'b.out.txt')]
+        wf = WorkFlow(jobs, slurm=True, lsf=False, arrays=True,
+                      metrics='m s/store.jsonl', name='wf.sh')
+        wf._build_shell_script_to_text()
+        for path, text in wf._support_files.items():
+            with open(path, 'w') as f:
+                f.write(text)
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID='1')
+        self.assertEqual(call(['bash', 'wf.copy.sh'], env=env), 0)
+        self.assertEqual(open('a.out.txt').read(), 'a' * 1000)
+        self.assertEqual([r['name'] for r in wf.metrics.records()],
+                         ['a_copy'])
@@ -0,0 +1,52 @@
+"""Tool registry unittests.
+
+"""
+import os
+import sys
+import inspect
+import unittest
+from subprocess import check_output
+from importlib import import_module
+import tfpipe.modules
+from tfpipe.base import Job
+from tfpipe.modules import TOOLS, PACKAGES, get_tool
+from tfpipe.modules.samtools import Sort
+from tfpipe.utils import InvalidInput
+
+
+class RegistryTest(unittest.TestCase):
+    """Looking tools up by name.
+
+    """
+    def test_index_lists_every_tool(self):
+        found = {}
+        for package in PACKAGES:
+            module = import_module('tfpipe.modules.' + package)
+            for name, value in vars(module).items():
+                if inspect.isclass(value) and issubclass(value, Job):
+                    found[name] = package
+        self.assertEqual(found, TOOLS)
+
+    def test_get_tool(self):
+        self.assertTrue(get_tool('Sort') is Sort)
+        self.assertTrue(get_tool('samtools.Sort') is Sort)
+        self.assertTrue(tfpipe.modules.Sort is Sort)
+        self.assertTrue(tfpipe.modules.samtools.Sort is Sort)
+        for name in ('Nothing', 'samtools.Nothing', 'nothing.Sort'):
+            self.assertRaises(InvalidInput, get_tool, name)
+        self.assertRaises(AttributeError, getattr, tfpipe.modules, 'Nothing')
+
+    def test_import_is_lazy(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        probe = ("import sys, tfpipe\n"
+                 "print sorted(m for m in sys.modules if m.startswith("
+                 "('tfpipe.modules.', 'tfpipe.pipeline')))\n"
+                 "print tfpipe.modules.Gsnap.__name__\n"
+                 "print sorted(m for m in sys.modules if m.startswith("
+                 "('tfpipe.modules.', 'tfpipe.pipeline')) and sys.modules[m])")
+        output = check_output([sys.executable, '-c', probe], cwd=root,
+                              env=dict(os.environ, TFPIPE_LOG_FILE='-'))
+        self.assertEqual(output.splitlines(), [
+            '[]', 'Gsnap',
+            "['tfpipe.modules.gmap', 'tfpipe.modules.gmap.alignment']"])
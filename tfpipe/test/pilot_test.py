@@ -0,0 +1,116 @@
+"""Pilot mode unittests.
+
+"""
+import os
+import json
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow, Pilot, engine
+from tfpipe.pipeline.pilot import PilotWorker, seconds
+from tfpipe.utils import python_module
+from tfpipe.test import TempDirTest
+
+
+class PilotTest(TempDirTest):
+    """Workers sharing a plan directory.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        first = CLI(cmd="echo one > a.txt", name='first')
+        second = CLI(cmd="cat a.txt > b.txt", name='second')
+        second.add_dependencies(done=[first])
+        bad = CLI(cmd="exit 2", name='bad')
+        child = CLI(cmd="touch child", name='child')
+        child.add_dependencies(done=[bad])
+        self.jobs = [first, second, bad, child]
+        self.wf = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh',
+                           pilot=Pilot(allocations=2, cpus=4, memory='8G',
+                                       walltime='02:00:00', poll=0))
+        self.plan_dir = os.path.join(self.tmp, 'wf.pilot')
+
+    def test_seconds(self):
+        self.assertEqual(seconds('"01:02:03"'), 3723)
+        self.assertEqual(seconds('10:00'), 36000)
+
+    def test_submissions(self):
+        """One allocation per worker instead of one submission per job.
+
+        """
+        script = self.wf._build_shell_script_to_text()
+        lines = [l for l in script.splitlines() if 'sbatch' in l]
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith(
+            'sbatch -J wf_pilot1 -N 1 -n 1 -c 4 --mem=8G --time 02:00:00'))
+        self.assertTrue('%s %s --cpus 4 --memory 8G --walltime 7200' % (
+            python_module('tfpipe.pipeline.pilot'), self.plan_dir)
+            in lines[0])
+        self.assertEqual(list(self.wf._support_files),
+                         [os.path.join(self.plan_dir, 'plan.json')])
+
+    def test_lsf_submissions(self):
+        wf = WorkFlow(self.jobs, name='wf.sh', pilot=Pilot(cpus=4,
+                                                           memory='8G'))
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('bsub -J wf_pilot1 -n 4 -R "span[hosts=1]" -M 8 '
+                        '-W 24:00 -o wf_pilot1.out %s' %
+                        python_module('tfpipe.pipeline.pilot') in script)
+
+    def test_workers(self):
+        """A worker runs the plan; a later worker finds nothing to do.
+
+        """
+        self.write_plan()
+        worker = PilotWorker(self.plan_dir, cpus=2, memory=1024, poll=0)
+        status = worker.run()
+        by_name = dict((job.name, state) for job, state in status.items())
+        self.assertEqual(by_name, {'first': 'DONE', 'second': 'DONE',
+                                   'bad': 'EXIT', 'child': 'SKIPPED'})
+        self.assertEqual(open('b.txt').read(), "one\n")
+        self.assertEqual(sorted(os.listdir(os.path.join(self.plan_dir,
+                                                        'status'))),
+                         ['bad', 'first', 'second'])
+        other = PilotWorker(self.plan_dir, cpus=2, memory=1024, poll=0)
+        other.run()
+        self.assertEqual(other.mine, set())
+        self.assertEqual(dict((job.name, state)
+                              for job, state in other.status.items()),
+                         by_name)
+
+    def write_plan(self):
+        submit = engine.system
+        engine.system = lambda command: 0
+        try:
+            self.wf.run()
+        finally:
+            engine.system = submit
+
+    def test_unfit_jobs_end_worker(self):
+        """A worker leaves when no job it could start fits its wall time.
+
+        """
+        self.jobs[0].runtime_estimate = 3 * 3600
+        self.wf = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh',
+                           pilot=Pilot(walltime='02:00:00', poll=0))
+        self.write_plan()
+        worker = PilotWorker(self.plan_dir, cpus=2, memory=1024,
+                             walltime=7200, poll=3600)
+        status = dict((job.name, state)
+                      for job, state in worker.run().items())
+        self.assertEqual((status['first'], status['second'], status['bad']),
+                         ('PENDING', 'PENDING', 'EXIT'))
+
+    def test_take_over_once(self):
+        """Of the workers finding a claim expired, one takes it over.
+
+        """
+        self.write_plan()
+        claim = os.path.join(self.plan_dir, 'claims', 'first')
+        os.mkdir(claim)
+        with open(os.path.join(claim, 'owner'), 'w') as f:
+            json.dump({'host': 'node1', 'pid': 1, 'deadline': 0}, f)
+        workers = [PilotWorker(self.plan_dir, cpus=2, memory=1024, poll=0)
+                   for i in range(2)]
+        first = [job for job in workers[0].jobs if job.name == 'first'][0]
+        self.assertEqual([worker._claim(first) for worker in workers],
+                         [True, False])
+        self.assertFalse(workers[1]._expired(claim))
@@ -0,0 +1,119 @@
+"""Genomic region sharding unittests.
+
+"""
+from subprocess import check_call
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.fseq import FseqJava
+from tfpipe.modules.mach import Mach1
+from tfpipe.modules.plink import Plink
+from tfpipe.pipeline import RegionShards, WorkFlow
+from tfpipe.pipeline.regions import genome_regions, read_genome
+from tfpipe.utils import InvalidInput
+from tfpipe.test import TempDirTest
+
+GENOME = [('1', 2500000), ('2', 1000000)]
+
+
+class RegionsTest(TempDirTest):
+    """Sharding Plink, Fseq and Mach1 jobs.
+
+    """
+    def test_regions(self):
+        with open('hg.fai', 'w') as f:
+            f.write('# name size\nchr1\t2500000\t6\t60\t61\nchr2\t1000000\n')
+        self.assertEqual(read_genome('hg.fai'),
+                         [('chr1', 2500000), ('chr2', 1000000)])
+        self.assertEqual(genome_regions(GENOME, 1000000), [
+            ('1', 1, 1000000, '1_0000'), ('1', 1000001, 2000000, '1_0001'),
+            ('1', 2000001, 2500000, '1_0002'), ('2', 1, 1000000, '2_0000')])
+        self.assertEqual(genome_regions(GENOME)[1], ('2', 1, 1000000, '2'))
+        with open('bad.genome', 'w') as f:
+            f.write('chr1 many\n')
+        self.assertRaises(InvalidInput, read_genome, 'bad.genome')
+
+    def test_plink(self):
+        upstream = CLI(cmd='true', name='qc')
+        assoc = Plink(name='assoc')
+        assoc.add_argument('--bfile', 'panel')
+        assoc.add_argument('--out', 'gwas.{region}')
+        assoc.output_file = 'gwas.{region}.assoc'
+        assoc.add_dependencies(done=[upstream])
+        self.assertRaises(InvalidInput, RegionShards, assoc, GENOME, 1000000)
+        shards = RegionShards(assoc, GENOME, 1000000, output='gwas.assoc')
+        self.assertEqual([job.name for job in shards.jobs], [
+            'assoc_1_0000', 'assoc_1_0001', 'assoc_1_0002', 'assoc_2_0000',
+            'assoc_merge'])
+        second = shards.shards[1]
+        self.assertEqual(second.args['--out'], 'gwas.1_0001')
+        self.assertEqual((second.args['--chr'], second.args['--from-kb'],
+                          second.args['--to-kb']), ('1', '1000.001', '2000'))
+        self.assertEqual(second.dep['done'], [upstream])
+        self.assertEqual(shards.merge.dep['done'], shards.shards)
+        self.assertEqual(shards.merge.parts[3], 'gwas.2_0000.assoc')
+        # Twice its share, two sevenths, of the template's six hours
+        self.assertEqual(shards.shards[3].time_str_slurm, '"03:26:00"')
+        self.assertEqual(assoc.args['--out'], 'gwas.{region}')
+
+    def test_merge(self):
+        rows = {'gwas.1.assoc': [' 1 rs3 300 A', ' 1 rs1 100 A'],
+                'gwas.2.assoc': [' 2 rs9 50 G']}
+        for path, lines in rows.items():
+            with open(path, 'w') as f:
+                f.write(' CHR SNP BP A1\n' + '\n'.join(lines) + '\n')
+        assoc = Plink(name='assoc')
+        assoc.redirect_output('gwas.assoc', 'output')
+        shards = RegionShards(assoc, [('2', 10), ('1', 10)])
+        self.assertEqual(shards.shards[0].redirect_output_file,
+                         'gwas.2.assoc')
+        check_call(str(shards.merge), shell=True)
+        self.assertEqual(open('gwas.assoc').read().split('\n'), [
+            ' CHR SNP BP A1', ' 1 rs1 100 A', ' 1 rs3 300 A', ' 2 rs9 50 G',
+            ''])
+
+    def test_fseq(self):
+        with open('reads.bed', 'w') as f:
+            f.write('chr1\t10\t60\nchr1\t990\t1040\nchr1\t1500\t1550\n'
+                    'chr2\t5\t55\n')
+        peaks = FseqJava(name='peaks')
+        peaks.add_argument('-of', 'bed')
+        peaks.add_positional_argument('reads.bed', 'input')
+        peaks.redirect_output('peaks.bed', 'output')
+        shards = RegionShards(peaks, [('chr1', 2000), ('chr2', 100)], 1000,
+                              pad=100)
+        second = shards.shards[1]
+        self.assertTrue(second._bash)
+        script = WorkFlow(shards.jobs, slurm=True, lsf=False,
+                          name='wf.sh')._build_shell_script_to_text()
+        self.assertTrue("--wrap=\"bash -c 'java" in script)
+        self.assertTrue("\\$1 == c" in script)
+        self.assertEqual(second.input_file, 'reads.bed')
+        command = second.pos_args[0]
+        self.assertTrue(command.startswith('<(awk -v c=chr1 -v s=901 '))
+        check_call(['bash', '-c', 'cat %s > out.bed' % command])
+        self.assertEqual(open('out.bed').read(),
+                         'chr1\t990\t1040\nchr1\t1500\t1550\n')
+        self.assertTrue('-v s=1 -v e=1100 ' in str(shards.shards[0]))
+        self.assertTrue(shards.merge._runtime_shell)
+        # A peak across the window edge is called by both padded shards
+        with open('peaks.chr1_0000.bed', 'w') as f:
+            f.write('chr1\t20\t50\nchr1\t995\t1030\n')
+        with open('peaks.chr1_0001.bed', 'w') as f:
+            f.write('chr1\t995\t1030\nchr1\t1510\t1540\n')
+        with open('peaks.chr2_0000.bed', 'w') as f:
+            f.write('chr2\t8\t40\n')
+        check_call(str(shards.merge), shell=True)
+        self.assertEqual(open('peaks.bed').read(),
+                         'chr1\t20\t50\nchr1\t995\t1030\n'
+                         'chr1\t1510\t1540\nchr2\t8\t40\n')
+        self.assertEqual(FseqJava._region_pad, 5000)
+
+    def test_mach(self):
+        impute = Mach1(name='impute')
+        impute.add_argument('--datfile', 'chr{chrom}.dat')
+        impute.add_argument('--prefix', 'chr{chrom}')
+        self.assertRaises(InvalidInput, RegionShards, impute, GENOME, 10)
+        self.assertRaises(InvalidInput, RegionShards, impute, GENOME)
+        shards = RegionShards(impute, GENOME, merge=False)
+        self.assertEqual(shards.jobs, shards.shards)
+        self.assertEqual(shards.shards[1].args['--datfile'], 'chr2.dat')
+        self.assertFalse('--chr' in shards.shards[1].args)
@@ -0,0 +1,66 @@
+"""Script rendering unittests.
+
+"""
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.samtools import Sort, View
+from tfpipe.pipeline import WorkFlow, engine, benchmark
+from tfpipe.test import TempDirTest
+
+
+class CountingCLI(CLI):
+    """CLI job counting how often its command line is built.
+
+    """
+    built = 0
+
+    def __str__(self):
+        CountingCLI.built += 1
+        return CLI.__str__(self)
+
+
+class RenderTest(TempDirTest):
+    """Rendering scripts in a temporary directory.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.system = engine.system
+        engine.system = lambda command: 0
+
+    def tearDown(self):
+        engine.system = self.system
+        TempDirTest.tearDown(self)
+
+    def test_modules_loaded_once_in_order(self):
+        jobs = [Sort(name='a'), View(name='b'), Sort(name='c'), CLI(cmd='ls')]
+        wf = WorkFlow(jobs, name='wf.sh',
+                      additionalmodules=['python', Sort()._module])
+        lines = wf._build_shell_script_to_text().splitlines()
+        loads = [line for line in lines if line.startswith('module load')]
+        self.assertEqual(loads, ['module load %s' % Sort()._module,
+                                 'module load python'])
+
+    def test_streamed_script_matches_text(self):
+        first = CLI(cmd='cat a', name='first')
+        second = CLI(cmd='cat b', name='second')
+        second.add_dependencies(done=[first])
+        wf = WorkFlow([first, second], slurm=True, lsf=False, name='wf.sh')
+        text = wf._build_shell_script_to_text()
+        wf.run()
+        self.assertEqual(open('wf.sh').read(), text)
+
+    def test_command_built_once(self):
+        job = CountingCLI(cmd='cp', name='copy')
+        job.add_argument('<', 'in.txt', 'input')
+        job.add_argument('>', 'out.txt', 'output')
+        wf = WorkFlow([job], slurm=True, lsf=False, name='wf.sh',
+                      metrics=True, incremental=True)
+        CountingCLI.built = 0
+        wf._build_shell_script_to_text()
+        # Shared by the metrics wrapper and the manifest record
+        self.assertEqual(CountingCLI.built, 1)
+
+    def test_benchmark(self):
+        result = benchmark.run(50, chain=5, slurm=True)
+        self.assertTrue(result['script_bytes'] > 0)
+        self.assertTrue(result['render'] >= 0)
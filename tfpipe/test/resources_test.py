@@ -0,0 +1,91 @@
+"""ResourcePool unittests.
+
+"""
+import unittest
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.samtools import Sort
+from tfpipe.pipeline.resources import ResourcePool, job_memory_mb
+from tfpipe.utils import memory_to_mb
+from tfpipe.test import make_job
+
+
+class MemoryTest(unittest.TestCase):
+    """Memory requirement parsing.
+
+    """
+    def test_memory_to_mb(self):
+        self.assertEqual(memory_to_mb('100G'), 102400)
+        self.assertEqual(memory_to_mb('4g'), 4096)
+        self.assertEqual(memory_to_mb('512'), 512)
+        self.assertEqual(memory_to_mb('"48"', 'G'), 49152)
+        self.assertEqual(memory_to_mb('2GB'), 2048)
+        self.assertEqual(memory_to_mb(None), None)
+
+    def test_job_memory(self):
+        """SLURM requests carry units, LSF requests are in gigabytes.
+
+        """
+        self.assertEqual(job_memory_mb(Sort()), 102400)
+        job = CLI(cmd="true")
+        job.memory_req_lsf = "48"
+        self.assertEqual(job_memory_mb(job), 49152)
+
+
+class ResourcePoolTest(unittest.TestCase):
+    """Packing ready jobs onto a fixed budget.
+
+    """
+    def test_first_fit(self):
+        """Jobs are started while cpus and memory last.
+
+        """
+        pool = ResourcePool(cpus=4, memory='8G')
+        jobs = [make_job('a', cpus=2, memory='2G'),
+                make_job('b', cpus=2, memory='2G'),
+                make_job('c', cpus=1, memory='1G')]
+        self.assertEqual(pool.select(jobs), jobs[:2])
+        pool.release(jobs[0])
+        self.assertEqual(pool.select(jobs[2:]), jobs[2:])
+        self.assertEqual((pool.used_cpus, pool.used_memory), (3, 3072))
+
+    def test_clamp(self):
+        """Requests bigger than the pool still run on their own.
+
+        """
+        pool = ResourcePool(cpus=2, memory='4G')
+        self.assertEqual(pool.request(Sort()), (1, 4096))
+
+    def test_reservation_blocks_long_backfill(self):
+        """Long small jobs may not delay a reserved big-memory job.
+
+        """
+        pool = ResourcePool(cpus=8, memory='10G')
+        running = make_job('running', cpus=1, memory='6G', runtime=60)
+        pool.select([running])
+        big = make_job('big', cpus=1, memory='8G', runtime=600)
+        long_small = make_job('long_small', cpus=1, memory='3G', runtime=3600)
+        picked = pool.select([big, long_small])
+        self.assertEqual(picked, [])
+        self.assertTrue(pool.reserved is big)
+
+    def test_backfill_short_jobs(self):
+        """Jobs finishing before the reservation starts are backfilled.
+
+        """
+        pool = ResourcePool(cpus=8, memory='10G')
+        running = make_job('running', cpus=1, memory='6G', runtime=600)
+        pool.select([running])
+        big = make_job('big', cpus=1, memory='8G', runtime=600)
+        short = make_job('short', cpus=1, memory='2G', runtime=10)
+        self.assertEqual(pool.select([big, short]), [short])
+
+    def test_backfill_spare_capacity(self):
+        """Jobs using capacity the reserved job does not need are backfilled.
+
+        """
+        pool = ResourcePool(cpus=8, memory='10G')
+        running = make_job('running', cpus=4, memory='6G', runtime=60)
+        pool.select([running])
+        big = make_job('big', cpus=2, memory='8G')
+        long_small = make_job('long_small', cpus=2, memory='1G', runtime=3600)
+        self.assertEqual(pool.select([big, long_small]), [long_small])
@@ -0,0 +1,135 @@
+"""Retry policy unittests.
+
+"""
+import os
+import unittest
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow, LocalExecutor, retry
+from tfpipe.pipeline.retry import slurm_limit, lsf_limit, local_limit, main
+from tfpipe.utils import python_module
+from tfpipe.test import TempDirTest
+
+
+class RetryTest(TempDirTest):
+    """A job killed on its first attempt.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.job = CLI(cmd="if [ -e flag ]; then echo ok > out.txt; "
+                       "else touch flag; kill -9 $$; fi", name='flaky')
+        self.job.memory_req_slurm = '1G'
+        self.child = CLI(cmd="cat out.txt > child.txt", name='child')
+        self.child.add_dependencies(done=[self.job])
+
+    def test_limits(self):
+        self.assertEqual(local_limit(-9), 'memory')
+        self.assertEqual(local_limit(1), None)
+        self.assertEqual(slurm_limit('OUT_OF_MEMORY', '0:125'), 'memory')
+        self.assertEqual(slurm_limit('TIMEOUT', '0:0'), 'time')
+        self.assertEqual(slurm_limit('FAILED', '1:0'), None)
+        self.assertEqual(lsf_limit('Exited with exit code 130. '
+                                   'TERM_RUNLIMIT: job killed'), 'time')
+
+    def test_local_retry(self):
+        self.job.add_retry(max_attempts=2, memory_factor=3)
+        wf = WorkFlow([self.job, self.child], local=True, name='wf.sh')
+        status = wf.run()
+        self.assertEqual(status[self.child], 'DONE')
+        self.assertEqual(open('child.txt').read(), "ok\n")
+        self.assertEqual(self.job.memory_req_slurm, '1G')
+
+    def test_local_time_limit(self):
+        """A job past its time limit is killed, and retried with more time.
+
+        """
+        job = CLI(cmd="if [ -e flag ]; then echo ok > out.txt; "
+                  "else touch flag; sleep 30; fi", name='slow')
+        job.time_str_slurm = '"00:00:01"'
+        executor = LocalExecutor([job])
+        self.assertEqual(executor.run()[job], 'EXIT')
+        os.remove('flag')
+        job.add_retry(max_attempts=2, time_factor=3)
+        executor = LocalExecutor([job])
+        self.assertEqual(executor.run()[job], 'DONE')
+        self.assertEqual(executor.limits[job][1], 3)
+        self.assertEqual(job.time_str_slurm, '"00:00:01"')
+
+    def test_local_without_policy(self):
+        wf = WorkFlow([self.job, self.child], local=True, name='wf.sh')
+        status = wf.run()
+        self.assertEqual(status[self.job], 'EXIT')
+        self.assertEqual(status[self.child], 'SKIPPED')
+
+    def test_tool_error_not_retried(self):
+        job = CLI(cmd="touch ran; exit 1", name='broken')
+        job.add_retry()
+        wf = WorkFlow([job], local=True, name='wf.sh')
+        self.assertEqual(wf.run()[job], 'EXIT')
+
+    def test_slurm_script(self):
+        self.job.add_retry()
+        wf = WorkFlow([self.job, self.child], slurm=True, lsf=False,
+                      name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('--mem=1G --requeue --wrap=' in script)
+        self.assertTrue(
+            'sbatch -J flaky_retry --dependency=afternotok:$%s '
+            '--kill-on-invalid-dep=yes -o flaky_retry.out --time 00:10:00 '
+            '--mem=256M --wrap="%s slurm $%s '
+            'flaky --attempt 1 --max-attempts 3 --memory-factor 2.0 '
+            '--time-factor 2.0 --memory 1024 --time 21600"\n' %
+            (self.job.jobid, python_module('tfpipe.pipeline.retry'),
+             self.job.jobid) in script)
+        self.assertTrue('-J child --dependency=afterok:$%s -o child.out '
+                        '--time "06:00:00" --kill-on-invalid-dep=no ' %
+                        self.job.jobid in script)
+
+    def test_lsf_script(self):
+        self.job.add_retry()
+        self.job.memory_req_lsf = '1'
+        script = WorkFlow([self.job], name='wf.sh')._build_shell_script_to_text()
+        self.assertTrue('bsub -J flaky_retry -w "exit(flaky)" -ti ' in script)
+        self.assertTrue('--memory 1024\n' in script)
+
+
+class WatcherTest(unittest.TestCase):
+    """The watcher requeues with escalated limits.
+
+    """
+    def setUp(self):
+        self.calls = []
+        self.check_output, self.call = retry.check_output, retry.call
+        retry.call = lambda command, shell=False: self.calls.append(command)
+
+    def tearDown(self):
+        retry.check_output, retry.call = self.check_output, self.call
+
+    def watch(self, state, attempt=1):
+        retry.check_output = lambda command: state
+        return main(['slurm', '1234', 'sort', '--attempt', str(attempt),
+                     '--memory', '4096', '--time', '3600'])
+
+    def test_out_of_memory(self):
+        self.assertEqual(self.watch("OUT_OF_MEMORY|0:125\n"), None)
+        self.assertEqual(self.calls[:3], [
+            ['scontrol', 'requeuehold', '1234'],
+            ['scontrol', 'update', 'JobId=1234', 'MinMemoryNode=8192M',
+             'TimeLimit=01:00:00'],
+            ['scontrol', 'release', '1234']])
+        self.assertTrue('slurm 1234 sort --attempt 2 --max-attempts 3 '
+                        in self.calls[3])
+        self.assertTrue('--memory 8192 --time 3600"' in self.calls[3])
+
+    def test_timeout(self):
+        self.watch("TIMEOUT|0:0\n")
+        self.assertEqual(self.calls[1][3:], ['MinMemoryNode=4096M',
+                                             'TimeLimit=02:00:00'])
+
+    def test_tool_error(self):
+        self.assertEqual(self.watch("FAILED|1:0\n"), 0)
+        self.assertEqual(self.calls, [])
+
+    def test_attempts_exhausted(self):
+        self.assertEqual(self.watch("OUT_OF_MEMORY|0:125\n", attempt=3), 1)
+        self.assertEqual(self.calls, [])
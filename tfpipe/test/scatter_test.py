@@ -0,0 +1,129 @@
+"""Scatter-gather alignment unittests.
+
+"""
+import gzip
+from subprocess import check_call
+from tfpipe.modules.cli import CLI
+from tfpipe.modules.picard import MergeSamFilesSLURM
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.scatter import ScatterGather, SplitFastq, chunk_path
+from tfpipe.pipeline.scatter import _retarget
+from tfpipe.utils import InvalidInput
+from tfpipe.test import TempDirTest
+
+
+def records(first, count):
+    """Return count FASTQ records, numbered from first.
+
+    """
+    return "".join("@r%d\nACGT\n+\nIIII\n" % i
+                   for i in range(first, first + count))
+
+
+class ScatterTest(TempDirTest):
+    """Aligning a read pair in chunks.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        with open('S1_R1.fq', 'w') as f:
+            f.write(records(0, 5))
+        with gzip.open('S1_R2.fq.gz', 'wb') as f:
+            f.write(records(100, 5))
+        self.index = CLI(cmd='touch index', name='index')
+        self.template = CLI(cmd='cat', name='align')
+        self.template.add_positional_argument('S1_R1.fq', 'input')
+        self.template.add_positional_argument('<(zcat S1_R2.fq.gz)')
+        self.template.redirect_output('S1.txt', 'output')
+        self.template.add_dependencies(done=[self.index])
+
+    def test_chunk_path(self):
+        self.assertEqual(chunk_path('/d/S1_R1.fastq.gz', 3),
+                         '/d/S1_R1.part003.fastq.gz')
+        self.assertEqual(chunk_path('S1.bam', 12, 'tmp'), 'tmp/S1.part012.bam')
+
+    def test_split(self):
+        split = SplitFastq('S1_R2.fq.gz', 3, 'split')
+        check_call(str(split), shell=True)
+        self.assertEqual(split.chunks[1], 'S1_R2.part001.fq.gz')
+        contents = [gzip.open(chunk).read() for chunk in split.chunks]
+        self.assertEqual(contents, [records(100, 1) + records(103, 1),
+                                    records(101, 1) + records(104, 1),
+                                    records(102, 1)])
+        split = SplitFastq('S1_R1.fq', 8, 'split')
+        check_call(str(split), shell=True)
+        self.assertEqual(open(split.chunks[7]).read(), '')
+
+    def test_wiring(self):
+        sg = ScatterGather(self.template, 2,
+                           fastqs=['S1_R1.fq', 'S1_R2.fq.gz'])
+        self.assertEqual([job.name for job in sg.jobs],
+                         ['align_split0', 'align_split1', 'align_part000',
+                          'align_part001', 'align_merge'])
+        part = sg.aligners[1]
+        self.assertEqual(str(part).split(), [
+            'cat', 'S1_R1.part001.fq', '<(zcat', 'S1_R2.part001.fq.gz)',
+            '>', 'S1.part001.txt'])
+        self.assertEqual(part.dep['done'], [self.index] + sg.split)
+        self.assertEqual(sg.split[0].dep['done'], [self.index])
+        self.assertEqual(sg.merge.dep['done'], sg.aligners)
+        self.assertEqual(str(sg.merge), "awk 'FNR == NR || !/^@/' "
+                         "S1.part000.txt S1.part001.txt > S1.txt")
+        # Twice the share of the template's six hours
+        sg = ScatterGather(self.template, 8)
+        self.assertEqual(sg.aligners[0].time_str_slurm, '"01:30:00"')
+        self.assertEqual(self.template.pos_args[0], 'S1_R1.fq')
+
+    def test_local_run(self):
+        sg = ScatterGather(self.template, 2,
+                           fastqs=['S1_R1.fq', 'S1_R2.fq.gz'])
+        wf = WorkFlow([self.index] + sg.split + sg.aligners, local=True,
+                      name='wf.sh')
+        wf.run()
+        self.assertEqual(open('S1.part001.txt').read(),
+                         records(1, 1) + records(3, 1) +
+                         records(101, 1) + records(103, 1))
+
+    def test_concat(self):
+        for i, read in enumerate(['r1', 'r0']):
+            with open('S1.part%03d.txt' % i, 'w') as f:
+                f.write('@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:100\n'
+                        '%s\t0\tchr1\t5\n' % read)
+        sg = ScatterGather(self.template, 2)
+        check_call(str(sg.merge), shell=True)
+        self.assertEqual(open('S1.txt').read(),
+                         '@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:100\n'
+                         'r1\t0\tchr1\t5\nr0\t0\tchr1\t5\n')
+        self.template.redirect_output('S1.bam', 'output')
+        sg = ScatterGather(self.template, 2)
+        self.assertEqual(str(sg.merge),
+                         'samtools cat -o S1.bam S1.part000.bam S1.part001.bam')
+
+    def test_picard_merge(self):
+        sg = ScatterGather(self.template, 2, merge=MergeSamFilesSLURM())
+        self.assertEqual(sg.merge.pos_args, ['O=S1.txt', 'I=S1.part000.txt',
+                                             'I=S1.part001.txt'])
+        self.assertEqual(len(sg.split), 1)
+
+    def test_retarget_whole_paths(self):
+        """Paths that start with the retargeted path are left alone.
+
+        """
+        job = CLI(cmd='tool', name='tool')
+        job.add_argument('--index', 'out.bam.bai')
+        job.add_argument('--tmp', '/x/out.bam.tmp/')
+        job.add_argument('--in', '<(zcat out.bam)')
+        job.add_positional_argument('O=out.bam')
+        job.add_positional_argument('"out.bam out.bam2"')
+        job.redirect_output('out.bam', 'output')
+        _retarget(job, 'out.bam', 'part.bam')
+        self.assertEqual(job.args, {'--index': 'out.bam.bai',
+                                    '--tmp': '/x/out.bam.tmp/',
+                                    '--in': '<(zcat part.bam)'})
+        self.assertEqual(job.pos_args, ['O=part.bam', '"part.bam out.bam2"'])
+        self.assertEqual((job.output_file, job.redirect_output_file),
+                         ('part.bam', 'part.bam'))
+
+    def test_invalid(self):
+        self.assertRaises(InvalidInput, ScatterGather, CLI(cmd='ls'), 2)
+        self.assertRaises(InvalidInput, ScatterGather, self.template, 0)
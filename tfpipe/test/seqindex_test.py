@@ -0,0 +1,164 @@
+"""Sequence record index unittests.
+
+"""
+import os
+import sys
+import zlib
+import gzip
+import json
+import struct
+import tfpipe
+from StringIO import StringIO
+from subprocess import check_output
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.scatter import ScatterGather
+from tfpipe.utils import InvalidInput, seqindex
+from tfpipe.utils.seqindex import SeqIndex
+from tfpipe.test import TempDirTest
+
+
+def fastq(first, count):
+    """Return count FASTQ records of varying length, numbered from first.
+
+    """
+    return "".join("@r%d\n%s\n+\n%s\n" % (i, 'ACGT' * (i % 7 + 1),
+                                          'I' * (4 * (i % 7 + 1)))
+                   for i in range(first, first + count))
+
+
+def bgzf(data, size):
+    """Compress data into BGZF blocks of size uncompressed bytes.
+
+    """
+    blocks = []
+    for start in range(0, len(data), size) + [len(data)]:
+        chunk = data[start:start + size]
+        compress = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = compress.compress(chunk) + compress.flush()
+        blocks.append('\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0' +
+                      struct.pack('<H', len(body) + 25) + body +
+                      struct.pack('<II', zlib.crc32(chunk) & 0xffffffff,
+                                  len(chunk)))
+    return "".join(blocks)
+
+
+def read_all(index, chunks):
+    """Return the records of each of chunks ranges of index.
+
+    """
+    parts = []
+    for offset, length in index.ranges(chunks):
+        out = StringIO()
+        index.read(offset, length, out)
+        parts.append(out.getvalue())
+    return parts
+
+
+class SeqIndexTest(TempDirTest):
+    """Indexing and reading plain and BGZF files.
+
+    """
+    def setUp(self):
+        # Aligners read their ranges with tfpipe.utils.seqindex
+        self.pythonpath = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(os.path.abspath(tfpipe.__file__)))
+        TempDirTest.setUp(self)
+        self.records = fastq(0, 200)
+        with open('S1.fq', 'w') as f:
+            f.write(self.records)
+        self.block = seqindex.SCAN_BLOCK
+        # Small blocks put record boundaries on block boundaries
+        seqindex.SCAN_BLOCK = 61
+
+    def tearDown(self):
+        if self.pythonpath is None:
+            del os.environ['PYTHONPATH']
+        else:
+            os.environ['PYTHONPATH'] = self.pythonpath
+        seqindex.SCAN_BLOCK = self.block
+        TempDirTest.tearDown(self)
+
+    def test_fastq(self):
+        index = SeqIndex.build('S1.fq', step=3)
+        self.assertEqual(index.records, 200)
+        self.assertEqual(len(index.entries), 67)
+        self.assertEqual(index.entries[1][0], len(fastq(0, 3)))
+        parts = read_all(index, 7)
+        self.assertEqual("".join(parts), self.records)
+        self.assertEqual([part.count('\n@') + 1 for part in parts],
+                         [30, 27, 30, 27, 30, 27, 29])
+        self.assertTrue(parts[1].startswith('@r30\n'))
+
+    def test_fasta(self):
+        records = "".join(">s%d x\n%s\n%s\n" % (i, 'A' * i, 'C' * 60)
+                          for i in range(50))
+        with open('ref.fa', 'w') as f:
+            f.write(records)
+        index = SeqIndex.build('ref.fa', step=2)
+        self.assertEqual((index.format, index.records), ('fasta', 50))
+        self.assertEqual("".join(read_all(index, 4)), records)
+
+    def test_bgzf(self):
+        with open('S1.fq.gz', 'wb') as f:
+            f.write(bgzf(self.records, 100))
+        self.assertEqual(gzip.open('S1.fq.gz').read(), self.records)
+        index = SeqIndex.build('S1.fq.gz', step=5)
+        self.assertTrue(index.bgzf)
+        self.assertEqual((index.records, index.length),
+                         (200, len(self.records)))
+        self.assertTrue(index.entries[3][0] >> 16 > 0)
+        parts = read_all(index, 3)
+        self.assertEqual("".join(parts), self.records)
+        self.assertEqual(parts, read_all(SeqIndex.build('S1.fq', step=5), 3))
+
+    def test_gzip(self):
+        with gzip.open('S1.fq.gz', 'wb') as f:
+            f.write(self.records)
+        self.assertRaises(InvalidInput, SeqIndex.build, 'S1.fq.gz')
+        with open('bad.fq', 'w') as f:
+            f.write('@r0\nA\n+\nI\n\n@r1\nA\n+\nI\n')
+        self.assertRaises(InvalidInput, SeqIndex.build, 'bad.fq', 1)
+
+    def test_cache(self):
+        index = SeqIndex.load('S1.fq', step=10)
+        self.assertTrue(os.path.exists('S1.fq.tfidx'))
+        with open('S1.fq.tfidx') as f:
+            self.assertEqual(json.load(f)['records'], 200)
+        self.assertEqual(SeqIndex.load('S1.fq').step, 10)
+        with open('S1.fq', 'a') as f:
+            f.write(fastq(200, 1))
+        os.utime('S1.fq', (0, 0))
+        self.assertEqual(SeqIndex.load('S1.fq').records, 201)
+        self.assertEqual(index.ranges(300)[-1], (0, 0))
+
+    def test_scatter_ranges(self):
+        with open('S1_R2.fq', 'w') as f:
+            f.write(fastq(1000, 200))
+        template = CLI(cmd='cat', name='align')
+        template.add_positional_argument('S1.fq', 'input')
+        template.add_positional_argument('S1_R2.fq')
+        template.redirect_output('S1.txt', 'output')
+        # The index jobs keep fresh indexes
+        SeqIndex.load('S1.fq', step=10)
+        SeqIndex.load('S1_R2.fq', step=10)
+        sg = ScatterGather(template, 4, fastqs=['S1.fq', 'S1_R2.fq'],
+                           ranges=True)
+        self.assertEqual([job.name for job in sg.split],
+                         ['align_index0', 'align_index1'])
+        self.assertEqual(sg.split[0].output_file, 'S1.fq.tfidx')
+        self.assertEqual(sg.aligners[2].input_file, 'S1.fq')
+        self.assertTrue('seqindex read S1_R2.fq 2 4)' in str(sg.aligners[2]))
+        script = WorkFlow(sg.jobs, slurm=True, lsf=False,
+                          name='wf.sh')._build_shell_script_to_text()
+        self.assertTrue('--wrap="bash -c \'cat ' in script)
+        wf = WorkFlow(sg.split + sg.aligners, local=True, name='wf.sh')
+        wf.run()
+        output = open('S1.part002.txt').read()
+        self.assertTrue(output.startswith('@r100\n'))
+        self.assertTrue('@r1100\n' in output and '@r1149\n' in output)
+        self.assertEqual(check_output(
+            [sys.executable, '-m', 'tfpipe.utils.seqindex', 'read', 'S1.fq',
+             '--range', '0', str(len(fastq(0, 2)))]),
+            fastq(0, 2))
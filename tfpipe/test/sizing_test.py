@@ -0,0 +1,75 @@
+"""Sizer unittests.
+
+"""
+from tfpipe.modules.gmap import Gsnap
+from tfpipe.modules.samtools import Sort
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.metrics import MetricsStore, job_class
+from tfpipe.pipeline.sizing import Sizer, format_walltime
+from tfpipe.test import TempDirTest
+
+MB = 1024 * 1024
+
+
+class SizerTest(TempDirTest):
+    """Sort jobs sized from three past runs.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.store = MetricsStore('wf.metrics.jsonl')
+        self.job = self.sort('big.bam', 300 * MB)
+        cls = job_class(self.job)
+        # peak memory 500M + 1M per input megabyte, wall 10s per megabyte
+        for size in (100, 200, 400):
+            self.store.append({'class': cls, 'returncode': 0,
+                               'input_bytes': size * MB,
+                               'max_rss_mb': 500 + size, 'wall': 10 * size})
+        self.store.append({'class': cls, 'returncode': 137,
+                           'input_bytes': 300 * MB, 'max_rss_mb': 90000,
+                           'wall': 1})
+
+    def sort(self, path, size):
+        with open(path, 'w') as f:
+            f.truncate(size)
+        job = Sort(name=path.split('.')[0])
+        job.add_positional_argument(path, 'input')
+        return job
+
+    def test_format_walltime(self):
+        self.assertEqual(format_walltime(3601), '"01:01:00"')
+        self.assertEqual(format_walltime(3601, lsf=True), '1:01')
+
+    def test_predict_scales_with_input(self):
+        sizer = Sizer(self.store, margin=1.0, memory_step=1)
+        self.assertEqual(sizer.predict(self.job), (800, 3000))
+        sizer.margin = 1.5
+        self.assertEqual(sizer.predict(self.job), (1200, 4500))
+
+    def test_unknown_input_uses_largest_run(self):
+        job = Sort(name='later')
+        job.add_positional_argument('not_there_yet.bam', 'input')
+        sizer = Sizer(self.store, margin=1.0, memory_step=1)
+        self.assertEqual(sizer.predict(job), (900, 4020))
+
+    def test_too_little_history(self):
+        self.assertEqual(Sizer(self.store, min_runs=4).predict(self.job), None)
+        self.assertEqual(Sizer(self.store).predict(Gsnap()), None)
+
+    def test_workflow(self):
+        kept = self.sort('kept.bam', MB)
+        kept.autosize = False
+        wf = WorkFlow([self.job, kept], slurm=True, lsf=False, autosize=True,
+                      name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('-J big  -o big.out --time "01:03:00" --mem=1024M '
+                        in script)
+        self.assertTrue('-J kept  -o kept.out --time "06:00:00" --mem=100G '
+                        in script)
+        wf = WorkFlow([self.job], autosize=True, name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('-M 1 -W 1:03 ' in script)
+
+    def test_class_time_limit(self):
+        self.assertEqual(Gsnap().time_str_slurm, '"05:00:00"')
+        self.assertEqual(Sort().time_str_slurm, '"06:00:00"')
@@ -0,0 +1,83 @@
+"""Scratch staging unittests.
+
+"""
+import os
+import gzip
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow
+from tfpipe.pipeline.staging import StagedJob, stage
+from tfpipe.test import TempDirTest
+
+
+class StagingTest(TempDirTest):
+    """A sort job run on a local scratch directory.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        os.mkdir('scratch')
+        f = gzip.open('in.txt.gz', 'wb')
+        f.write("b\na\n")
+        f.close()
+        self.job = CLI(cmd='sort', name='sort')
+        self.job.add_argument('-o', 'out.txt', 'output')
+        self.job.add_positional_argument('in.txt.gz', 'input')
+        self.child = CLI(cmd='cat out.txt', name='child')
+        self.child.add_dependencies(done=[self.job])
+
+    def test_unmarked_jobs_untouched(self):
+        jobs = [self.job, self.child]
+        self.assertTrue(stage(jobs) is jobs)
+
+    def test_command(self):
+        self.job.use_scratch(directory='scratch', decompress=True)
+        staged, child = stage([self.job, self.child])
+        self.assertTrue(isinstance(staged, StagedJob))
+        self.assertEqual(staged.jobid, self.job.jobid)
+        self.assertEqual(child.dep['done'], [staged])
+        self.assertEqual(self.child.dep['done'], [self.job])
+        command = str(staged)
+        self.assertTrue('gzip -dc in.txt.gz > "$S/0/in.txt" & P0=$!'
+                        in command)
+        self.assertTrue('sort -o "$S/1/out.txt" "$S/0/in.txt" || exit $?'
+                        in command)
+        self.assertTrue('{ cp "$S/1/out.txt" out.txt.partial && '
+                        'mv out.txt.partial out.txt; } & P1=$!' in command)
+
+    def test_assigned_and_quoted_arguments(self):
+        job = CLI(cmd='tool', name='tool')
+        job.add_positional_argument('INPUT=in.txt.gz')
+        job.add_argument('--out=out.txt', '')
+        job.add_argument('--label', '"a  b"')
+        job.add_argument('--pair', 'in.txt.gz  other.txt')
+        job.input_file, job.output_file = 'in.txt.gz', 'out.txt'
+        job.use_scratch(directory='scratch')
+        command = str(StagedJob(job))
+        self.assertTrue('INPUT="$S/0/in.txt.gz"' in command)
+        self.assertTrue('--out="$S/1/out.txt"' in command)
+        self.assertTrue('"a  b"' in command)
+        self.assertTrue('--pair "$S/0/in.txt.gz"  other.txt' in command)
+        self.assertEqual(job.pos_args, ['INPUT=in.txt.gz'])
+
+    def test_workflow_local(self):
+        self.job.use_scratch(directory='scratch', decompress=True)
+        wf = WorkFlow([self.job, self.child], local=True, name='wf.sh')
+        status = wf.run()
+        self.assertEqual(sorted(status.values()), ['DONE', 'DONE'])
+        self.assertEqual(open('out.txt').read(), "a\nb\n")
+        self.assertEqual(os.listdir('scratch'), [])
+
+    def test_failed_job_leaves_no_output(self):
+        self.job.use_scratch(directory='scratch')
+        self.job.add_argument('--bogus-option', '')
+        wf = WorkFlow([self.job], local=True, name='wf.sh')
+        self.assertEqual(wf.run().values(), ['EXIT'])
+        self.assertFalse(os.path.exists('out.txt'))
+        self.assertEqual(os.listdir('scratch'), [])
+
+    def test_workflow_slurm_escapes(self):
+        self.job.use_scratch()
+        wf = WorkFlow([self.job], slurm=True, lsf=False, name='wf.sh')
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('--wrap="( S=\\$(mktemp -d \\"\\${TMPDIR:-/tmp}'
+                        '/tfpipe.XXXXXX\\") || exit 1; ' in script)
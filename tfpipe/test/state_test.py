@@ -0,0 +1,183 @@
+"""State database unittests.
+
+"""
+import os
+from tfpipe.modules.cli import CLI
+from tfpipe.pipeline import WorkFlow, engine, state
+from tfpipe.pipeline.state import StateStore, lsf_states
+from tfpipe.test import TempDirTest, copy_job
+
+
+class StateTest(TempDirTest):
+    """A three job workflow submitted to a fake scheduler.
+
+    """
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.first = CLI(cmd='true', name='first')
+        self.second = CLI(cmd='true', name='second')
+        self.second.add_dependencies(done=[self.first])
+        self.third = CLI(cmd='true', name='third')
+        self.third.add_dependencies(done=[self.second])
+        self.jobs = [self.first, self.second, self.third]
+        self.queries = []
+        self.saved = engine.system, state.check_output, state.sleep
+        state.sleep = lambda seconds: self.queries.append(('sleep', seconds))
+
+    def tearDown(self):
+        engine.system, state.check_output, state.sleep = self.saved
+        TempDirTest.tearDown(self)
+
+    def submit(self, **options):
+        """Run a workflow whose script writes fake scheduler IDs.
+
+        """
+        wf = WorkFlow(self.jobs, name='wf.sh', state=True, **options)
+
+        def system(command):
+            with open(wf._ids_path(), 'a') as f:
+                for i, job in enumerate(self.jobs):
+                    f.write("%s %d\n" % (job.jobid, 100 + i))
+        engine.system = system
+        wf.run()
+        return wf
+
+    def scheduler(self, *outputs):
+        """Answer successive scheduler queries with outputs.
+
+        """
+        outputs = list(outputs)
+
+        def check_output(command):
+            self.queries.append(command)
+            return outputs.pop(0)
+        state.check_output = check_output
+
+    def test_script_records_ids(self):
+        wf = WorkFlow(self.jobs, slurm=True, lsf=False, name='wf.sh',
+                      state=True)
+        script = wf._build_shell_script_to_text()
+        self.assertTrue('\necho "%s $%s" >> %s\n' % (
+            self.first.jobid, self.first.jobid, wf._ids_path()) in script)
+
+    def test_wait_polls_in_batches(self):
+        wf = self.submit(slurm=True, lsf=False)
+        self.scheduler("100|RUNNING|0:0\n101|PENDING|0:0\n102|PENDING|0:0\n",
+                       "100|RUNNING|0:0\n101|PENDING|0:0\n102|PENDING|0:0\n",
+                       "100|COMPLETED|0:0\n101|RUNNING|0:0\n",
+                       "101|COMPLETED|0:0\n102|COMPLETED|0:0\n")
+        status = wf.wait(interval=10, max_interval=15)
+        self.assertEqual(status, {'first': 'DONE', 'second': 'DONE',
+                                  'third': 'DONE'})
+        sacct = [q for q in self.queries if q[0] == 'sacct']
+        self.assertEqual(len(sacct), 4)
+        self.assertEqual(sacct[0][-1], '100,101,102')
+        self.assertEqual(sacct[-1][-1], '101,102')
+        self.assertEqual([q[1] for q in self.queries if q[0] == 'sleep'],
+                         [10, 15, 10])
+
+    def test_orphans(self):
+        wf = self.submit(slurm=True, lsf=False)
+        self.scheduler("100|FAILED|1:0\n101|PENDING|0:0\n102|PENDING|0:0\n",
+                       "")
+        calls = []
+        saved = state.call
+        state.call = calls.append
+        try:
+            status = wf.wait(cancel_orphans=True)
+        finally:
+            state.call = saved
+        self.assertEqual(status, {'first': 'EXIT', 'second': 'ORPHANED',
+                                  'third': 'ORPHANED'})
+        self.assertEqual(calls, [['scancel', '101', '102']])
+
+    def test_array_elements(self):
+        store = StateStore(':memory:')
+        store.add([('a', 'JOB1', 1, 'arr[1]'), ('b', 'JOB1', 2, 'arr[2]'),
+                   ('c', 'JOB1', 3, 'arr[3]')], [])
+        with open('ids', 'w') as f:
+            f.write("JOB1 55\n")
+        store.load_ids('ids')
+        self.scheduler("55_1|COMPLETED|0:0\n55_[2-3%1]|PENDING|0:0\n",
+                       "55_[2-3%1]|PENDING|0:0\n")
+        self.assertEqual(store.poll(), 3)
+        self.assertEqual(store.poll(), 0)
+        self.assertEqual(self.queries[-1][-1], '55')
+        self.assertEqual(store.states(), {'a': 'DONE', 'b': 'PENDING',
+                                          'c': 'PENDING'})
+
+    def test_lsf(self):
+        self.scheduler("7|first|DONE|-\n9|first|EXIT|2\n8|other|RUN|-\n"
+                       "12|arr[2]|PEND|-\n")
+        self.assertEqual(lsf_states(['first', 'arr[2]']),
+                         {'first': ('EXIT', '2', '9'),
+                          'arr[2]': ('PEND', '', '12[2]')})
+
+    def test_lsf_missing(self):
+        """Jobs bjobs no longer lists are EXIT after the grace period.
+
+        """
+        store = StateStore(':memory:')
+        store.add([('a', 'JOBa', None, 'a'), ('b', 'JOBb', None, 'b')], [])
+        self.scheduler("1|a|RUN|-\n", "1|a|RUN|-\n", "1|a|DONE|-\n")
+        self.assertEqual(store.poll(slurm=False), 1)
+        self.assertEqual(store.states(), {'a': 'RUNNING', 'b': 'PENDING'})
+        store.missing_grace = 0
+        self.assertEqual(store.poll(slurm=False), 1)
+        self.assertEqual(store.states(), {'a': 'RUNNING', 'b': 'EXIT'})
+        self.assertEqual(store.db.execute(
+            "SELECT scheduler_state FROM jobs WHERE name = 'b'").fetchone(),
+            ('MISSING',))
+        self.assertEqual(store.wait(slurm=False), {'a': 'DONE', 'b': 'EXIT'})
+
+    def test_local(self):
+        with open('a.txt', 'w') as f:
+            f.write('a')
+        self.jobs = [copy_job('copy', 'a.txt', 'b.txt'),
+                     CLI(cmd='exit 1', name='bad')]
+        wf = WorkFlow(self.jobs, local=True, name='wf.sh', state='wf.db')
+        wf.run()
+        self.assertEqual(StateStore('wf.db').states(),
+                         {'copy': 'DONE', 'bad': 'EXIT'})
+
+    def test_rescue(self):
+        side = CLI(cmd='true', name='side')
+        side.add_dependencies(done=[self.first])
+        join = CLI(cmd='true', name='join')
+        join.add_dependencies(done=[self.second, side])
+        self.jobs.extend([side, join])
+        wf = self.submit(slurm=True, lsf=False)
+        self.scheduler("100|COMPLETED|0:0\n101|NODE_FAIL|1:0\n"
+                       "102|PENDING|0:0\n103|RUNNING|0:0\n104|PENDING|0:0\n")
+        calls = []
+        saved = state.call
+        state.call = calls.append
+        try:
+            wf.rescue()
+        finally:
+            state.call = saved
+        self.assertEqual(calls, [['scancel', '102', '104']])
+        script = open('wf.sh').read()
+        self.assertFalse('-J first ' in script or '-J side ' in script)
+        self.assertTrue('\n%s=103\n' % side.jobid in script)
+        self.assertTrue('-J second  -o ' in script)
+        self.assertTrue('-J join --dependency=afterok:$%s:$%s ' %
+                        (self.second.jobid, side.jobid) in script)
+        self.assertEqual(StateStore('wf.state.db').states()['second'],
+                         'PENDING')
+
+    def test_rescue_local(self):
+        flag = CLI(cmd='test -e flag', name='flag')
+        after = CLI(cmd='touch after', name='after')
+        after.add_dependencies(done=[flag])
+        self.jobs = [CLI(cmd='touch before', name='before'), flag, after]
+        flag.add_dependencies(done=[self.jobs[0]])
+        wf = WorkFlow(self.jobs, local=True, name='wf.sh', state=True)
+        wf.run()
+        os.remove('before')
+        open('flag', 'w').close()
+        status = wf.rescue()
+        self.assertEqual(sorted(job.name for job in status), ['after', 'flag'])
+        self.assertTrue(os.path.exists('after'))
+        self.assertFalse(os.path.exists('before'))
+        self.assertEqual(set(wf.state.states().values()), set(['DONE']))
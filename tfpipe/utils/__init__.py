@@ -1,7 +1,9 @@
 """
 
 """
-from logger import logger
+from logger import logger, configure_logging, stop_logging
 from exceptions import InvalidInput, InvalidObjectCall, DuplicateJobNames
-from exceptions import InvalidType
-from helper import build_output, get_file_location_info
+from exceptions import InvalidType, CyclicDependency
+from helper import build_output, get_file_location_info, memory_to_mb
+from helper import python_module, set_interpreter
+from lazy import LazyPackage
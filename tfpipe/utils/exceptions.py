@@ -63,3 +63,16 @@ class DuplicateJobNames(Exception):
         return repr(self.message)
 
 
+class CyclicDependency(Exception):
+    """Raise exception when job dependencies form a cycle.
+
+    """
+    def __init__(self, message):
+        """Log message.
+
+        """
+        self.message = message
+        logger.warn(message)
+
+    def __str__(self):
+        return repr(self.message)
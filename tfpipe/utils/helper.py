@@ -1,7 +1,8 @@
 """Simple, but common functions typically used in pipelines.                   
 
 """
-from mimetypes import guess_type
+import os
+import sys
 from os.path import dirname
 from os.path import basename as bname
 from os.path import join as path_join
@@ -16,6 +17,8 @@ def get_file_location_info(some_file):
     except ValueError:
         path, filename = ('.', some_file)
     basename = '.'.join(filename.split('.')[:-1])
+    # mimetypes imports urllib and ssl, so only when needed
+    from mimetypes import guess_type
     if guess_type(some_file)[1] is 'gzip':
         basename = '.'.join(basename.split('.')[:-1])
     return (path, filename, basename)
@@ -27,7 +30,44 @@ def build_output(out_dir, prepend, basename, ext):
     return path_join(out_dir, ''.join([prepend, basename, ext]))
 
 
+def memory_to_mb(value, default_unit='M'):
+    """Return a scheduler memory request in megabytes.
 
+    Accepts the forms used in job memory requirements, e.g. '100G', '4g',
+    '"48"' or 512.  Values without a unit are read in default_unit.
 
+    """
+    if value is None or value == '':
+        return None
+    text = str(value).strip().strip('"\'').upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    unit = default_unit.upper()
+    if text and text[-1] in 'KMGT':
+        unit, text = text[-1], text[:-1]
+    scale = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}[unit]
+    return int(float(text) * scale)
+
+
+_interpreter = None
+
+
+def set_interpreter(path=None):
+    """Run tfpipe's own commands in jobs with the python at path.
 
+    Without a path they run with $TFPIPE_PYTHON if set, or else with the
+    interpreter running this process, which then has to exist at the same
+    path on the cluster nodes.
 
+    """
+    global _interpreter
+    _interpreter = path
+
+
+def python_module(module):
+    """Return the command line running a tfpipe module as a script.
+
+    """
+    from pipes import quote
+    python = _interpreter or os.environ.get('TFPIPE_PYTHON') or sys.executable
+    return "%s -m %s" % (quote(python), module)
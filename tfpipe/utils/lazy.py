@@ -0,0 +1,39 @@
+"""Packages that import their contents on first use.
+
+"""
+from types import ModuleType
+from importlib import import_module
+
+
+class LazyPackage(ModuleType):
+    """LazyPackage replaces a package in sys.modules and imports the
+    attributes it is given as they are first accessed.
+
+    attributes maps a name to a module, or to a (module, attribute) pair.
+
+    """
+    def __init__(self, package, attributes):
+        """Initialize LazyPackage from the package being imported.
+
+        """
+        ModuleType.__init__(self, package.__name__, package.__doc__)
+        self.__dict__.update(package.__dict__)
+        # The package's functions still use its globals, so keep it alive
+        self.__dict__['_package'] = package
+        self.__dict__['_lazy'] = attributes
+
+    def __getattr__(self, name):
+        try:
+            target = self._lazy[name]
+        except KeyError:
+            raise AttributeError("'module' object has no attribute '%s'" %
+                                 name)
+        if isinstance(target, tuple):
+            value = getattr(import_module(target[0]), target[1])
+        else:
+            value = import_module(target)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self._lazy))
@@ -1,11 +1,267 @@
-"""
+"""tfpipe logging.
+
+Log records are put on a queue by the calling thread and formatted and
+written by a listener thread, so building a workflow does not wait on the
+log file.  Messages are only formatted when written: pass their arguments
+separately, logger.info("%s: added", name), to defer the formatting too.
+Messages about each job are logged at DEBUG, so the default INFO level logs
+what happens to a workflow as a whole.
+
+Logging is configured from the environment when first imported:
+
+    TFPIPE_LOG_LEVEL    level name or number (default INFO)
+    TFPIPE_LOG_FILE     log file (default tfpipe.log); '-' for stderr
+    TFPIPE_LOG_FORMAT   'text' (default) or 'jsonl', one JSON object a line
+    TFPIPE_LOG_CONFIG   a logging.config file, such as logconf.py, used
+                        instead of the settings above
+
+configure_logging changes the settings at run time.  Processes forked
+after logging is configured, such as multiprocessing workers, have no
+listener thread and write their records to the log themselves.
 
 """
-from os import path
+import os
+import sys
+import json
+import atexit
 import logging
-import logging.config
+import threading
+from Queue import Queue, Empty
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+logger = logging.getLogger('tfpipe')
+_listener = None
+# Log files inherited by forked processes, see QueueListener._after_fork
+_inherited = []
+
+
+class QueueHandler(logging.Handler):
+    """QueueHandler puts log records on a queue for a QueueListener.
+
+    Records are queued unformatted.  Exception tracebacks are rendered here,
+    as only the thread that caught the exception can.  In a process forked
+    from the listener's, records go straight to the listener's handlers.
+
+    """
+    def __init__(self, queue, listener=None):
+        """Initialize QueueHandler.
+
+        """
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.listener = listener
+
+    def createLock(self):
+        # The queue has its own lock, and a handler lock held by another
+        # thread at a fork would never be released in the child
+        self.lock = None
+
+    def emit(self, record):
+        try:
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+                record.exc_info = None
+            if self.listener and self.listener.pid != os.getpid():
+                self.listener.write(record)
+            else:
+                self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """QueueListener writes queued records to handlers in its own thread.
+
+    The thread is not copied into forked processes, which call write
+    instead.
+
+    """
+    _stop = object()
+
+    def __init__(self, queue, *handlers):
+        """Initialize QueueListener.
+
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.pid = None
+        self._thread = None
+        self._writer_pid = None
+
+    def start(self):
+        """Start the listener thread.
+
+        """
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='tfpipe-log')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _monitor(self):
+        """Hand records to the handlers until stopped.
+
+        Handlers are flushed once the queue is drained rather than after
+        every record.
+
+        """
+        while True:
+            record = self.queue.get()
+            while record is not self._stop:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                try:
+                    record = self.queue.get_nowait()
+                except Empty:
+                    break
+            for handler in self.handlers:
+                handler.flush()
+            if record is self._stop:
+                break
+
+    def _after_fork(self):
+        """Take over the handlers in a forked process.
+
+        Their locks may have been held by the listener thread at the fork,
+        and the buffers of inherited log files hold records of the parent,
+        so locks are renewed and files reopened.  Inherited files are kept
+        open so their buffers are not written twice.
+
+        """
+        if self._writer_pid == os.getpid():
+            return
+        for handler in self.handlers:
+            handler.createLock()
+            if isinstance(handler, logging.FileHandler) and handler.stream:
+                _inherited.append(handler.stream)
+                handler.stream = None
+        self._writer_pid = os.getpid()
+
+    def write(self, record):
+        """Write a record of a forked process to the handlers.
+
+        """
+        self._after_fork()
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+            handler.flush()
+
+    def stop(self):
+        """Write the remaining records and stop the thread.
+
+        """
+        if self.pid != os.getpid():
+            self._after_fork()
+        elif self._thread:
+            self.queue.put(self._stop)
+            self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+
+class BatchFileHandler(logging.FileHandler):
+    """BatchFileHandler writes records without flushing each one.
+
+    The QueueListener flushes it after each batch.
+
+    """
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            message = self.format(record)
+            if isinstance(message, unicode):
+                message = message.encode('utf-8')
+            self.stream.write(message + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """JSONFormatter formats a record as one compact JSON object.
+
+    """
+    def format(self, record):
+        entry = {'time': round(record.created, 3),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, sort_keys=True, separators=(',', ':'))
+
+
+def _level(level):
+    """Return a level given by name or number as a number.
+
+    """
+    if isinstance(level, basestring) and not level.isdigit():
+        return getattr(logging, level.upper())
+    return int(level)
+
+
+def stop_logging():
+    """Write queued records and close the log handlers.
+
+    """
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def configure_logging(level=None, path=None, fmt=None, queued=True):
+    """Configure tfpipe logging.
+
+    Arguments left as None are read from the environment.  When queued is
+    False records are written by the logging thread itself.
+
+    """
+    global _listener
+    stop_logging()
+    config = os.environ.get('TFPIPE_LOG_CONFIG')
+    if config and level is path is fmt is None:
+        # logging.config imports socket and ssl, so only when needed
+        from logging.config import fileConfig
+        fileConfig(config, disable_existing_loggers=False)
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+        return
+    if level is None:
+        level = os.environ.get('TFPIPE_LOG_LEVEL', 'INFO')
+    if path is None:
+        path = os.environ.get('TFPIPE_LOG_FILE', 'tfpipe.log')
+    if fmt is None:
+        fmt = os.environ.get('TFPIPE_LOG_FORMAT', 'text')
+    if path == '-':
+        handler = logging.StreamHandler(sys.stderr)
+    elif queued:
+        # The file is only created once something is logged
+        handler = BatchFileHandler(path, delay=True)
+    else:
+        handler = logging.FileHandler(path, delay=True)
+    if fmt == 'jsonl':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logger.setLevel(_level(level))
+    logger.propagate = False
+    if queued:
+        queue = Queue()
+        _listener = QueueListener(queue, handler)
+        _listener.start()
+        logger.addHandler(QueueHandler(queue, _listener))
+    else:
+        logger.addHandler(handler)
 
-conffile = path.join(path.dirname(path.abspath(__file__)), 'logconf.py')
-logging.config.fileConfig(conffile)
-logger = logging
 
+configure_logging()
+atexit.register(stop_logging)
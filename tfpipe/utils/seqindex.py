@@ -0,0 +1,383 @@
+"""Sparse record index of FASTQ and FASTA files.
+
+A SeqIndex records the byte offset of every step-th record of a file, found
+in one sequential scan of the memory mapped file.  The step starts at 1 and
+doubles whenever the index outgrows MAX_ENTRIES, so small files are indexed
+record by record and large ones stay small.  Chunks of records can
+then be read straight from the original file instead of being copied into
+chunk files first:
+
+    python -m tfpipe.utils.seqindex build FILE [--step N]
+    python -m tfpipe.utils.seqindex read FILE CHUNK CHUNKS
+    python -m tfpipe.utils.seqindex read FILE --range OFFSET LENGTH
+
+read writes records to standard output, uncompressed.  The index is cached
+next to the file as FILE.tfidx, and build and read only rebuild it when the
+file changes.
+
+BGZF files (bgzip, as used by htslib) are indexed through their blocks.
+Their offsets are virtual offsets, the compressed offset of a block shifted
+left by 16 bits plus the offset into the uncompressed block, and range
+lengths count uncompressed bytes.  Plain gzip files cannot be read from an
+offset and raise InvalidInput.
+
+"""
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+from tfpipe.utils import logger
+from tfpipe.utils.exceptions import InvalidInput
+
+INDEX_SUFFIX = '.tfidx'
+INDEX_VERSION = 1
+# Records between index entries, at first
+DEFAULT_STEP = 1
+MAX_ENTRIES = 1 << 12
+# Bytes of a plain file counted at a time
+SCAN_BLOCK = 1 << 16
+COPY_BLOCK = 1 << 20
+
+_BGZF_MAGIC = '\x1f\x8b\x08\x04'
+
+
+def index_path(path):
+    """Return the path the index of path is cached at.
+
+    """
+    return path + INDEX_SUFFIX
+
+
+def sequence_format(path):
+    """Return 'fastq' or 'fasta' from a file name, ignoring compression.
+
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith(('.fa', '.fasta', '.fna', '.fas')):
+        return 'fasta'
+    return 'fastq'
+
+
+def _bgzf_blocks(data):
+    """Yield (compressed offset, uncompressed data) of each BGZF block.
+
+    """
+    offset, size = 0, len(data)
+    while offset < size:
+        if data[offset:offset + 4] != _BGZF_MAGIC:
+            raise InvalidInput("Not a BGZF block at byte %d" % offset)
+        xlen = struct.unpack('<H', data[offset + 10:offset + 12])[0]
+        extra, block_size = offset + 12, None
+        while extra < offset + 12 + xlen:
+            tag, length = data[extra:extra + 2], struct.unpack(
+                '<H', data[extra + 2:extra + 4])[0]
+            if tag == 'BC':
+                block_size = struct.unpack(
+                    '<H', data[extra + 4:extra + 6])[0] + 1
+            extra += 4 + length
+        if block_size is None:
+            raise InvalidInput("BGZF block without size at byte %d" % offset)
+        body = data[offset + 12 + xlen:offset + block_size - 8]
+        yield offset, zlib.decompress(body, -15)
+        offset += block_size
+
+
+def is_bgzf(path):
+    """True if path is BGZF compressed.
+
+    """
+    with open(path, 'rb') as f:
+        header = f.read(16)
+    return header[:4] == _BGZF_MAGIC and header[12:14] == 'BC'
+
+
+def _is_gzip(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == '\x1f\x8b'
+
+
+class SeqIndex(object):
+    """SeqIndex holds the offsets of every step-th record of a file.
+
+    entries[i] is the (offset, uncompressed offset) of record i * step.
+
+    """
+    def __init__(self, path, fmt, step, bgzf, records, length, entries,
+                 size=None, mtime=None):
+        """Initialize SeqIndex.
+
+        """
+        self.path = path
+        self.format = fmt
+        self.step = step
+        self.bgzf = bgzf
+        self.records = records
+        self.length = length
+        self.entries = entries
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def build(cls, path, step=DEFAULT_STEP, fmt=None,
+              max_entries=MAX_ENTRIES):
+        """Index path in one sequential scan.
+
+        """
+        fmt = fmt or sequence_format(path)
+        bgzf = is_bgzf(path)
+        if not bgzf and _is_gzip(path):
+            raise InvalidInput("%s: gzip files cannot be indexed, compress "
+                               "with bgzip instead" % path)
+        stat = os.stat(path)
+        scanner = _Scanner(fmt, step, max_entries)
+        if stat.st_size:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    if bgzf:
+                        for coffset, block in _bgzf_blocks(data):
+                            scanner.feed(block, coffset << 16)
+                    else:
+                        for start in xrange(0, stat.st_size, SCAN_BLOCK):
+                            scanner.feed(data[start:start + SCAN_BLOCK], None)
+                finally:
+                    data.close()
+        logger.info("%s: indexed %d records", path, scanner.records)
+        return cls(path, fmt, scanner.step, bgzf, scanner.records,
+                   scanner.length, scanner.entries, stat.st_size,
+                   stat.st_mtime)
+
+    @classmethod
+    def load(cls, path, step=None, fmt=None, cache=True):
+        """Return the cached index of path, building and caching it if it is
+        missing, older than the file or, if step is given, of another step.
+
+        """
+        stat = os.stat(path)
+        try:
+            with open(index_path(path)) as f:
+                saved = json.load(f)
+            if (saved['version'] == INDEX_VERSION and
+                    saved['size'] == stat.st_size and
+                    saved['mtime'] == stat.st_mtime and
+                    step in (None, saved['step'])):
+                return cls(path, saved['format'], saved['step'],
+                           saved['bgzf'], saved['records'], saved['length'],
+                           [tuple(e) for e in saved['entries']],
+                           saved['size'], saved['mtime'])
+        except (IOError, ValueError, KeyError):
+            pass
+        index = cls.build(path, step or DEFAULT_STEP, fmt)
+        if cache:
+            try:
+                index.save()
+            except (IOError, OSError) as error:
+                logger.warn("%s: could not cache index: %s", path, error)
+        return index
+
+    def save(self):
+        """Write the index next to its file.
+
+        """
+        target = index_path(self.path)
+        with open(target + '.partial', 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'format': self.format,
+                       'step': self.step, 'bgzf': self.bgzf,
+                       'records': self.records, 'length': self.length,
+                       'size': self.size, 'mtime': self.mtime,
+                       'entries': self.entries}, f, separators=(',', ':'))
+        os.rename(target + '.partial', target)
+
+    def ranges(self, chunks):
+        """Split the records into chunks ranges of about equal record count.
+
+        Returns [(offset, length)], with lengths in uncompressed bytes.
+        Chunk boundaries fall on index entries, so with fewer entries than
+        chunks some ranges are empty.  Files with the same number of
+        records, such as the two files of a read pair, split alike.
+
+        """
+        points = [self._entry(k * self.records // chunks)
+                  for k in range(chunks)] + [None]
+        result = []
+        for start, end in zip(points, points[1:]):
+            if start is None:
+                result.append((0, 0))
+            else:
+                stop = self.length if end is None else end[1]
+                result.append((start[0], stop - start[1]))
+        return result
+
+    def _entry(self, record):
+        """Return the first index entry at or after record, None past the
+        last one.
+
+        """
+        i = -(-record // self.step)
+        return self.entries[i] if i < len(self.entries) else None
+
+    def read(self, offset, length, out):
+        """Write length uncompressed bytes from offset to the file out.
+
+        """
+        with open(self.path, 'rb') as f:
+            if not self.bgzf:
+                f.seek(offset)
+                while length > 0:
+                    data = f.read(min(COPY_BLOCK, length))
+                    if not data:
+                        break
+                    out.write(data)
+                    length -= len(data)
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                skip = offset & 0xFFFF
+                for _, block in _bgzf_blocks(buffer(data, offset >> 16)):
+                    block = block[skip:skip + length]
+                    skip = 0
+                    out.write(block)
+                    length -= len(block)
+                    if length <= 0:
+                        break
+            finally:
+                data.close()
+
+
+class _Scanner(object):
+    """_Scanner finds record boundaries in successive blocks of a file.
+
+    FASTQ records are four lines; FASTA records start with '>'.  Blocks are
+    counted with str.count and only searched for the sampled records.
+
+    """
+    def __init__(self, fmt, step, max_entries):
+        """Initialize _Scanner.
+
+        """
+        self.max_entries = max_entries
+        self.fastq = fmt == 'fastq'
+        self.marker = '@' if self.fastq else '>'
+        self.step = step
+        self.entries = []
+        self.records = 0
+        self.length = 0
+        self._lines = 0
+        self._last = '\n'
+
+    def feed(self, data, virtual):
+        """Scan data, the next block; virtual is the virtual offset of its
+        start for BGZF and None for plain files.
+
+        """
+        if not data:
+            return
+        starts = self._fastq(data) if self.fastq else self._fasta(data)
+        count, locate = starts
+        record = -(-self.records // self.step) * self.step
+        while record < self.records + count:
+            position = locate(record - self.records)
+            if data[position] != self.marker:
+                raise InvalidInput("Record %d does not start with %r at byte "
+                                   "%d" % (record, self.marker,
+                                           self.length + position))
+            offset = self.length + position if virtual is None else \
+                virtual + position
+            self.entries.append((offset, self.length + position))
+            if len(self.entries) > self.max_entries:
+                # Keep the entries of every other sampled record
+                del self.entries[1::2]
+                self.step *= 2
+                record = (record // self.step + 1) * self.step
+            else:
+                record += self.step
+        self.records += count
+        self.length += len(data)
+        self._last = data[-1]
+
+    def _fastq(self, data):
+        """Return the number of records starting in data, and a function
+        locating the n-th of them, for ascending n.
+
+        Records start after every fourth newline of the file.
+
+        """
+        before = self._lines
+        lines = data.count('\n')
+        self._lines += lines
+        first = before % 4 == 0 and self._last == '\n'
+        count = int(first) + self._lines // 4 - before // 4
+        if self._lines % 4 == 0 and data[-1] == '\n':
+            # The next record starts in the next block
+            count -= 1
+        return count, self._locate(data, '\n', first,
+                                   lambda n: (before // 4 + 1 + n) * 4 -
+                                   before)
+
+    def _fasta(self, data):
+        """Return the number of records starting in data, and a function
+        locating the n-th of them, for ascending n.
+
+        """
+        first = data[0] == '>' and self._last == '\n'
+        count = int(first) + data.count('\n>')
+        return count, self._locate(data, '\n>', first, lambda n: n + 1)
+
+    @staticmethod
+    def _locate(data, separator, first, target):
+        """Return a function locating the n-th record start of data, which
+        follows the target(n)-th separator, or is at 0 if first.
+
+        The search goes on from the last record located.
+
+        """
+        state = {'seen': 0, 'position': -1}
+
+        def locate(n):
+            if first:
+                if not n:
+                    return 0
+                n -= 1
+            for _ in xrange(target(n) - state['seen']):
+                state['position'] = data.index(separator,
+                                               state['position'] + 1)
+            state['seen'] = target(n)
+            return state['position'] + 1
+        return locate
+
+
+def main(argv):
+    """Build the index of a file or write a range of its records.
+
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m tfpipe.utils.seqindex')
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build')
+    build.add_argument('path')
+    build.add_argument('--step', type=int)
+    read = commands.add_parser('read')
+    read.add_argument('path')
+    read.add_argument('chunk', type=int, nargs='?')
+    read.add_argument('chunks', type=int, nargs='?')
+    read.add_argument('--range', type=int, nargs=2,
+                      metavar=('OFFSET', 'LENGTH'))
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        SeqIndex.load(args.path, args.step)
+        return 0
+    index = SeqIndex.load(args.path)
+    if args.range:
+        offset, length = args.range
+    elif args.chunks and 0 <= args.chunk < args.chunks:
+        offset, length = index.ranges(args.chunks)[args.chunk]
+    else:
+        parser.error("read needs CHUNK CHUNKS or --range OFFSET LENGTH")
+    index.read(offset, length, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))